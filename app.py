@@ -1,21 +1,160 @@
 #!/usr/bin/env python3
 
 from traceback import format_exc
+from contextlib import asynccontextmanager
+from hashlib import sha1
+from ipaddress import IPv4Address, IPv4Network
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from file_utils import *
 from gcp_utils import *
+from session_pool import get_session_pool, close_session_pool
+from parsing import close_parse_pool
+from network_index import NetworkIndex
+from snapshots import REFRESH_INTERVAL, Snapshot, start_background_refresh, stop_background_refresh, get_snapshot
+from snapshots import get_snapshot_metrics
 
 RESPONSE_HEADERS = {
     'Cache-Control': "no-cache, no-store",
     'Pragma': "no-cache"
 }
+SNAPSHOT_HEADERS = {
+    'Cache-Control': "no-cache",  # Clients may keep a copy, but must revalidate it with the ETag
+}
 PLAIN_CONTENT_TYPE = "text/plain"
 
-app = FastAPI()
+
+async def load_subnets() -> list:
+
+    settings = await get_settings()
+    key_file = settings.get('key_file')
+    access_token = await get_access_token(key_file)
+    if host_project_id := settings.get('host_project_id'):
+        subnets = await get_subnets(host_project_id, access_token)
+    else:
+        raise Exception(f"'host_project_id' must be defined to view networks")
+    tasks = [s.get_bindings(access_token) for s in subnets]
+    _ = await gather(*tasks)
+    projects = await get_projects(access_token)
+    for s in subnets:
+        if s.members:
+            s.attached_projects = []
+            for p in projects:
+                if f"serviceAccount:{p.number}-compute@developer.gserviceaccount.com" in s.members:
+                    s.attached_projects.append(p.id)
+    return subnets
+
+
+async def load_service_projects(access_token: str) -> list:
+
+    settings = await get_settings()
+    projects = await get_projects(access_token)
+    if host_project_id := settings.get('host_project_id'):
+        service_projects = await get_service_projects(host_project_id, access_token)
+        projects = [p for p in projects if p.id in service_projects]
+    return projects
+
+
+async def load_gke_clusters() -> list:
+
+    settings = await get_settings()
+    access_token = await get_access_token(settings.get('key_file'))
+    projects = await load_service_projects(access_token)
+    tasks = [p.get_gke_clusters(access_token) for p in projects]
+    _ = await gather(*tasks)
+    gke_clusters = []
+    for p in projects:
+        gke_clusters.extend(p.gke_clusters)
+    return gke_clusters
+
+
+async def get_gke_range_allocations(refresh: bool = False):
+    """
+    Get GKE services range allocations from the subnet and cluster snapshots, updated only when they change
+    """
+    from gke_ranges import get_range_allocations
+
+    subnets = await get_snapshot('subnets', refresh)
+    gke_clusters = await get_snapshot('gke_clusters', refresh)
+    return get_range_allocations(subnets.data, gke_clusters.data, subnets.timestamp, gke_clusters.timestamp)
+
+
+async def load_instance_nics() -> list:
+
+    settings = await get_settings()
+    access_token = await get_access_token(settings.get('key_file'))
+    projects = await load_service_projects(access_token)
+    tasks = [p.get_instances(access_token) for p in projects]
+    _ = await gather(*tasks)
+    instance_nics = []
+    for p in projects:
+        for instance in p.instances:
+            instance_nics.extend(instance.nics)
+    return instance_nics
+
+
+async def load_ip_index():
+
+    from ip_index import main
+
+    settings = await get_settings()
+    _ = await get_access_token(settings.get('key_file'))  # Raise any credential errors here, rather than quit()
+    return await main()
+
+
+async def load_range_index():
+
+    from cidr_overlaps import get_range_index
+
+    settings = await get_settings()
+    _ = await get_access_token(settings.get('key_file'))  # Raise any credential errors here, rather than quit()
+    return await get_range_index()
+
+
+# Datasets that are crawled in the background rather than on each request
+SNAPSHOT_LOADERS = {
+    'subnets': load_subnets,
+    'gke_clusters': load_gke_clusters,
+    'instance_nics': load_instance_nics,
+    'ip_index': load_ip_index,
+    'range_index': load_range_index,
+}
+
+
+def snapshot_response(request: Request, content, snapshot: Snapshot) -> Response:
+    """
+    Return content from a snapshot with an ETag and Last-Modified, or just a 304 if the client's copy is current
+    """
+    response = JSONResponse(content, headers=SNAPSHOT_HEADERS)
+    headers = SNAPSHOT_HEADERS | {
+        'ETag': f'"{sha1(response.body).hexdigest()}"',
+        'Last-Modified': snapshot.last_modified,
+    }
+    if request.headers.get('if-none-match') == headers['ETag']:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return response
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+
+    get_session_pool()  # Open the shared connection pool used by all gcp_utils calls
+    try:
+        settings = await get_settings()
+    except Exception as e:
+        settings = {}
+    start_background_refresh(SNAPSHOT_LOADERS, settings.get('refresh_interval', REFRESH_INTERVAL))
+    yield
+    await stop_background_refresh()
+    await close_session_pool()
+    close_parse_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
@@ -54,7 +193,7 @@ async def _projects():
         key_file = settings.get('key_file')
         access_token = await get_access_token(key_file)
         projects = await get_projects(access_token)
-        return JSONResponse([item.__dict__ for item in projects], headers=RESPONSE_HEADERS)
+        return JSONResponse([item.to_dict() for item in projects], headers=RESPONSE_HEADERS)
     except Exception as e:
         return PlainTextResponse(content=format_exc(), status_code=500)
 
@@ -95,7 +234,7 @@ async def _networks(request: Request):
         if host_project_id := settings.get('host_project_id'):
             _ = await get_networks(host_project_id, access_token)
             networks = await apply_filter(_, settings, dict(request.query_params))
-            return JSONResponse([item.__dict__ for item in networks], headers=RESPONSE_HEADERS)
+            return JSONResponse([item.to_dict() for item in networks], headers=RESPONSE_HEADERS)
         else:
             raise Exception(f"'host_project_id' must be defined to view networks")
     except Exception as e:
@@ -107,28 +246,12 @@ async def _subnets(request: Request):
 
     try:
         settings = await get_settings()
-        key_file = settings.get('key_file')
-        access_token = await get_access_token(key_file)
         options = dict(request.query_params)
-        if host_project_id := settings.get('host_project_id'):
-            regions = [options.get('region')] if 'region' in options else options.get('regions')
-            _ = await get_subnets(host_project_id, access_token, regions=regions)
-            subnets = await apply_filter(_, settings, options)
-        else:
-            raise Exception(f"'host_project_id' must be defined to view networks")
+        snapshot = await get_snapshot('subnets', refresh=options.get('refresh') == "true")
+        subnets = await apply_filter(snapshot.data, settings, options)
         if network_name := options.get('network'):
             subnets = [s for s in subnets if s.network_name == network_name]
-        tasks = [s.get_bindings(access_token) for s in subnets]
-        _ = await gather(*tasks)
-        projects = await get_projects(access_token)
-        for s in subnets:
-            if s.members:
-                s.attached_projects = []
-                for p in projects:
-                    if f"serviceAccount:{p.number}-compute@developer.gserviceaccount.com" in s.members:
-                        s.attached_projects.append(p.id)
-                    #print(s)
-        return JSONResponse([s.__dict__ for s in subnets], headers=RESPONSE_HEADERS)
+        return snapshot_response(request, [s.to_dict() for s in subnets], snapshot)
     except Exception as e:
         return PlainTextResponse(content=format_exc(), status_code=500)
 
@@ -222,19 +345,10 @@ async def _gke_clusters(request: Request):
 
     try:
         settings = await get_settings()
-        key_file = settings.get('key_file')
-        access_token = await get_access_token(key_file)
-        projects = await get_projects(access_token)
-        if host_project_id := settings.get('host_project_id'):
-            service_projects = await get_service_projects(host_project_id, access_token)
-            projects = [p for p in projects if p.id in service_projects]
-        tasks = [p.get_gke_clusters(access_token) for p in projects]
-        _ = await gather(*tasks)
-        gke_clusters = []
-        for p in projects:
-            gke_clusters.extend(p.gke_clusters)
-        _ = await apply_filter(gke_clusters, settings, dict(request.query_params))
-        return JSONResponse([item.__dict__ for item in _], headers=RESPONSE_HEADERS)
+        options = dict(request.query_params)
+        snapshot = await get_snapshot('gke_clusters', refresh=options.get('refresh') == "true")
+        _ = await apply_filter(snapshot.data, settings, options)
+        return snapshot_response(request, [item.to_dict() for item in _], snapshot)
     except Exception as e:
         return PlainTextResponse(content=format_exc(), status_code=500)
 
@@ -242,12 +356,61 @@ async def _gke_clusters(request: Request):
 @app.get("/gke-ranges")
 async def _gke_ranges(request: Request):
 
-    from gke_ranges import main
+    try:
+        options = dict(request.query_params)
+        allocations = await get_gke_range_allocations(refresh=options.get('refresh') == "true")
+        return JSONResponse(allocations.get_range_data(), headers=RESPONSE_HEADERS)
+        #return JSONResponse([item.to_dict() for item in _], headers=RESPONSE_HEADERS)
+    except Exception as e:
+        return PlainTextResponse(content=format_exc(), status_code=500)
+
+
+@app.get("/gke-ranges-plan")
+async def _gke_ranges_plan(request: Request):
 
     try:
-        _ = await main()
+        options = dict(request.query_params)
+        if not (region := options.get('region')):
+            raise Exception(f"'region' must be given, ex: ?region=us-central1&num_clusters=2")
+        num_clusters = int(options.get('num_clusters', 1))
+        allocations = await get_gke_range_allocations(refresh=options.get('refresh') == "true")
+        if not (_ := allocations.plan(region, num_clusters)):
+            return PlainTextResponse(content=f"No subnet in '{region}' has {num_clusters} free services ranges", status_code=404)
+        return JSONResponse(_, headers=RESPONSE_HEADERS)
+    except Exception as e:
+        return PlainTextResponse(content=format_exc(), status_code=500)
+
+
+@app.get("/gke-master-range")
+async def _gke_master_range(request: Request):
+
+    from range_allocator import get_master_range_allocator
+
+    try:
+        options = dict(request.query_params)
+        if not (pool := options.get('pool')):
+            raise Exception(f"'pool' must be given, ex: ?pool=10.0.0.0/16&network=my-host-project/my-vpc")
+        snapshot = await get_snapshot('gke_clusters', refresh=options.get('refresh') == "true")
+        network_key = options.get('network')
+        allocator = get_master_range_allocator(pool, snapshot.data, network_key, snapshot.timestamp)
+        if cidr_range := options.get('release'):
+            # Give back a range that won't be used after all; existing clusters' ranges can't be released
+            if cidr_range not in allocator.allocated:
+                return PlainTextResponse(content=f"'{cidr_range}' is not an allocated range", status_code=404)
+            allocator.release(cidr_range)
+            gke_master_range = cidr_range
+        # Only hold the range for a cluster that's about to be created if asked to, otherwise just show it
+        elif options.get('reserve') == "true":
+            gke_master_range = allocator.allocate(options.get('cluster'))
+        else:
+            gke_master_range = allocator.get_first_free()
+        _ = {
+            'pool': pool,
+            'network_key': network_key,
+            'gke_master_range': gke_master_range,
+            'num_free': allocator.num_free,
+        }
         return JSONResponse(_, headers=RESPONSE_HEADERS)
-        #return JSONResponse([item.__dict__ for item in _], headers=RESPONSE_HEADERS)
     except Exception as e:
         return PlainTextResponse(content=format_exc(), status_code=500)
 
@@ -257,32 +420,69 @@ async def _instances(request: Request):
 
     try:
         settings = await get_settings()
-        key_file = settings.get('key_file')
-        access_token = await get_access_token(key_file)
-        projects = await get_projects(access_token)
-        if host_project_id := settings.get('host_project_id'):
-            service_projects = await get_service_projects(host_project_id, access_token)
-            projects = [p for p in projects if p.id in service_projects]
-        tasks = [p.get_instances(access_token) for p in projects]
-        _ = await gather(*tasks)
-        instances = []
-        for p in projects:
-            instances.extend(p.instances)
-        instance_nics = []
-        for instance in instances:
-            instance_nics.extend(instance.nics)
-        instance_nics = await apply_filter(instance_nics, settings, dict(request.query_params))
-        subnet_keys = [nic.subnet_key for nic in instance_nics]
+        options = dict(request.query_params)
+        snapshot = await get_snapshot('instance_nics', refresh=options.get('refresh') == "true")
+        instance_nics = await apply_filter(snapshot.data, settings, options)
+        instance_nics = NetworkIndex(instance_nics, keys=('subnet_key',))
         used_subnets = {}
-        for sk in subnet_keys:
-            used_subnets[sk] = list(set([nic.project_id for nic in instance_nics if nic.subnet_key == sk]))
-        return JSONResponse(used_subnets, headers=RESPONSE_HEADERS)
-        #return return JSONResponse([item.__dict__ for item in instance_nics]), RESPONSE_HEADERS
+        for nic in instance_nics:
+            sk = nic.subnet_key
+            if sk not in used_subnets:
+                used_subnets[sk] = list(set([_.project_id for _ in instance_nics.get('subnet_key', sk)]))
+        return snapshot_response(request, used_subnets, snapshot)
+        #return return JSONResponse([item.to_dict() for item in instance_nics]), RESPONSE_HEADERS
 
     except Exception as e:
         return PlainTextResponse(content=format_exc(), status_code=500)
 
 
+@app.get("/ip-lookup")
+async def _ip_lookup(request: Request):
+
+    try:
+        options = dict(request.query_params)
+        if not (ip := options.get('ip')):
+            raise Exception(f"'ip' must be given as an IP address or CIDR range, ex: ?ip=10.44.3.17 or ?ip=10.44.0.0/16")
+        try:
+            _ = IPv4Network(ip, strict=False) if '/' in ip else IPv4Address(ip)
+        except ValueError as e:
+            return PlainTextResponse(content=f"Invalid IPv4 address or CIDR range: '{ip}'", status_code=400)
+        snapshot = await get_snapshot('ip_index', refresh=options.get('refresh') == "true")
+        return snapshot_response(request, snapshot.data.query(ip), snapshot)
+    except Exception as e:
+        return PlainTextResponse(content=format_exc(), status_code=500)
+
+
+@app.get("/cidr-overlaps")
+async def _cidr_overlaps():
+
+    from cidr_overlaps import main
+
+    try:
+        _ = await main()
+        return JSONResponse(content=_, headers=RESPONSE_HEADERS)
+    except Exception as e:
+        return PlainTextResponse(content=format_exc(), status_code=500)
+
+
+@app.get("/cidr-check")
+async def _cidr_check(request: Request):
+
+    try:
+        options = dict(request.query_params)
+        if not (cidr_range := options.get('cidr')):
+            raise Exception(f"'cidr' must be given, ex: ?cidr=10.44.0.0/20&network=my-host-project/my-vpc")
+        snapshot = await get_snapshot('range_index', refresh=options.get('refresh') == "true")
+        _ = {
+            'cidr_range': cidr_range,
+            'network_key': options.get('network'),
+            'conflicts': snapshot.data.check(cidr_range, options.get('network')),
+        }
+        return snapshot_response(request, _, snapshot)
+    except Exception as e:
+        return PlainTextResponse(content=format_exc(), status_code=500)
+
+
 @app.get("/recent-firewall-rules")
 async def _recent_firewall_rules():
 
@@ -295,6 +495,24 @@ async def _recent_firewall_rules():
         return PlainTextResponse(content=format_exc(), status_code=500)
 
 
+@app.get("/fetch-metrics")
+async def _fetch_metrics():
+
+    from fetch_scheduler import get_scheduler
+
+    try:
+        scheduler = get_scheduler()
+        _ = scheduler.get_metrics()
+        _.update({
+            'connections': get_session_pool().get_metrics(),
+            'failed_urls': scheduler.errors,
+            'snapshots': get_snapshot_metrics(),
+        })
+        return JSONResponse(content=_, headers=RESPONSE_HEADERS)
+    except Exception as e:
+        return PlainTextResponse(content=format_exc(), status_code=500)
+
+
 @app.get("/", response_class=HTMLResponse)
 async def _root(request: Request):
 
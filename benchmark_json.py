@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import json
+from time import perf_counter
+from json_codec import msgspec, orjson, get_typed_loads
+
+ITERATIONS = 20
+NUM_INSTANCES = 500  # Per synthetic page, the max page size for aggregated/instances
+
+
+def make_aggregated_instances(project_id: str = "my-project", num_instances: int = NUM_INSTANCES) -> bytes:
+    """
+    Make a page shaped like an aggregated/instances response, for when there's no recorded one to hand
+    """
+    base_url = f"https://www.googleapis.com/compute/v1/projects/{project_id}"
+    zones = ("us-central1-a", "us-central1-b", "us-east4-a", "europe-west1-b")
+    items = {f"zones/{zone}": {'instances': []} for zone in zones}
+    for i in range(num_instances):
+        zone = zones[i % len(zones)]
+        name = f"instance-{i:05}"
+        items[f"zones/{zone}"]['instances'].append({
+            'kind': "compute#instance",
+            'id': str(4000000000000000000 + i),
+            'creationTimestamp': "2024-05-01T10:11:12.345-07:00",
+            'name': name,
+            'tags': {'items': ["allow-ssh", "allow-health-checks"], 'fingerprint': "6smc4R4d39I="},
+            'machineType': f"{base_url}/zones/{zone}/machineTypes/e2-standard-4",
+            'status': "RUNNING",
+            'zone': f"{base_url}/zones/{zone}",
+            'canIpForward': False,
+            'networkInterfaces': [{
+                'kind': "compute#networkInterface",
+                'network': f"{base_url}/global/networks/default",
+                'subnetwork': f"{base_url}/regions/{zone[:-2]}/subnetworks/default",
+                'networkIP': f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+                'name': "nic0",
+                'fingerprint': "xQ0Rv8Hu0Yc=",
+                'stackType': "IPV4_ONLY",
+            }],
+            'disks': [{
+                'kind': "compute#attachedDisk",
+                'type': "PERSISTENT",
+                'mode': "READ_WRITE",
+                'source': f"{base_url}/zones/{zone}/disks/{name}",
+                'deviceName': "persistent-disk-0",
+                'index': 0,
+                'boot': True,
+                'autoDelete': True,
+                'licenses': ["https://www.googleapis.com/compute/v1/projects/debian-cloud/global/licenses/debian-12-bookworm"],
+                'interface': "SCSI",
+                'guestOsFeatures': [{'type': _} for _ in ("UEFI_COMPATIBLE", "VIRTIO_SCSI_MULTIQUEUE", "GVNIC")],
+                'diskSizeGb': "20",
+                'architecture': "X86_64",
+            }],
+            'metadata': {
+                'kind': "compute#metadata",
+                'fingerprint': "n9S5l-7BnDo=",
+                'items': [{'key': "startup-script", 'value': "#!/bin/bash\napt-get update\n" * 20}],
+            },
+            'serviceAccounts': [{
+                'email': f"123456789-compute@developer.gserviceaccount.com",
+                'scopes': ["https://www.googleapis.com/auth/cloud-platform"],
+            }],
+            'selfLink': f"{base_url}/zones/{zone}/instances/{name}",
+            'scheduling': {'onHostMaintenance': "MIGRATE", 'automaticRestart': True, 'preemptible': False},
+            'cpuPlatform': "Intel Broadwell",
+            'labels': {'env': "prod", 'team': "network"},
+            'labelFingerprint': "42WmSpB8rSM=",
+            'startRestricted': False,
+            'deletionProtection': False,
+            'shieldedInstanceConfig': {'enableSecureBoot': False, 'enableVtpm': True, 'enableIntegrityMonitoring': True},
+            'fingerprint': "0nGmZ9kBnWc=",
+            'lastStartTimestamp': "2024-05-01T10:11:40.123-07:00",
+        })
+    return json.dumps({'kind': "compute#instanceAggregatedList", 'items': items, 'nextPageToken': "abc"}).encode()
+
+
+def get_decoders() -> dict:
+
+    decoders = {'json': json.loads}
+    if orjson:
+        decoders['orjson'] = orjson.loads
+    if msgspec:
+        decoders['msgspec'] = msgspec.json.Decoder().decode
+        decoders['msgspec (typed)'] = get_typed_loads("items", "instances", is_aggregated=True)
+    return decoders
+
+
+def main(payloads: dict) -> list:
+
+    results = []
+    for payload_name, payload in payloads.items():
+        size = len(payload) / 1024 / 1024
+        for name, decode in get_decoders().items():
+            start = perf_counter()
+            for _ in range(ITERATIONS):
+                decode(payload)
+            seconds = (perf_counter() - start) / ITERATIONS
+            results.append({
+                'payload': payload_name,
+                'decoder': name,
+                'size_mb': round(size, 2),
+                'ms_per_page': round(seconds * 1000, 2),
+                'mb_per_second': round(size / seconds),
+            })
+    return results
+
+
+if __name__ == "__main__":
+
+    from sys import argv
+
+    # Recorded aggregated/instances responses can be given as file names, otherwise use a synthetic page
+    if files := argv[1:]:
+        payloads = {}
+        for file in files:
+            with open(file, 'rb') as fp:
+                payloads[file] = fp.read()
+    else:
+        payloads = {'synthetic aggregated/instances': make_aggregated_instances()}
+    for row in main(payloads):
+        print(row)
@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 
-from asyncio import run, gather
+from asyncio import run
 from collections import Counter
-from aiohttp import ClientSession
-from file_utils import get_settings, write_to_excel, get_calls
-from gcp_utils import get_access_token, get_projects, get_api_data
-from gcp_classes import *
+from file_utils import write_to_excel
+from network_index import NetworkIndex
+from subnet_usage import get_address_arrays, get_subnet_usage
 
 CALLS = ('vpc_networks', 'firewall_rules', 'subnetworks', 'instances', 'forwarding_rules', 'cloud_routers')
+API_FIELDS = {
+    'instances': ['name', 'zone', 'selfLink', 'networkInterfaces(name,networkIP,network,subnetwork)'],
+    'forwarding_rules': ['name', 'region', 'selfLink', 'IPAddress', 'loadBalancingScheme', 'network', 'subnetwork'],
+    'firewall_rules': ['name', 'selfLink', 'network'],
+}
 XLSX_FILE = "network_quotas.xlsx"
 
 
@@ -16,16 +20,10 @@ def sort_data(data: list, key: str, reverse: bool = True) -> list:
     return sorted(data, key=lambda _: _[key], reverse=reverse)
 
 
-async def main():
-
-    try:
-        settings = await get_settings()
-        access_token = await get_access_token(settings.get('key_file'))
-    except Exception as e:
-        quit(e)
-
-    projects = await get_projects(access_token)
-
+async def get_report(projects: list, network_data: dict, access_token: str = None, refresh: bool = False) -> dict:
+    """
+    Count everything relevant to quotas, given objects for each resource type in CALLS
+    """
     sheets = {
         'projects': {'description': "Project Counts"},
         'networks': {'description': "Network Counts"},
@@ -33,54 +31,26 @@ async def main():
         'cloud_nats': {'description': "Cloud NAT Counts"},
     }
 
-    # Form a dictionary of relevant API Calls
-    _ = await get_calls()
-    calls = {k: v.get('calls')[0] for k, v in _.items() if k in CALLS}
-
-    # Get all network data
-    raw_data = {}
-    session = ClientSession(raise_for_status=False)
-    for k, call in calls.items():
-        # Perform API calls
-        urls = [f"/compute/v1/projects/{project.id}/{call}" for project in projects]
-        tasks = [get_api_data(session, url, access_token) for url in urls]
-        results = await gather(*tasks)
-        results = dict(zip(urls, results))
-        items = []
-        for url, data in results.items():
-            if len(data) > 0:
-                _ = [item for item in data]
-                items.extend(_)
-        raw_data[k] = items
-    await session.close()
-
-    # Create Lists of objects for any resource that could be relevant to a quota count
+    # Anything that gets counted is indexed, so each count is a lookup rather than a scan
     network_data = {
-        'instances': [Instance(_) for _ in raw_data.pop('instances')],
-        'vpc_networks': [Network(_) for _ in raw_data.pop('vpc_networks')],
-        'subnets': [Subnet(_) for _ in raw_data.pop('subnetworks')],
-        'forwarding_rules': [ForwardingRule(_) for _ in raw_data.pop('forwarding_rules')],
-        'cloud_routers': [CloudRouter(_) for _ in raw_data.pop('cloud_routers')],
-        'firewall_rules': [FirewallRule(_) for _ in raw_data.pop('firewall_rules')],
+        'vpc_networks': network_data['vpc_networks'],
+        'subnets': network_data['subnetworks'],
+        'forwarding_rules': NetworkIndex(network_data['forwarding_rules']),
+        'cloud_routers': NetworkIndex(network_data['cloud_routers']),
+        'firewall_rules': NetworkIndex(network_data['firewall_rules']),
+        'instance_nics': NetworkIndex(nic for instance in network_data['instances'] for nic in instance.nics),
     }
-    del raw_data
-
-    # Use the instances list to form list of all instance NICs
-    _ = []
-    for instance in network_data['instances']:
-        _.extend(instance.nics)
-    network_data['instance_nics'] = _
-    del network_data['instances']
+    internal_forwarding_rules = network_data['forwarding_rules'].filter(lambda _: _.is_internal)
 
     network_counts = []
     for vpc_network in network_data['vpc_networks']:
         network_key = vpc_network.key
         counts = {
             'peerings': vpc_network.peerings,
-            'instances': [_ for _ in network_data['instance_nics'] if _.network_key == network_key],
-            'forwarding_rules': [_ for _ in network_data['forwarding_rules'] if _.network_key == network_key and _.is_internal],
-            'firewall_rules': [_ for _ in network_data['firewall_rules'] if _.network_key == network_key],
-            'cloud_routers':  [_ for _ in network_data['cloud_routers'] if _.network_key == network_key],
+            'instances': network_data['instance_nics'].get('network_key', network_key),
+            'forwarding_rules': internal_forwarding_rules.get('network_key', network_key),
+            'firewall_rules': network_data['firewall_rules'].get('network_key', network_key),
+            'cloud_routers': network_data['cloud_routers'].get('network_key', network_key),
         }
         application_ilbs = [_ for _ in counts['forwarding_rules'] if _.is_internal and _.is_managed]
         passthrough_ilbs = [_ for _ in counts['forwarding_rules'] if _.is_internal and not _.is_managed]
@@ -97,54 +67,52 @@ async def main():
         })
     sheets['networks']['data'] = sort_data(network_counts, 'num_instances')
 
+    # Bucket all NIC and forwarding rule IPs into subnet ranges in one pass, rather than looking up each subnet
+    subnets = [_ for _ in network_data['subnets'] if not (_.is_psc or _.is_proxy_only)]
+    usage = get_subnet_usage(
+        subnets,
+        get_address_arrays(network_data['instance_nics']),
+        get_address_arrays(network_data['forwarding_rules']),
+    )
     subnet_counts = []
-    for subnet in network_data['subnets']:
-        if subnet.is_psc or subnet.is_proxy_only:
-            continue
-        subnet_key = subnet.key
-        counts = {
-            'instances': [_ for _ in network_data['instance_nics'] if _.subnet_key == subnet_key],
-            'forwarding_rules': [_ for _ in network_data['forwarding_rules'] if _.subnet_key == subnet_key],
-        }
-        active_ips = len(counts['instances']) + len(counts['forwarding_rules'])
+    for subnet in subnets:
+        _ = usage[subnet.key]
+        num_instances, num_forwarding_rules = _['used_ips']
         subnet_counts.append({
             'name': subnet.name,
             'network_name': subnet.network_name,
             'region': subnet.region,
             'cidr_range': subnet.cidr_range,
             'usable_ips': subnet.usable_ips,
-            'num_instances': len(counts['instances']),
-            'num_forwarding_rules': len(counts['forwarding_rules']),
-            'utilization': round(active_ips / subnet.usable_ips * 100),
+            'num_instances': num_instances,
+            'num_forwarding_rules': num_forwarding_rules,
+            'utilization': round((num_instances + num_forwarding_rules) / subnet.usable_ips * 100),
+            'largest_free_block': _['largest_free_block'],
+            'fragmentation': _['fragmentation'],
         })
     sheets['subnets']['data'] = sort_data(subnet_counts, 'num_instances')
 
     project_counts = []
+    networks_by_project = Counter(_['project_id'] for _ in network_counts)
     for project in projects:
         project_id = project.id
-        counts = {
-            'networks': [_ for _ in network_counts if _['project_id'] == project_id],
-            'firewall_rules': [_ for _ in network_data['firewall_rules'] if _.project_id == project_id],
-            'cloud_routers': [_ for _ in network_data['cloud_routers'] if _.project_id == project_id],
-        }
         project_counts.append({
             'id': project_id,
             'number': project.number,
             'creation': project.creation,
             'state': project.state,
-            'num_vpc_networks': len(counts['networks']),
-            'num_firewall_rules': len(counts['firewall_rules']),
-            'num_cloud_routers': len(counts['cloud_routers']),
+            'num_vpc_networks': networks_by_project[project_id],
+            'num_firewall_rules': network_data['firewall_rules'].count('project_id', project_id),
+            'num_cloud_routers': network_data['cloud_routers'].count('project_id', project_id),
         })
     sheets['projects']['data'] = sort_data(project_counts, 'num_vpc_networks')
 
     cloud_nat_counts = []
-    for network in network_counts:
-        network_key = network['key']
-        _ = Counter([nic.region for nic in network_data['instance_nics'] if nic.network_key == network_key])
-        for region, instance_count in _.items():
+    network_keys = set(network['key'] for network in network_counts)
+    for (network_key, region), instance_count in network_data['instance_nics'].group_by('network_key', 'region').items():
+        if network_key in network_keys:
             cloud_nat_counts.append({
-                'network_key': network['key'],
+                'network_key': network_key,
                 'region': region,
                 'num_instances': instance_count,
             })
@@ -155,7 +123,17 @@ async def main():
 
     return sheets
 
+
+async def main(refresh: bool = False):
+
+    from reports import run_reports
+
+    _ = await run_reports(['check_quotas'], refresh)
+    return _['check_quotas']
+
 if __name__ == "__main__":
 
-    _ = run(main())
+    from sys import argv
+
+    _ = run(main(refresh='--refresh' in argv))
     #print(_)
@@ -1,63 +1,25 @@
 #!/usr/bin/env python3
 
 from asyncio import run, gather
-from aiohttp import ClientSession
 from file_utils import get_settings, write_to_excel, get_calls
-from gcp_utils import get_access_token, get_projects, get_api_data
+from gcp_utils import get_access_token, get_projects, get_api_data, has_api_enabled
+from session_pool import get_session
+from inventory_cache import get_inventory, get_enabled_services
 from gcp_classes import ForwardingRule, TargetProxy, SSLCert
-from itertools import chain
+from parsing import parse_items
 
 
-async def get_forwarding_rules(project_id: str, access_token: str) -> list:
+def get_planned_urls(project_id: str, collection: str, regions: list) -> list:
+    """
+    Get the urls to list a compute collection in a project's global scope and a list of regions,
+    using a single aggregated call instead whenever that would be fewer requests
+    """
+    urls = [f"/compute/v1/projects/{project_id}/global/{collection}"]
+    urls.extend([f"/compute/v1/projects/{project_id}/regions/{region}/{collection}" for region in regions])
+    if len(urls) > 1:
+        return [f"/compute/v1/projects/{project_id}/aggregated/{collection}"]
+    return urls
 
-    results = []
-    session = ClientSession(raise_for_status=False)
-
-    try:
-        # use aggregated call since it's the fastest
-        url = f"/compute/v1/projects/{project_id}/aggregated/forwardingRules"
-        _ = await get_api_data(session, url, access_token)
-        results.extend(_)
-    except Exception as e:
-        raise RuntimeError(f"Error getting Forwarding Rules: {e}")
-
-    await session.close()
-    #return [item for items in results for item in items]  # Flatten results
-    return list(chain(*results))
-
-
-async def get_target_https_proxies(project_id: str, access_token: str, regions: list = []) -> list:
-
-    results = []
-    session = ClientSession(raise_for_status=False)
-    try:
-        urls = [f"/compute/v1/projects/{project_id}/global/targetHttpsProxies"]   # Global
-        urls.extend([f"/compute/v1/projects/{project_id}/regions/{region}/targetHttpsProxies" for region in regions])
-        tasks = [get_api_data(session, url, access_token) for url in urls]
-        results.extend(await gather(*tasks))
-    except Exception as e:
-        raise RuntimeError(f"Error getting Target HTTPS Proxies: {e}")
-
-    await session.close()
-    #return [item for items in results for item in items]  # Flatten results
-    return list(chain(*results))
-
-async def get_ssl_certs(project_id: str, access_token: str, name: str, regions: list = []) -> list:
-
-    results = []
-    session = ClientSession(raise_for_status=False)
-    try:
-        urls = [f"/compute/v1/projects/{project_id}/global/sslCertificates"]
-        for region in regions:
-            urls.append(f"/compute/v1/projects/{project_id}/regions/{region}/sslCertificates")
-        tasks = [get_api_data(session, url, access_token) for url in urls]
-        results.extend(await gather(*tasks))
-    except Exception as e:
-        raise RuntimeError(f"Error getting SSL Certs: {e}")
-
-    await session.close()
-    #return [item for items in results for item in items]  # Flatten results
-    return list(chain(*results))
 
 async def main() -> list:
 
@@ -74,7 +36,7 @@ async def main() -> list:
     print("Getting Google ADCs...")
     access_token = await get_access_token(settings.get('key_file'))
 
-    session = ClientSession(raise_for_status=False)
+    session = get_session()
 
     print("Getting Projects...")
     projects = await get_projects(access_token)
@@ -83,59 +45,39 @@ async def main() -> list:
     calls = await get_calls()
 
     print("Getting forwarding rules for", len(project_ids), "Projects...")
-    call = calls.get('forwarding_rules')['calls'][0]
-    urls = [f"/compute/v1/projects/{project_id}/{call}" for project_id in project_ids]
-    #tasks = [make_api_call(url, access_token) for url in urls]
-    tasks = [get_api_data(session, url, access_token) for url in urls]
-    results = await gather(*tasks)
+    call = calls.get('forwarding_rules')
+    enabled_services = await get_enabled_services(session, access_token, project_ids)
+    project_ids = [project_id for project_id in project_ids if has_api_enabled(project_id, call, enabled_services)]
+    results = await get_inventory(session, access_token, project_ids, 'forwarding_rules', call)
 
-    forwarding_rules = [ForwardingRule(item) for items in results for item in items]
+    forwarding_rules = [ForwardingRule(item) for items in results.values() for item in items]
     # Filter to rules that reference an HTTPS Target proxy
     forwarding_rules = [rule for rule in forwarding_rules if 'targetHttpsProxies' in rule.target]
     print("Discovered", len(forwarding_rules), "HTTPS Forwarding Rules")
 
-    # Get a list of active regions for each project to limit the scope of further API calls
-    regions_by_project = {project_id: [] for project_id in project_ids}
+    # Certs can only be active in projects with HTTPS forwarding rules, so only look in those projects,
+    # and only in the regions that have them
+    regions_by_project = {}
     for item in forwarding_rules:
-        if item.region == "global":
-            continue
-        project_id = item.project_id
-        region = item.region
-        regions = regions_by_project.get(project_id, [])
-        if region not in regions:
-            regions.append(region)
-            regions_by_project.update({project_id: regions})
-    #print(regions_by_project)
-    #quit()
-
-    print("Getting SSL Certificate for", len(project_ids), "Projects...")
-    tasks = [get_ssl_certs(project_id, access_token, regions_by_project[project_id]) for project_id in project_ids]
-    results = await gather(*tasks)
-    ssl_certs = [SSLCert(item) for items in results for item in items]
-    
-    urls = [f"/compute/v1/projects/{project_id}/global/sslCertificates" for project_id in project_ids]
-    for project_id in project_ids:
-        for region in regions_by_project[project_id]:
-            urls.append(f"/compute/v1/projects/{project_id}/regions/{region}/sslCertificates")
-    print(urls)
-    tasks = [get_api_data(session, url, access_token) for url in urls]
-    #results.extend(await gather(*tasks))
+        regions = regions_by_project.setdefault(item.project_id, [])
+        if item.region != "global" and item.region not in regions:
+            regions.append(item.region)
+
+    urls = {'sslCertificates': [], 'targetHttpsProxies': []}
+    for project_id, regions in regions_by_project.items():
+        for collection in urls.keys():
+            urls[collection].extend(get_planned_urls(project_id, collection, regions))
+
+    print("Getting SSL Certificates and Target HTTPS proxies for", len(regions_by_project), "Projects...")
+    tasks = [get_api_data(session, url, access_token) for url in urls['sslCertificates']]
+    fields = ['name', 'region', 'selfLink', 'sslCertificates']
+    tasks.extend([get_api_data(session, url, access_token, fields=fields) for url in urls['targetHttpsProxies']])
     results = await gather(*tasks)
-    ssl_certs = [SSLCert(item) for items in results for item in items]
-    #    return [item for items in results for item in items]  # Flatten results
-
+    num_ssl_cert_urls = len(urls['sslCertificates'])
+    ssl_certs = await parse_items(SSLCert, [item for items in results[:num_ssl_cert_urls] for item in items])
     print("Discovered", len(ssl_certs), "SSL Certificates")
-
-    print(f"Getting Target HTTPS proxies for {len(project_ids)} Projects...")
-    urls = [f"/compute/v1/projects/{project_id}/global/targetHttpsProxies" for project_id in project_ids]
-    for project_id in project_ids:
-        for region in regions_by_project[project_id]:
-            urls.append(f"/compute/v1/projects/{project_id}/regions/{region}/targetHttpsProxies")
-    tasks = [get_api_data(session, url, access_token) for url in urls]
-    results = await gather(*tasks)
-    target_proxies = [TargetProxy(item) for items in results for item in items]
+    target_proxies = [TargetProxy(item) for items in results[num_ssl_cert_urls:] for item in items]
     print("Discovered", len(target_proxies), "HTTPS Target proxies...")
-    await session.close()
 
     print("Matching SSL Certificates to Target Proxies...")
     active_certs = {}
@@ -157,7 +99,7 @@ async def main() -> list:
 
     # Sort so ones expiring soonest are first in the list
     certs_to_update = sorted(certs_to_update, key=lambda x: x.expire_timestamp, reverse=False)
-    return [_.__dict__ for _ in certs_to_update]
+    return [_.to_dict() for _ in certs_to_update]
 
 if __name__ == "__main__":
 
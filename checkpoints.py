@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 from asyncio import run, gather
-from aiohttp import ClientSession
+from session_pool import get_session, close_session_pool
 from file_utils import get_environments, get_calls
 from gcp_utils import get_api_data, get_access_token
 
@@ -18,7 +18,7 @@ async def main():
     calls = await get_calls()
     print("Calls for disks:", calls.get('disks'))
 
-    session = ClientSession(raise_for_status=False)
+    session = get_session()
     tasks = []
     for e, environment in environments.items():
         if not (project := environment.get('network_project')):
@@ -35,7 +35,7 @@ async def main():
 
     raw_data = await gather(*tasks)
     print(raw_data)
-    await session.close()
+    await close_session_pool()
 
 
     checkpoints = []
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+from asyncio import run
+from heapq import heappush, heappop
+from ip_index import IPIndex
+from subnet_usage import get_range_bounds
+
+CALLS = ('vpc_networks', 'subnetworks', 'gke_clusters', 'global_addresses')
+API_FIELDS = {
+    'global_addresses': ['name', 'selfLink', 'address', 'prefixLength', 'addressType', 'purpose', 'network'],
+}
+RANGE_FIELDS = ('name', 'project_id', 'region', 'network_key')
+XLSX_FILE = "cidr_overlaps.xlsx"
+
+
+def get_ranges(network_data: dict) -> list:
+    """
+    Get every IPv4 range that's routed in a network: subnet primary and secondary ranges, GKE master ranges,
+    and Private Services Access (PSA) allocations, which are the reservedPeeringRanges of each PSA connection
+    """
+    ranges = []
+    for subnet in network_data['subnetworks']:
+        _ = {k: getattr(subnet, k) for k in RANGE_FIELDS}
+        if subnet.cidr_range:
+            ranges.append(_ | {'cidr_range': subnet.cidr_range, 'type': "Subnet"})
+        for secondary_range in subnet.secondary_ranges:
+            ranges.append(_ | {
+                'cidr_range': secondary_range['range'],
+                'type': "Subnet Secondary Range",
+                'name': f"{subnet.name}/{secondary_range['name']}",
+            })
+    for gke_cluster in network_data['gke_clusters']:
+        if gke_cluster.master_range:
+            _ = {k: getattr(gke_cluster, k) for k in RANGE_FIELDS}
+            ranges.append(_ | {'cidr_range': gke_cluster.master_range, 'type': "GKE Master Range"})
+    for address in network_data['global_addresses']:
+        if address.purpose == "VPC_PEERING" and address.cidr_range:
+            _ = {k: getattr(address, k) for k in RANGE_FIELDS}
+            ranges.append(_ | {'cidr_range': address.cidr_range, 'type': "PSA Range"})
+    return [_ for _ in ranges if _['network_key'] and ":" not in _['cidr_range']]
+
+
+def get_peerings(networks: list) -> dict:
+    """
+    Get the keys of directly peered networks, by network key
+    """
+    peerings = {}
+    for network in networks:
+        _ = [peering['network'].split('/') for peering in network.peerings if peering.get('network')]
+        peerings[network.key] = {f"{peer[-4]}/{peer[-1]}" for peer in _}
+    return peerings
+
+
+def find_overlaps(ranges: list, peerings: dict) -> list:
+    """
+    Find every pair of overlapping ranges that can route to each other, i.e. in the same network or in directly
+    peered networks.  Each network's ranges and those of its peers are swept once in order of first IP, with a
+    heap of the ranges still open, so it's O(n log n) plus the number of overlaps rather than pairwise
+    """
+    ranges_by_network = {}
+    for _ in ranges:
+        ranges_by_network.setdefault(_['network_key'], []).append(_)
+
+    overlaps = {}
+    for network_key, network_ranges in ranges_by_network.items():
+        # Peering isn't transitive, so only pairs with at least one range in this network count
+        peer_ranges = [_ for peer in peerings.get(network_key, ()) for _ in ranges_by_network.get(peer, ())]
+        candidates = network_ranges + peer_ranges
+        bounds = [get_range_bounds(_['cidr_range']) for _ in candidates]
+        is_local = [True] * len(network_ranges) + [False] * len(peer_ranges)
+        open_ranges = []
+        for i in sorted(range(len(candidates)), key=lambda i: (bounds[i][0], -bounds[i][1])):
+            first, last = bounds[i]
+            while open_ranges and open_ranges[0][0] < first:
+                heappop(open_ranges)
+            for _, j in open_ranges:
+                if is_local[i] or is_local[j]:
+                    # Pairs between peers are found from both sides, so key by both ranges' identity
+                    overlaps[frozenset((id(candidates[i]), id(candidates[j])))] = (candidates[j], candidates[i])
+            heappush(open_ranges, (last, i))
+
+    return [
+        {k: a[k] for k in ('network_key', 'project_id', 'region', 'type', 'name', 'cidr_range')} | {
+            'overlaps_network_key': b['network_key'],
+            'overlaps_project_id': b['project_id'],
+            'overlaps_type': b['type'],
+            'overlaps_name': b['name'],
+            'overlaps_cidr_range': b['cidr_range'],
+            'is_peered': a['network_key'] != b['network_key'],
+        } for a, b in overlaps.values()
+    ]
+
+
+class RangeIndex:
+    """
+    Every range in use, for checking a new range against the ranges reachable from its network before creating it
+    """
+    def __init__(self, ranges: list, peerings: dict):
+
+        self.peerings = peerings
+        self.ip_index = IPIndex()
+        for _ in ranges:
+            self.ip_index.add_network(_['cidr_range'], _)
+
+    def __len__(self):
+        return len(self.ip_index)
+
+    def check(self, cidr_range: str, network_key: str = None) -> list:
+        """
+        Get ranges that overlap a CIDR range; if a network key is given, only those in it or its peers
+        """
+        _ = self.ip_index.search(cidr_range)
+        conflicts = _['covering_networks'] + _['networks']
+        if network_key:
+            network_keys = {network_key} | self.peerings.get(network_key, set())
+            conflicts = [_ for _ in conflicts if _['network_key'] in network_keys]
+        return conflicts
+
+
+async def get_report(projects: list, network_data: dict, access_token: str = None, refresh: bool = False) -> list:
+    """
+    Find overlapping ranges across all networks and their peerings, given objects for each resource type in CALLS
+    """
+    ranges = get_ranges(network_data)
+    print("Checking", len(ranges), "ranges for overlaps...")
+    overlaps = find_overlaps(ranges, get_peerings(network_data['vpc_networks']))
+    print("Found", len(overlaps), "overlapping ranges")
+    return sorted(overlaps, key=lambda x: (x['network_key'], x['cidr_range']))
+
+
+async def get_range_index(refresh: bool = False) -> RangeIndex:
+
+    from reports import get_network_data
+
+    _, network_data, _ = await get_network_data(['cidr_overlaps'], refresh)
+    return RangeIndex(get_ranges(network_data), get_peerings(network_data['vpc_networks']))
+
+
+async def main(refresh: bool = False):
+
+    from reports import run_reports
+
+    _ = await run_reports(['cidr_overlaps'], refresh)
+    return _['cidr_overlaps']
+
+
+if __name__ == "__main__":
+
+    from sys import argv
+    from pprint import pprint
+
+    # Given a CIDR range (and optionally a network key), check it; otherwise report all overlaps
+    if _ := [arg for arg in argv[1:] if not arg.startswith('--')]:
+        range_index = run(get_range_index(refresh='--refresh' in argv))
+        pprint(range_index.check(*_[:2]))
+    else:
+        from file_utils import write_to_excel
+        _ = run(main(refresh='--refresh' in argv))
+        run(write_to_excel({'cidr_overlaps': {'data': _}}, XLSX_FILE))
@@ -2,7 +2,7 @@
 
 from os import environ
 from asyncio import run, gather
-from aiohttp import ClientSession
+from session_pool import get_session, close_session_pool
 from itertools import chain
 from file_utils import get_settings
 from gcp_utils import get_access_token, get_projects, get_api_data
@@ -24,7 +24,7 @@ async def main():
         project_ids = [p.id for p in projects]
 
     policies = []
-    session = ClientSession(raise_for_status=False)
+    session = get_session()
     try:
         urls = [f"/compute/v1/projects/{p}/global/securityPolicies" for p in project_ids]
         tasks = [get_api_data(session, url, access_token) for url in urls]
@@ -35,7 +35,7 @@ async def main():
             policies.append(_)
     except Exception as e:
         raise RuntimeError(e)
-    await session.close()
+    await close_session_pool()
     return policies
 
 
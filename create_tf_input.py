@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 from asyncio import run
-from aiohttp import ClientSession
+from session_pool import get_session, close_session_pool
 from gcp_utils import get_access_token, get_api_data
 
 
@@ -42,10 +42,10 @@ async def main(module, resource, project_id, network):
         quit(e)
 
     # Make API Call
-    session = ClientSession()
+    session = get_session()
     url = f"/compute/v1/projects/{project_id}/aggregated/routers"
     results = await get_api_data(session, url, access_token)
-    await session.close()
+    await close_session_pool()
 
     # Filter for specific network
     items = [item for item in results.get('items', []) if item.get('network').endswith(network)]
@@ -1,66 +1,47 @@
 #!/usr/bin/env python3
 
-from asyncio import run, gather
-from aiohttp import ClientSession
-from file_utils import get_settings, write_to_excel, get_calls
-from gcp_utils import get_access_token, get_projects, get_api_data
-from gcp_classes import *
-
+from asyncio import run
+from file_utils import write_to_excel, get_calls
+from gcp_classes import Instance
 
+CALLS = None  # Everything in the calls file
 XLXS_FILE = "gcp_network_data.xlsx"
+FIELDS = ('name', 'description', 'kind', 'region', 'zone', 'creation_timestamp', 'creation', 'self_link', 'id',
+          'project_id', 'key', 'network_project_id', 'network_key', 'network_name', 'subnet_key', 'subnet_name')
 
 
-async def main():
-
-    try:
-        settings = await get_settings()
-        access_token = await get_access_token(settings.get('key_file'))
-    except Exception as e:
-        quit(e)
-
-    # Get projects and create first sheet
-    projects = await get_projects(access_token, sort_by='create_timestamp')
+async def get_report(projects: list, network_data: dict, access_token: str = None, refresh: bool = False) -> dict:
+    """
+    Dump the common fields of every resource type to a workbook, one sheet per resource type
+    """
     if len(projects) < 1:
         quit("Didn't find any projects")
-    sheets = {'projects': {'description': "Projects", 'data': [project.__dict__ for project in projects]}}
+    projects = sorted(projects, key=lambda x: x.create_timestamp)
+    sheets = {'projects': {'description': "Projects", 'data': [project.to_dict() for project in projects]}}
 
     # Add the other sheets
-    session = ClientSession(raise_for_status=False)
     calls = await get_calls()
-    for k, v in calls.items():
-        api_name = v.get('api_name', "compute")
-        urls = []
-        for call in v.get('calls', []):
-            if api_name == 'compute':
-                urls.extend([f"/compute/v1/projects/{project.id}/{call}" for project in projects])
-            if api_name == 'container':
-                urls.extend([f"/v1/projects/{project.id}/{call}" for project in projects])
-        tasks = [get_api_data(session, url, access_token) for url in urls]
-        results = await gather(*tasks)
-        results = dict(zip(urls, results))
+    for k, objects in network_data.items():
         data = []
-        for result in results.values():
-            if len(result) > 0:
-                items = [item for item in result]  # Flatten
-                for item in items:
-                    network_item = GCPNetworkItem(item)
-                    if k == 'instances':
-                        instance = Instance(item)
-                        nic0 = instance.nics[0]  # Get the network information by looking at the first NIC
-                        for field in ('network_key', 'network_name', 'subnet_key', 'subnet_name'):
-                            setattr(network_item, field, getattr(nic0, field))
-                    data.append(network_item)
-        new_sheet = {
-            k: {
-                'description': v.get('description'),
-                'data': [row.__dict__ for row in data],  # Convert from object to dictionary
-            }
-        }
-        sheets.update(new_sheet)
+        for _ in objects:
+            row = {field: getattr(_, field, None) for field in FIELDS}
+            if isinstance(_, Instance) and _.nics:
+                nic0 = _.nics[0]  # Get the network information by looking at the first NIC
+                row.update({field: getattr(nic0, field) for field in ('network_key', 'network_name', 'subnet_key', 'subnet_name')})
+            data.append(row)
+        sheets[k] = {'description': calls[k].get('description'), 'data': data}
 
-    await session.close()
     # Create and save the Excel workbook
     _ = await write_to_excel(sheets, XLXS_FILE)
+    return sheets
+
+
+async def main(refresh: bool = False):
+
+    from reports import run_reports
+
+    _ = await run_reports(['dump_network_data'], refresh)
+    return _['dump_network_data']
 
 if __name__ == "__main__":
 
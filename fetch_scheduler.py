@@ -0,0 +1,202 @@
+from asyncio import Semaphore, Lock, sleep, get_running_loop
+from collections import Counter
+from contextlib import asynccontextmanager
+from time import monotonic, time
+from weakref import WeakKeyDictionary
+
+MAX_CONCURRENT_REQUESTS = 100  # Across all APIs
+DEFAULT_API_LIMIT = 20
+API_LIMITS = {
+    'compute': 50,
+    'container': 20,
+    'sqladmin': 10,
+    'cloudresourcemanager': 10,
+    'serviceusage': 10,
+    'servicenetworking': 10,
+}
+DEFAULT_API_RATE = 20.0  # Requests per second
+API_RATES = {
+    'compute': 40.0,
+    'container': 10.0,
+    'sqladmin': 5.0,
+    'cloudresourcemanager': 10.0,
+    'serviceusage': 5.0,
+    'servicenetworking': 5.0,
+}
+MIN_API_RATE = 0.5
+RATE_DECREASE_FACTOR = 0.5  # Multiply rate by this when the API says we're going too fast
+RATE_INCREASE_STEP = 0.2    # Add this to the rate on every success, up to the API's configured rate
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, min_rate: float = MIN_API_RATE):
+
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.tokens = rate
+        self.blocked_until = 0.0
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def _refill(self, now: float) -> None:
+
+        self.tokens = min(self.rate, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available, or until any Retry-After pause has passed
+        """
+        async with self._lock:
+            while True:
+                now = monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                await sleep(wait)
+
+    def slow_down(self, retry_after: float = None) -> None:
+
+        self.rate = max(self.min_rate, self.rate * RATE_DECREASE_FACTOR)
+        self.tokens = min(self.tokens, self.rate)
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, monotonic() + retry_after)
+
+    def speed_up(self) -> None:
+
+        self.rate = min(self.max_rate, self.rate + RATE_INCREASE_STEP)
+
+
+class FetchScheduler:
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_REQUESTS, api_limits: dict = None, api_rates: dict = None):
+
+        self.max_concurrent = max_concurrent
+        self.api_limits = API_LIMITS | (api_limits if api_limits else {})
+        self.api_rates = API_RATES | (api_rates if api_rates else {})
+        self._global = Semaphore(max_concurrent)
+        self._per_api = {}
+        self._buckets = {}
+        self.queued = Counter()       # Requests waiting for a slot, by API name
+        self.in_flight = Counter()    # Requests currently running, by API name
+        self.completed = Counter()    # Requests finished, by API name
+        self.retries = Counter()      # Requests retried, by API name
+        self.throttled = Counter()    # Rate limit responses, by API name
+        self.coalesced = Counter()    # Calls that shared an identical in-flight call, by API name
+        self.peak_in_flight = 0
+        self.errors = {}              # Last failure for each URL that gave up
+
+    def _api_semaphore(self, api_name: str) -> Semaphore:
+
+        if api_name not in self._per_api:
+            self._per_api[api_name] = Semaphore(self.api_limits.get(api_name, DEFAULT_API_LIMIT))
+        return self._per_api[api_name]
+
+    def bucket(self, api_name: str) -> TokenBucket:
+
+        if api_name not in self._buckets:
+            self._buckets[api_name] = TokenBucket(self.api_rates.get(api_name, DEFAULT_API_RATE))
+        return self._buckets[api_name]
+
+    @asynccontextmanager
+    async def slot(self, api_name: str):
+        """
+        Wait for a free slot for this API, respecting both the per-API and global limits
+        """
+        api_semaphore = self._api_semaphore(api_name)
+        self.queued[api_name] += 1
+        try:
+            await self.bucket(api_name).acquire()
+            await api_semaphore.acquire()
+            try:
+                await self._global.acquire()
+            except BaseException:
+                api_semaphore.release()
+                raise
+        finally:
+            self.queued[api_name] -= 1
+
+        self.in_flight[api_name] += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight.total())
+        try:
+            yield
+        finally:
+            self.in_flight[api_name] -= 1
+            self.completed[api_name] += 1
+            self._global.release()
+            api_semaphore.release()
+
+    def record_success(self, api_name: str, url: str) -> None:
+
+        self.bucket(api_name).speed_up()
+        self.errors.pop(url, None)
+
+    def record_retry(self, api_name: str, throttled: bool = False, retry_after: float = None) -> None:
+
+        self.retries[api_name] += 1
+        if throttled:
+            self.throttled[api_name] += 1
+            self.bucket(api_name).slow_down(retry_after)
+
+    def record_coalesced(self, api_name: str) -> None:
+
+        self.coalesced[api_name] += 1
+
+    def record_error(self, api_name: str, url: str, status: int, reason: str, attempts: int) -> None:
+
+        self.errors[url] = {
+            'api_name': api_name,
+            'status': status,
+            'reason': reason,
+            'attempts': attempts,
+            'timestamp': int(time()),
+        }
+
+    def get_metrics(self) -> dict:
+        """
+        Return queue depth and in-flight counts, overall and by API
+        """
+        api_names = sorted(set(self.queued) | set(self.in_flight) | set(self.completed) | set(self._buckets))
+        return {
+            'max_concurrent': self.max_concurrent,
+            'queue_depth': self.queued.total(),
+            'in_flight': self.in_flight.total(),
+            'peak_in_flight': self.peak_in_flight,
+            'completed': self.completed.total(),
+            'retries': self.retries.total(),
+            'throttled': self.throttled.total(),
+            'coalesced': self.coalesced.total(),
+            'errors': len(self.errors),
+            'apis': {
+                api_name: {
+                    'limit': self.api_limits.get(api_name, DEFAULT_API_LIMIT),
+                    'queue_depth': self.queued[api_name],
+                    'in_flight': self.in_flight[api_name],
+                    'completed': self.completed[api_name],
+                    'retries': self.retries[api_name],
+                    'throttled': self.throttled[api_name],
+                    'coalesced': self.coalesced[api_name],
+                    'rate': round(self.bucket(api_name).rate, 2),
+                } for api_name in api_names
+            },
+        }
+
+
+_schedulers = WeakKeyDictionary()
+
+
+def get_scheduler() -> FetchScheduler:
+    """
+    Get the shared scheduler for the running event loop
+    """
+    # Semaphores bind to a single loop, and scripts may call asyncio.run() more than once
+    loop = get_running_loop()
+    if loop not in _schedulers:
+        _schedulers[loop] = FetchScheduler()
+    return _schedulers[loop]
@@ -1,25 +1,116 @@
 #!/usr/bin/env python3
 
-from datetime import datetime
+import json
+from datetime import datetime, timezone
+from hashlib import sha1, sha256
+from functools import cache, lru_cache
+from sys import intern
 from time import time
 from aiohttp import ClientSession
 
-class GCPProject:
+_parsed_certificates = {}
 
 
+def _intern(value):
+    """
+    Intern strings such as project IDs, regions and network keys that are repeated across many objects
+    """
+    return intern(value) if isinstance(value, str) else value
+
+
+@lru_cache(maxsize=4096)
+def _get_date_timestamp(date: str) -> int:
+
+    return int(datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+
+
+def parse_timestamp(timestamp: str | int) -> int:
+    """
+    Convert an RFC3339 timestamp such as '2024-05-01T10:11:12.345-07:00' to epoch seconds.
+    The date part is memoized, since most objects are created on relatively few dates
+    """
+    if not timestamp:
+        return 0
+    if isinstance(timestamp, int):
+        return timestamp
+    seconds = _get_date_timestamp(timestamp[:10])
+    seconds += int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+    offset = timestamp[19:].lstrip('.0123456789')  # Skip fractional seconds
+    if offset[:1] in ('+', '-'):
+        _ = int(offset[1:3]) * 3600 + int(offset[4:6]) * 60
+        seconds -= _ if offset[0] == '+' else -_
+    return seconds
+
+
+def format_timestamp(timestamp: int) -> str:
+    """
+    Convert epoch seconds to a human-readable UTC string
+    """
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _parse_certificate(certificate: str) -> tuple:
+    """
+    Get the issuer, subject and common name of a PEM certificate.  Cached by the PEM's SHA-256,
+    since the same cert is often uploaded to many projects
+    """
+    key = sha256(certificate.encode('utf-8')).digest()
+    if not (_ := _parsed_certificates.get(key)):
+
+        from cryptography.x509 import load_pem_x509_certificate
+        from cryptography.x509.oid import NameOID
+
+        cert = load_pem_x509_certificate(certificate.encode('utf-8'))
+        common_name = cert.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+        _ = (cert.issuer.rfc4514_string(), cert.subject.rfc4514_string(),
+             common_name[0].value if common_name else "UNKNOWN")
+        _parsed_certificates[key] = _
+    return _
+
+
+@cache
+def _get_fields(cls) -> tuple:
+
+    fields = []
+    for c in reversed(cls.__mro__):
+        fields.extend(_ for _ in c.__dict__.get('__slots__', ()) if _ not in fields and not _.startswith('_'))
+        fields.extend(k for k, v in c.__dict__.items() if isinstance(v, property) and k not in fields)
+    return tuple(fields)
+
+
+class GCPObject:
+    """
+    Base class that stores attributes in __slots__ rather than a per-instance __dict__
+    """
+    __slots__ = ()
+
+    def to_dict(self) -> dict:
+        """
+        Get all attributes that have been set, plus properties such as creation, e.g. for a JSONResponse
+        or a spreadsheet row
+        """
+        return {k: getattr(self, k) for k in _get_fields(type(self)) if hasattr(self, k)}
+
+    def __repr__(self):
+        return str({k: v for k, v in self.to_dict().items() if v})
+
+    def __str__(self):
+        return str({k: v for k, v in self.to_dict().items() if v})
+
+
+class GCPProject(GCPObject):
+
+    __slots__ = ('id', 'name', 'number', 'state', 'labels', 'create_timestamp', 'parent_folder_id',
+                 'is_network_project', 'network_project_id', 'instances', 'gke_clusters', 'forwarding_rules')
+
     def __init__(self, item: dict):
 
-        self.id = item.get('projectId')
+        self.id = _intern(item.get('projectId'))
         self.name = item.get('name')
         self.number = int(item.get('projectNumber', 000000000))
         self.state = item.get('lifecycleState', "UNKNOWN")
         self.labels = item.get('labels', {})
-        if create_time := item.get('createTime'):
-            date_time = f"{create_time[:10]} {create_time[11:19]}"
-            self.create_timestamp = int(datetime.timestamp(datetime.strptime(date_time, "%Y-%m-%d %H:%M:%S")))
-        else:
-            self.create_timestamp = 0
-        self.creation = str(datetime.fromtimestamp(self.create_timestamp))  
+        self.create_timestamp = parse_timestamp(item.get('createTime'))
 
         # Try to find parent folder
         parent_folder_id = None
@@ -39,71 +130,61 @@ class GCPProject:
         self.gke_clusters = None
         self.forwarding_rules = None
 
-    def __repr__(self):
-        return str({k: v for k, v in vars(self).items() if v})
-
-    def __str__(self):
-        return str({k: v for k, v in vars(self).items() if v})
+    @property
+    def creation(self) -> str:
+        return format_timestamp(self.create_timestamp)
 
     async def get_instances(self, access_token: str, session: ClientSession = None):
 
         from gcp_utils import get_instances
+        from session_pool import get_session
 
-        _session = session if session else ClientSession(raise_for_status=False)
+        _session = session if session else get_session()
         try:
             self.instances = await get_instances(self.id, access_token, _session)
         except Exception as e:
-            await _session.close()
-        if not session:
-            await _session.close()
+            pass
 
     async def get_gke_clusters(self, access_token: str, session: ClientSession = None):
 
         from gcp_utils import get_gke_clusters
+        from session_pool import get_session
 
-        _session = session if session else ClientSession(raise_for_status=False)
+        _session = session if session else get_session()
         try:
             self.gke_clusters = await get_gke_clusters(self.id, access_token, _session)
         except Exception as e:
-            await _session.close()
-        if not session:
-            await _session.close()
+            pass
 
     async def get_forwarding_rules(self, access_token: str, session: ClientSession = None):
 
         from gcp_utils import get_forwarding_rules
+        from session_pool import get_session
 
-        _session = session if session else ClientSession(raise_for_status=False)
+        _session = session if session else get_session()
         try:
             self.forwarding_rules = await get_forwarding_rules(self.id, access_token, _session)
         except Exception as e:
-            await _session.close()
-        if not session:
-            await _session.close()
+            pass
+
 
+class GCPItem(GCPObject):
 
-class GCPItem:
+    __slots__ = ('name', 'description', 'labels', 'kind', 'region', 'zone', 'creation_timestamp', 'self_link', 'id',
+                 'project_id', 'key')
 
     def __init__(self, item: dict):
 
         self.name = item.get('name')
         self.description = item.get('description', "")
         self.labels = item.get('labels', {})
-        self.kind = item.get('kind')
+        self.kind = _intern(item.get('kind'))
         self.region = None
         self.zone = None
         for field in ('creation_timestamp', 'creationTimestamp', 'createTime'):
             if creation_timestamp := item.get(field):
                 break
-        if creation_timestamp:
-            if isinstance(creation_timestamp, int):
-                self.creation_timestamp = creation_timestamp
-            else:
-                date_time = f"{creation_timestamp[:10]} {creation_timestamp[11:19]}"
-                self.creation_timestamp = int(datetime.timestamp(datetime.strptime(date_time, "%Y-%m-%d %H:%M:%S")))
-        else:
-            self.creation_timestamp = 0
-        self.creation = str(datetime.fromtimestamp(self.creation_timestamp))     # Convert to human-readable string
+        self.creation_timestamp = parse_timestamp(creation_timestamp)
         if zone := item.get('zone'):
             self.zone = zone.split('/')[-1]
             self.region = self.zone[:-2]
@@ -129,6 +210,9 @@ class GCPItem:
         else:
             self.id = ""
             self.project_id = item.get('project_id', "unknown")
+        self.project_id = _intern(self.project_id)
+        self.region = _intern(self.region)
+        self.zone = _intern(self.zone)
         if self.zone:
             self.key = f"{self.project_id}/{self.zone}/{self.name}"   # Zonal compute resource
         elif self.region == 'global':
@@ -136,15 +220,16 @@ class GCPItem:
         else:
             self.key = f"{self.project_id}/{self.region}/{self.name}"  # Regional compute resource
 
-    def __repr__(self):
-        return str({k: v for k, v in vars(self).items() if v})
-
-    def __str__(self):
-        return str({k: v for k, v in vars(self).items() if v})
+    @property
+    def creation(self) -> str:
+        return format_timestamp(self.creation_timestamp)     # Convert to human-readable string
 
 
 class GCPNetworkItem(GCPItem):
 
+    __slots__ = ('network', 'subnetwork', 'network_project_id', 'network_key', 'network_name', 'subnet_key',
+                 'subnet_name')
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -174,11 +259,18 @@ class GCPNetworkItem(GCPItem):
             self.subnet_name = subnetwork.split('/')[-1]
         if self.kind == "compute#subnetwork":
             self.subnet_name = self.name
-        self.subnet_key = f"{self.network_project_id}/{self.region}/{self.subnet_name}"
+        self.region = _intern(self.region)
+        self.network_project_id = _intern(self.network_project_id)
+        self.network_name = _intern(self.network_name)
+        self.network_key = _intern(self.network_key)
+        self.subnet_name = _intern(self.subnet_name)
+        self.subnet_key = _intern(f"{self.network_project_id}/{self.region}/{self.subnet_name}")
 
 
 class Network(GCPNetworkItem):
 
+    __slots__ = ('routing_mode', 'peerings', 'subnetworks', 'num_subnets', 'mtu', 'auto_create_subnets')
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -198,8 +290,28 @@ class Network(GCPNetworkItem):
         self.subnet_key = None
 
 
+class Address(GCPNetworkItem):
+
+    __slots__ = ('address', 'prefix_length', 'address_type', 'purpose', 'cidr_range')
+
+    def __init__(self, item: dict):
+
+        super().__init__(item)
+
+        self.address = item.get('address')
+        self.prefix_length = item.get('prefixLength')
+        self.address_type = item.get('addressType', "UNKNOWN")
+        self.purpose = item.get('purpose', "UNKNOWN")
+        self.cidr_range = None
+        if self.address and self.prefix_length:
+            self.cidr_range = f"{self.address}/{self.prefix_length}"  # Range allocation, e.g. for PSA
+
+
 class Subnet(GCPNetworkItem):
 
+    __slots__ = ('purpose', 'is_private', 'is_psc', 'is_proxy_only', 'cidr_range', 'usable_ips', 'used_ips',
+                 'secondary_ranges', 'members', 'attached_projects', 'active_projects')
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -235,12 +347,11 @@ class Subnet(GCPNetworkItem):
     async def get_bindings(self, access_token: str, session: ClientSession = None) -> None:
 
         from gcp_utils import get_subnet_iam_binding
+        from session_pool import get_session
 
-        _session = session if session else ClientSession(raise_for_status=True)
+        _session = session if session else get_session()
         if self.is_private:
             self.members = await get_subnet_iam_binding(self.id, access_token, _session)
-        if not session:
-            await _session.close()
 
     async def set_actives_projects(self, projects: list = None) -> None:
         
@@ -251,10 +362,15 @@ class Subnet(GCPNetworkItem):
 
 class CloudRouter(GCPNetworkItem):
 
+    __slots__ = ('fingerprint', 'interfaces', 'bgp_peers', 'cloud_nats', 'nat_ips')
+
     def __init__(self, item: dict):
 
         super().__init__(item)
 
+        # Changes whenever the router config changes; routers have no fingerprint field, so hash the item instead
+        self.fingerprint = item.get('fingerprint') or sha1(json.dumps(item, sort_keys=True).encode()).hexdigest()
+
         self.interfaces = []
         interfaces = item.get('interfaces', [])
         for interface in interfaces:
@@ -295,6 +411,8 @@ class CloudRouter(GCPNetworkItem):
 
 class CloudNat(GCPNetworkItem):
 
+    __slots__ = ('ip_allocation_option', 'min_ports_per_vm', 'max_ports_per_vm', 'enable_dpa', 'enable_eim', 'ips')
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -312,6 +430,8 @@ class CloudNat(GCPNetworkItem):
 
 class FirewallRule(GCPNetworkItem):
 
+    __slots__ = ()
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -322,6 +442,8 @@ class FirewallRule(GCPNetworkItem):
 
 class ForwardingRule(GCPNetworkItem):
 
+    __slots__ = ('ip_address', 'lb_scheme', 'is_internal', 'is_external', 'is_managed', 'target', 'ports')
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -347,6 +469,8 @@ class ForwardingRule(GCPNetworkItem):
 
 class TargetProxy(GCPNetworkItem):
 
+    __slots__ = ('ssl_certs',)
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -358,6 +482,8 @@ class TargetProxy(GCPNetworkItem):
 
 class CloudVPNGateway(GCPNetworkItem):
 
+    __slots__ = ('vpn_ips',)
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -368,6 +494,8 @@ class CloudVPNGateway(GCPNetworkItem):
 
 class PeerVPNGateway(GCPNetworkItem):
 
+    __slots__ = ('vpn_ips', 'interface_ips', 'redundancy_type')
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -382,6 +510,8 @@ class PeerVPNGateway(GCPNetworkItem):
 
 class VPNTunnel(GCPNetworkItem):
 
+    __slots__ = ('vpn_gateway', 'interface', 'peer_gateway', 'peer_ip', 'ike_version', 'status', 'detailed_status')
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -403,6 +533,8 @@ class VPNTunnel(GCPNetworkItem):
 
 class Instance(GCPItem):
 
+    __slots__ = ('machine_type', 'ip_forwarding', 'status', 'nics')
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -412,20 +544,21 @@ class Instance(GCPItem):
         self.machine_type = item.get('machineType', "unknown/unknown").split('/')[-1]
         self.ip_forwarding = item.get('canIpForward', False)
         self.status = item.get('status', "UNKNOWN")
-        nics = []
+        # Copy rather than update the raw NIC dicts, so they aren't kept alive with the extra fields
+        self.nics = []
         for nic in item.get('networkInterfaces', []):
-            nic.update({
+            self.nics.append(InstanceNic(nic | {
                 'name': f"{self.name}-{nic['name']}",
                 'project_id': self.project_id,
                 'zone': self.zone,
                 'creation_timestamp': self.creation_timestamp,
-            })
-            nics.append(nic)
-        self.nics = [InstanceNic(nic) for nic in nics]
+            }))
 
 
 class InstanceNic(GCPNetworkItem):
 
+    __slots__ = ('ip_address', 'access_config_name', 'access_config_type', 'external_ip_address')
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -450,10 +583,10 @@ class InstanceNic(GCPNetworkItem):
 
 class SSLCert(GCPNetworkItem):
 
-    def __init__(self, item: dict):
+    __slots__ = ('type', 'is_expired', 'is_expiring_soon', 'target_proxy', 'expire_timestamp', '_certificate',
+                 '_issuer', '_cn')
 
-        from cryptography.x509 import load_pem_x509_certificate
-        from cryptography.x509.oid import NameOID
+    def __init__(self, item: dict):
 
         super().__init__(item)
 
@@ -464,38 +597,23 @@ class SSLCert(GCPNetworkItem):
         for _ in ("zone", "network_project_id", "network_key", "network_name", "subnet_key", "subnet_name"):
             setattr(self, _, None)
 
-        self.issuer = "UNKNOWN"
-        self.subject = "UNKNOWN"
-        self.cn = "UNKNOWN"
+        # The PEM is only decoded if issuer, subject or cn are read, e.g. for certs that are expiring soon
+        self._certificate = None
+        self._issuer = None
+        self._cn = None
         if certificate := item.get('certificate'):
             if managed := item.get('managed'):
-                self.issuer = "Google"
+                self._issuer = "Google"
                 domains = managed.get('domains', [])
                 if len(domains) > 0:
-                    self.cn = domains[0]
+                    self._cn = domains[0]
             else:
-                # Get CN from the cert itself
-                _ = load_pem_x509_certificate(certificate.encode('utf-8'))
-                self.issuer = _.issuer.rfc4514_string()
-                self.subject = _.subject.rfc4514_string()
-                common_name = _.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
-                self.cn = common_name[0].value
+                self._certificate = certificate
             if sans := item.get('subjectAlternativeNames', []):
                 # Cert is SAN, so won't have Common Name
-                for san in sans:
-                    if not san.startswith('*'):
-                        # Use first non-wildcard hostname
-                        self.cn = san
-                        break
-                if len(sans) > 0:
-                    self.cn = sans[0]   # only has wildcards, so just use the first one
-
-        if expire_time := item.get('expireTime'):
-            _ = f"{expire_time[:10]} {expire_time[11:19]}"  # reformat to <date> <time>
-            self.expire_timestamp = int(datetime.timestamp(datetime.strptime(_, "%Y-%m-%d %H:%M:%S")))
-        else:
-            self.expire_timestamp = 0
-        self.expire_str = str(datetime.fromtimestamp(self.expire_timestamp))  # Convert to human-readable string
+                self._cn = sans[0]
+
+        self.expire_timestamp = parse_timestamp(item.get('expireTime'))
 
         now = int(time())
 
@@ -505,9 +623,36 @@ class SSLCert(GCPNetworkItem):
         if self.expire_timestamp < now + 21 * 24 * 3600:
             self.is_expiring_soon = True
 
+    @property
+    def issuer(self) -> str:
+        if self._certificate:
+            return _parse_certificate(self._certificate)[0]
+        return self._issuer or "UNKNOWN"
+
+    @property
+    def subject(self) -> str:
+        if self._certificate:
+            return _parse_certificate(self._certificate)[1]
+        return "UNKNOWN"
+
+    @property
+    def cn(self) -> str:
+        if self._cn:
+            return self._cn
+        if self._certificate:
+            return _parse_certificate(self._certificate)[2]  # Get CN from the cert itself
+        return "UNKNOWN"
+
+    @property
+    def expire_str(self) -> str:
+        return format_timestamp(self.expire_timestamp)  # Convert to human-readable string
+
 
 class GKECluster(GCPNetworkItem):
 
+    __slots__ = ('current_master_version', 'current_node_version', 'status', 'master_range', 'endpoint_ips', 'pods_range',
+                 'pods_cidr', 'services_range', 'services_cidr')
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -560,6 +705,8 @@ class GKECluster(GCPNetworkItem):
 
 class CloudSQL(GCPItem):
 
+    __slots__ = ('network_project_id', 'network_name', 'network_key', 'ip_addresses')
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -579,6 +726,8 @@ class CloudSQL(GCPItem):
 
 class SecurityPolicy(GCPNetworkItem):
 
+    __slots__ = ('rules',)
+
     def __init__(self, item: dict):
 
         super().__init__(item)
@@ -595,7 +744,9 @@ class SecurityPolicy(GCPNetworkItem):
             })
 
 
-class PSAConnection:
+class PSAConnection(GCPObject):
+
+    __slots__ = ('peer_network_id', 'network_name', 'peering_name', 'peering_ranges', 'service', 'region')
 
     def __init__(self, item: dict):
 
@@ -608,15 +759,11 @@ class PSAConnection:
         self.service = item.get('service').split('/')[-1]
         self.region = 'global'
 
-    def __repr__(self):
-        return str({k: v for k, v in vars(self).items() if v})
-
-    def __str__(self):
-        return str({k: v for k, v in vars(self).items() if v})
-
 
 class GCSBucket(GCPItem):
 
+    __slots__ = ('objects',)
+
     def __init__(self, item: dict):
 
          super().__init__(item)
@@ -626,6 +773,8 @@ class GCSBucket(GCPItem):
 
 class NetappVolume(GCPItem):
 
+    __slots__ = ('ip_address', 'network_id', 'network_name')
+
     def __init__(self, item: dict):
 
          super().__init__(item)
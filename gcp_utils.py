@@ -1,15 +1,21 @@
 from pathlib import Path
 from urllib import parse
-from asyncio import gather
-from os import environ
-import google.auth
-import google.auth.transport.requests
-from google.oauth2 import service_account
-from aiohttp import ClientSession
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from asyncio import gather, create_task, sleep, shield, get_running_loop
+from random import uniform
+from typing import AsyncIterator
+from weakref import WeakKeyDictionary
+from aiohttp import ClientSession, ClientResponse, ClientConnectionError, ClientPayloadError
 from gcloud.aio.auth import Token
 from gcloud.aio.storage import Storage
 from gcp_classes import GCPProject
 from gcp_classes import Subnet
+from fetch_scheduler import get_scheduler
+from token_cache import get_token_provider
+from session_pool import get_session
+from json_codec import loads, get_typed_loads, get_page_token
+from parsing import parse_json, get_page_items
 
 SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
 SERVICE_USAGE_PARENTS = {
@@ -19,8 +25,27 @@ SERVICE_USAGE_PARENTS = {
 }
 STORAGE_TIMEOUT = 30
 VERIFY_SSL = False
+MAX_RETRIES = 5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'RESOURCE_EXHAUSTED')
+BACKOFF_BASE = 1.0
+MAX_BACKOFF = 60.0
 PWD = Path(__file__).parent
 
+_shared_calls = WeakKeyDictionary()  # In-flight get_api_data() calls for each event loop, by request
+
+
+class IncompleteResultsError(RuntimeWarning):
+    """
+    A listing gave up part way through, or after retrying, so the results so far can't be taken as complete
+    """
+    def __init__(self, url: str, status: int, reason: str):
+
+        super().__init__(f"Incomplete results from {url}: {status} {reason}")
+        self.url = url
+        self.status = status
+        self.reason = reason
+
 
 async def get_project_from_account_key(key_file: str) -> str:
     """
@@ -36,27 +61,15 @@ async def get_project_from_account_key(key_file: str) -> str:
 
 async def get_access_token(key_file: str = None, quota_project_id: str = None) -> str:
     """
-    Authenticate to GCP and return an access token
+    Authenticate to GCP and return an access token, re-using a cached token until shortly before it expires
     """
-    if key_file:
-        # Convert relative to full path
-        key_file = PWD.joinpath(key_file)
-        assert key_file.exists(), f"JSON key file not found: '{key_file}'"
-        environ.update({'GOOGLE_APPLICATION_CREDENTIALS': key_file.__str__()})
-        credentials = service_account.Credentials.from_service_account_file(str(key_file), scopes=SCOPES)
-    else:
-        # Authenticate via ADC
-        credentials, project_id = google.auth.default(scopes=SCOPES, quota_project_id=quota_project_id)
-
-    # Generate access token
-    _ = google.auth.transport.requests.Request()
-    credentials.refresh(_)
-    return credentials.token
+    provider = get_token_provider(key_file, quota_project_id)
+    return await provider.get_token()
 
 
-async def get_api_data(session: ClientSession, url: str, access_token: str, params: dict = None, items_key: str = None) -> list:
+def parse_api_url(url: str, params: dict = None) -> tuple[str, str, dict]:
     """
-    Make a Rest API to GCP, return data
+    Given a full or partial API url, return the API name, full url, and query parameters
     """
     api_name = None
     if url.startswith('http:') or url.startswith('https:'):
@@ -76,9 +89,97 @@ async def get_api_data(session: ClientSession, url: str, access_token: str, para
     # If Url has query string, convert that to parameters
     if "?" in url:
         _ = parse.urlparse(url)
-        url = f"https://{_.netloc}/{_.path}"
+        url = f"https://{_.netloc}{_.path}"
         params = dict(parse.parse_qsl(_.query))
 
+    return api_name, url, params
+
+
+def _parse_fields(text: str, i: int = 0) -> tuple[dict, int]:
+
+    tree = {}
+    name = ""
+    while i < len(text):
+        char = text[i]
+        if char == '(':
+            tree[name.strip()], i = _parse_fields(text, i + 1)
+            name = ""
+        elif char == ')':
+            break
+        elif char == ',':
+            if name.strip():
+                tree[name.strip()] = None
+            name = ""
+        else:
+            name += char
+        i += 1
+    if name.strip():
+        tree[name.strip()] = None
+    return tree, i
+
+
+def _merge_field_trees(tree: dict, other: dict) -> None:
+
+    for k, v in other.items():
+        if k not in tree:
+            tree[k] = v
+        elif tree[k] is None or v is None:
+            tree[k] = None  # Whole field wins over a sub-selection
+        else:
+            _merge_field_trees(tree[k], v)
+
+
+def _format_field_tree(k: str, v: dict | None) -> str:
+
+    return k if v is None else f"{k}({','.join(_format_field_tree(_k, _v) for _k, _v in v.items())})"
+
+
+def merge_fields(*field_lists: list | None) -> list | None:
+    """
+    Merge lists of partial response fields such as 'networkInterfaces(network,subnetwork)'.
+    None means the whole resource, so it wins over any list of fields
+    """
+    tree = {}
+    for fields in field_lists:
+        if fields is None:
+            return None
+        for field in fields:
+            _merge_field_trees(tree, _parse_fields(field)[0])
+    return [_format_field_tree(k, v) for k, v in tree.items()]
+
+
+def has_api_enabled(project_id: str, call: dict, enabled_services: dict) -> bool:
+    """
+    Check if a project could have resources from an entry in the calls file, given its enabled services.
+    Projects with unknown services are assumed to have everything enabled
+    """
+    if not (services := enabled_services.get(project_id)):
+        return True
+    return f"{call.get('api_name', 'compute')}.googleapis.com" in services
+
+
+def get_call_urls(project_id: str, call: dict) -> list[str]:
+    """
+    Given a project ID and an entry from the calls file, return the urls to get that resource type
+    """
+    api_name = call.get('api_name', "compute")
+    urls = []
+    for _ in call.get('calls', []):
+        if api_name == 'compute':
+            urls.append(f"/compute/v1/projects/{project_id}/{_}")
+        elif api_name == 'container':
+            urls.append(f"/v1/projects/{project_id}/{_}")
+        else:
+            urls.append(f"https://{api_name}.googleapis.com/v1/projects/{project_id}/{_}")
+    return urls
+
+
+def get_items_path(url: str, items_key: str = None) -> tuple[str | None, str | None]:
+    """
+    Get where a response keeps its list of items: the items key, and for aggregated calls the collection name
+    that each scope keeps its items under.  No items key means the response is a single item
+    """
+    url = parse_api_url(url)[1]
     if not items_key:
         if 'compute.googleapis.com' in url:
             if '/zones' in url or '/regions' in url or '/global' in url or '/aggregate' in url:
@@ -89,51 +190,198 @@ async def get_api_data(session: ClientSession, url: str, access_token: str, para
                     items_key = "resources"
         else:
             items_key = url.split('/')[-1]
-            #print(items_key)
+    return items_key, url.split('/')[-1] if 'aggregated/' in url else None
 
-    params = {} if not params else params
-    headers = {'Authorization': f"Bearer {access_token}"}
 
-    data = []
+async def _iter_pages(session: ClientSession, url: str, access_token: str, params: dict, items_key: str | None,
+                      fields: list | None, decode) -> AsyncIterator:
+    """
+    Get each page of a Rest API call to GCP as it arrives, while the next page downloads.
+    decode() takes the raw body of a page, and returns what to yield along with the page's nextPageToken
+    """
+    api_name, url, params = parse_api_url(url, params)
+    params = dict(params) if params else {}
+    if fields:
+        _ = ",".join(merge_fields(fields))
+        if 'aggregated/' in url:
+            params['fields'] = f"{items_key}/*/{url.split('/')[-1]}({_}),nextPageToken"
+        elif items_key:
+            params['fields'] = f"{items_key}({_}),nextPageToken"
+        else:
+            params['fields'] = _
+    headers = {'Authorization': f"Bearer {access_token}"}
+    scheduler = get_scheduler()
+
+    async def get_page(page_params: dict) -> tuple | None:
+        """
+        Get a page, retrying where it might help.  Returns None if the first page fails in a way that retrying
+        won't fix, e.g. the API isn't enabled; any other failure raises IncompleteResultsError
+        """
+        for attempt in range(1, MAX_RETRIES + 2):
+            retry_after = None
+            try:
+                async with scheduler.slot(api_name):
+                    # Status is checked here whatever the session's setting, so the error reason can be read
+                    async with session.get(url, headers=headers, params=page_params, ssl=VERIFY_SSL,
+                                           raise_for_status=False) as response:
+                        status = int(response.status)
+                        if status == 200:
+                            scheduler.record_success(api_name, url)
+                            return decode(await response.read())
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        reason = await get_error_reason(response)
+            except (ClientConnectionError, ClientPayloadError, TimeoutError) as e:  # Payload: truncated body
+                status = 0
+                reason = str(e) or type(e).__name__
+            if not is_retryable(status, reason) or attempt > MAX_RETRIES:
+                scheduler.record_error(api_name, url, status, reason, attempt)
+                if 'pageToken' in page_params or is_retryable(status, reason):
+                    raise IncompleteResultsError(url, status, reason)
+                return None
+            scheduler.record_retry(api_name, throttled=is_rate_limited(status, reason), retry_after=retry_after)
+            await sleep(get_backoff(attempt, retry_after))
+        return None
+
+    next_page = create_task(get_page(params))
     try:
-        while True:
-            async with (session.get(url, headers=headers, params=params, ssl=VERIFY_SSL) as response):
-                if int(response.status) == 200:
-                    json_data = await response.json()
-                    #print(url, items_key, json_data)
-                    if 'aggregated/' in url:
-                        for k, v in json_data.get(items_key, {}).items():
-                            if _ := v.get(url.split("/")[-1]):
-                                data.extend(_)
-                    else:
-                        if items_key:
-                            _ = json_data.get(items_key, [])
-                            data.extend(_)
-                        else:
-                            data = [json_data]  # API returned a dictionary
-                    if next_page_token := json_data.get('nextPageToken'):
-                        params.update({'pageToken': next_page_token})
-                    else:
-                        break
-                else:
-                    break
+        while next_page:
+            _ = await next_page
+            next_page = None
+            if _ is None:
+                break
+            page, next_page_token = _
+            # Start downloading the next page before handing out this one
+            if next_page_token:
+                next_page = create_task(get_page(params | {'pageToken': next_page_token}))
+            yield page
+    except IncompleteResultsError:
+        raise
     except Exception as e:
         raise RuntimeWarning(e)
+    finally:
+        if next_page:
+            next_page.cancel()
 
-    return data
+
+async def iter_api_pages(session: ClientSession, url: str, access_token: str, params: dict = None,
+                         items_key: str = None, fields: list = None) -> AsyncIterator[bytes]:
+    """
+    Make a Rest API call to GCP, yielding the raw JSON of each page as it arrives, without decoding its items.
+    get_items_path() gives where the items are in each page.
+    Raises IncompleteResultsError if a page still fails after retrying, or a page after the first fails
+    """
+    items_key = get_items_path(url, items_key)[0]
+    async for page in _iter_pages(session, url, access_token, params, items_key, fields,
+                                  lambda _: (_, get_page_token(_))):
+        yield page
+
+
+async def iter_api_data(session: ClientSession, url: str, access_token: str, params: dict = None, items_key: str = None,
+                        fields: list = None, typed: bool = False) -> AsyncIterator[dict]:
+    """
+    Make a Rest API call to GCP, yielding items as each page arrives.
+    If fields are given, only those fields of each item are returned (partial response).
+    If typed, pages are decoded into the typed structs for the gcp_classes models where available,
+    so items only have the fields those models use.
+    Raises IncompleteResultsError if a page still fails after retrying, or a page after the first fails
+    """
+    items_key, collection = get_items_path(url, items_key)
+    loads_page = loads
+    if typed:
+        loads_page = get_typed_loads(items_key, parse_api_url(url)[1].split('/')[-1], collection is not None) or loads
+
+    def decode(data: bytes) -> tuple[dict, str | None]:
+        json_data = loads_page(data)
+        return json_data, json_data.get('nextPageToken')
+
+    async for json_data in _iter_pages(session, url, access_token, params, items_key, fields, decode):
+        for item in get_page_items(json_data, items_key, collection):
+            yield item
+
+
+async def get_api_data(session: ClientSession, url: str, access_token: str, params: dict = None, items_key: str = None,
+                       fields: list = None, typed: bool = False) -> list:
+    """
+    Make a Rest API to GCP, return data.
+    Concurrent calls for the same request with the same access token share a single fetch
+    """
+    api_name, _url, _params = parse_api_url(url, params)
+    k = (_url, repr(sorted(_params.items())) if _params else None, items_key, tuple(fields) if fields else None,
+         typed, access_token)
+    shared_calls = _shared_calls.setdefault(get_running_loop(), {})
+    if task := shared_calls.get(k):
+        get_scheduler().record_coalesced(api_name)
+    else:
+        task = create_task(_get_api_data(session, url, access_token, params, items_key, fields, typed))
+        shared_calls[k] = task
+        task.add_done_callback(lambda _: shared_calls.pop(k, None))
+    # Shielded so a cancelled caller doesn't cancel the fetch for the others; each gets its own list
+    return list(await shield(task))
+
+
+async def _get_api_data(session: ClientSession, url: str, access_token: str, params: dict = None,
+                        items_key: str = None, fields: list = None, typed: bool = False) -> list:
+
+    return [item async for item in iter_api_data(session, url, access_token, params, items_key, fields, typed)]
+
+
+def is_rate_limited(status: int, reason: str = None) -> bool:
+
+    return status == 429 or (status == 403 and reason in RATE_LIMIT_REASONS)
+
+
+def is_retryable(status: int, reason: str = None) -> bool:
+
+    return status == 0 or status in RETRY_STATUSES or is_rate_limited(status, reason)
+
+
+def get_backoff(attempt: int, retry_after: float = None) -> float:
+    """
+    Seconds to wait before the next attempt: Retry-After if given, otherwise jittered exponential backoff
+    """
+    if retry_after:
+        return min(retry_after, MAX_BACKOFF)
+    return uniform(0, min(MAX_BACKOFF, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def parse_retry_after(value: str = None) -> float | None:
+    """
+    Get seconds to wait from a Retry-After header, which can be a number of seconds or an HTTP date
+    """
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        _ = parsedate_to_datetime(value) - datetime.now(timezone.utc)
+        return max(_.total_seconds(), 0.0)
+    except Exception as e:
+        return None
+
+
+async def get_error_reason(response: ClientResponse) -> str:
+    """
+    Get the error reason (ex: 'rateLimitExceeded') from a Google API error response
+    """
+    try:
+        _ = await response.json(content_type=None)
+        error = _.get('error', {})
+        if errors := error.get('errors'):
+            return errors[0].get('reason', "")
+        return error.get('status', "")
+    except Exception as e:
+        return response.reason or ""
 
 
 async def get_projects(access_token: str, parent_filter: str = None, state: str = None, sort_by: str = None, session: ClientSession = None) -> list[GCPProject]:
     """
     Get list of all projects
     """
-    _session = session if session else ClientSession(raise_for_status=True)
+    _session = session if session else get_session()
     url = "https://cloudresourcemanager.googleapis.com/v1/projects"
     qs = {'filter': parent_filter} if parent_filter else None
     _projects = await get_api_data(_session, url, access_token, qs)
     #print(_projects)
-    if not session:
-        await _session.close()
 
     projects = [GCPProject(p) for p in _projects]
     if state:
@@ -151,7 +399,7 @@ async def get_project(project_id: str, access_token: str, parent_filter: dict =
     from gcp_classes import GCPProject
 
     try:
-        _session = session if session else ClientSession(raise_for_status=True)
+        _session = session if session else get_session()
         url = f"https://compute.googleapis.com/compute/v1/projects/{project_id}"
         if parent_filter:
             p = None
@@ -161,10 +409,8 @@ async def get_project(project_id: str, access_token: str, parent_filter: dict =
                     break
             url = f"{url}?filter={parent_filter}"
         _project = await get_api_data(_session, url, access_token)
-        if not session:
-            await _session.close()
         project = GCPProject(_project[0])
-        return project.__dict__
+        return project.to_dict()
     except Exception as e:
         raise KeyError(e)
 
@@ -173,11 +419,9 @@ async def get_service_projects(host_project_id: str, access_token: str, session:
     """
     Given a Shared VPC host project, get list of all projects under that folder
     """
-    _session = session if session else ClientSession(raise_for_status=True)
+    _session = session if session else get_session()
     url = f"/compute/v1/projects/{host_project_id}/getXpnResources"
     _resources = await get_api_data(_session, url, access_token)
-    if not session:
-        await _session.close()
     assert len(_resources) > 0, f"No service projects found in Project ID '{host_project_id}'"
     _ = [r['id'] for r in _resources if r.get('type') == "PROJECT"]
     return _
@@ -187,11 +431,9 @@ async def get_host_project(project_id: str, access_token: str, session: ClientSe
     """
     Given a project id, get the host network project ID
     """
-    _session = session if session else ClientSession(raise_for_status=True)
+    _session = session if session else get_session()
     url = f"/compute/v1/projects/{project_id}/getXpnHost"
     _resources = await get_api_data(_session, url, access_token)
-    if not session:
-        await _session.close()
     if len(_resources) == 1:
         return _resources[0]['name']
 
@@ -206,11 +448,9 @@ async def get_service_usage(parent: dict, access_token: str, session: ClientSess
             p = f"{v}/{_}"
             break
     assert p, f"parent must be one of these keys: {SERVICE_USAGE_PARENTS.keys()}.  Got '{parent}'"
-    _session = session if session else ClientSession(raise_for_status=True)
+    _session = session if session else get_session()
     url = f"https://serviceusage.googleapis.com/v1/{p}/services"
     _resources = await get_api_data(_session, url, access_token)
-    if not session:
-        await _session.close()
     return _resources
 
 
@@ -220,11 +460,9 @@ async def get_networks(project_id: str, access_token: str, session: ClientSessio
     """
     from gcp_classes import Network
 
-    _session = session if session else ClientSession(raise_for_status=True)
+    _session = session if session else get_session()
     url = f"/compute/v1/projects/{project_id}/global/networks"
     _resources = await get_api_data(_session, url, access_token)
-    if not session:
-        await _session.close()
     assert len(_resources) > 0, f"No VPC Networks found in Project ID '{project_id}'"
     networks = []
     for _network in _resources:
@@ -242,15 +480,13 @@ async def get_subnets(project_id: str, access_token: str, session: ClientSession
     """
     from gcp_classes import Subnet
 
-    _session = session if session else ClientSession(raise_for_status=True)
+    _session = session if session else get_session()
     if regions:
         urls = [f"/compute/v1/projects/{project_id}/regions/{r}/subnetworks" for r in regions]
     else:
         urls = [f"/compute/v1/projects/{project_id}/aggregated/subnetworks"]
     tasks = [get_api_data(_session, url, access_token) for url in urls]
     _results = await gather(*tasks)
-    if not session:
-        await _session.close()
     _results = [item for items in _results for item in items]
     subnets = []
     for _subnet in _results:
@@ -262,11 +498,9 @@ async def get_subnets(project_id: str, access_token: str, session: ClientSession
 
 async def get_subnet_iam_bindings(subnets: list[Subnet], access_token: str, session: ClientSession = None) -> None:
 
-    _session = session if session else ClientSession(raise_for_status=True)
+    _session = session if session else get_session()
     tasks = [get_subnet_iam_binding(s.id, access_token, _session) for s in subnets]
     _results = await gather(*tasks)
-    if not session:
-        await _session.close()
     _results = [item for items in _results for item in items]
     #print(_results)
 
@@ -276,15 +510,13 @@ async def get_subnet_iam_binding(subnet_id: str, access_token: str, session: Cli
     Get list of Compute Network uses on a given subnet
     """
     subnet_id.replace('https://www.googleapis.com/compute/v1/', "")  # don't need/want full URL
-    _session = session if session else ClientSession(raise_for_status=True)
+    _session = session if session else get_session()
     url = f"/compute/v1/{subnet_id}/getIamPolicy?optionsRequestedPolicyVersion=1"
     members = []
     _ = await get_api_data(_session, url, access_token, items_key="bindings")
     for binding in _:
         if binding.get('role') == "roles/compute.networkUser":
             members.extend([member for member in binding.get('members', []) if not member.startswith('deleted')])
-    if not session:
-        await _session.close()
     return members
 
 
@@ -292,27 +524,22 @@ async def get_instances(project_id: str, access_token: str, session: ClientSessi
 
     from gcp_classes import Instance
 
-    _session = session if session else ClientSession(raise_for_status=True)
+    _session = session if session else get_session()
     url = f"/compute/v1/projects/{project_id}/aggregated/instances"
-    _results = await get_api_data(_session, url, access_token)
-    if not session:
-        await _session.close()
-    #_results = [item for items in _results for item in items]
-    #print([item.get('name') for item in _results if item])
-    _ = [Instance(item) for item in _results]
-    #print(project_id, _)
-    return _
+    items_key, collection = get_items_path(url)
+    # Each page is parsed in a worker while the next one downloads
+    tasks = [create_task(parse_json(Instance, page, items_key, collection))
+             async for page in iter_api_pages(_session, url, access_token)]
+    return [instance for _, instances in await gather(*tasks) for instance in instances]
 
 
 async def get_gke_clusters(project_id: str, access_token: str, session: ClientSession = None) -> list:
 
     from gcp_classes import GKECluster
 
-    _session = session if session else ClientSession(raise_for_status=True)
+    _session = session if session else get_session()
     url = f"/v1/projects/{project_id}/locations/-/clusters"
     _results = await get_api_data(_session, url, access_token)
-    if not session:
-        await _session.close()
     _ = [GKECluster(item) for item in _results]
     return _
 
@@ -321,22 +548,15 @@ async def get_forwarding_rules(project_id: str, access_token: str, session: Clie
 
     from gcp_classes import ForwardingRule
 
-    _session = session if session else ClientSession(raise_for_status=True)
-    forwarding_rules = []
+    _session = session if session else get_session()
     urls = [
         f"/compute/v1/projects/{project_id}/aggregated/forwardingRules",
         f"/compute/v1/projects/{project_id}/global/forwardingRules",
     ]
-    tasks = [get_api_data(_session, url, access_token) for url in urls]
+    tasks = [get_api_data(_session, url, access_token, typed=True) for url in urls]
     _results = await gather(*tasks)
-    for result in _results:
-        print(result)
-        if isinstance(result, list):
-            _results = [item for items in _results for item in items ]
-        _ = [ForwardingRule(item) for item in _results if item]
-        forwarding_rules.extend(_)
-    if not session:
-        await _session.close()
+    _results = [item for items in _results for item in items]
+    forwarding_rules = [ForwardingRule(item) for item in _results if item]
     return forwarding_rules
 
 
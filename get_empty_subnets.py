@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 
-from asyncio import run, gather
-from aiohttp import ClientSession
-from file_utils import get_settings, write_to_excel, get_calls
-from gcp_utils import get_access_token, get_projects, get_api_data
-from gcp_classes import Subnet, Instance, ForwardingRule
+from asyncio import run
+from file_utils import write_to_excel
+from subnet_usage import get_address_arrays, get_subnet_usage
 
 
-CALLS = ('vpc_networks', 'subnetworks', 'instances', 'forwarding_rules')
+CALLS = ('subnetworks', 'instances', 'forwarding_rules')
+API_FIELDS = {
+    'instances': ['name', 'zone', 'selfLink', 'networkInterfaces(name,networkIP,network,subnetwork)'],
+    'forwarding_rules': ['name', 'region', 'selfLink', 'IPAddress', 'loadBalancingScheme', 'network', 'subnetwork'],
+}
 XLSX_FILE = "empty_subnets.xlsx"
 
 
@@ -16,69 +18,21 @@ def sort_data(data: list, key: str, reverse: bool = True) -> list:
     return sorted(data, key=lambda _: _[key], reverse=reverse)
 
 
-async def main():
-
-    try:
-        settings = await get_settings()
-        access_token = await get_access_token(settings.get('key_file'))
-    except Exception as e:
-        quit(e)
-
-    projects = await get_projects(access_token)
-
-    # Form a dictionary of relevant API Calls
-    _ = await get_calls()
-    calls = {k: v.get('calls')[0] for k, v in _.items() if k in CALLS}
-
-    print("Gathering Network Data...")
-    session = ClientSession(raise_for_status=False)
-
-    # Get all network data
-    raw_data = {}
-    for k, call in calls.items():
-        # Perform API calls
-        urls = [f"/compute/v1/projects/{project.id}/{call}" for project in projects]
-        tasks = [get_api_data(session, url, access_token) for url in urls]
-        results = await gather(*tasks)
-        results = dict(zip(urls, results))
-        items = []
-        for url, data in results.items():
-            if len(data) > 0:
-                _ = [item for item in data]
-                items.extend(_)
-        raw_data[k] = items
-    await session.close()
-
+async def get_report(projects: list, network_data: dict, access_token: str = None, refresh: bool = False) -> list:
+    """
+    Find private subnets with no instances or internal forwarding rules, given objects for each resource type in CALLS
+    """
     print("Organizing Network Data...")
 
-    # Create Lists of objects for any resource that could be relevant to a quota count
-    network_data = {
-        'subnets': [Subnet(_) for _ in raw_data.pop('subnetworks')],
-        'instances': [Instance(_) for _ in raw_data.pop('instances')],
-        'forwarding_rules': [ForwardingRule(_) for _ in raw_data.pop('forwarding_rules')],
-    }
-
-    subnets = [_ for _ in network_data['subnets'] if _.purpose == "PRIVATE"]
-    del network_data['subnets']
-
-    forwarding_rules = [_ for _ in network_data['forwarding_rules'] if _.is_internal]
-    del network_data['forwarding_rules']
-
-    # Use the instances list to form list of all instance NICs
-    instance_nics = []
-    for instance in network_data['instances']:
-        instance_nics.extend(instance.nics)
-    del network_data['instances']
+    subnets = [_ for _ in network_data['subnetworks'] if _.purpose == "PRIVATE"]
+    forwarding_rules = get_address_arrays(_ for _ in network_data['forwarding_rules'] if _.is_internal)
+    instance_nics = get_address_arrays(nic for instance in network_data['instances'] for nic in instance.nics)
 
     print("Filtering down to empty subnets...")
+    usage = get_subnet_usage(subnets, instance_nics, forwarding_rules)
     empty_subnets = []
     for subnet in subnets:
-        subnet_key = subnet.key
-        counts = {
-            'instances': [_ for _ in instance_nics if _.subnet_key == subnet_key],
-            'forwarding_rules': [_ for _ in forwarding_rules if _.subnet_key == subnet_key],
-        }
-        if len(counts['instances']) + len(counts['forwarding_rules']) > 0:
+        if sum(usage[subnet.key]['used_ips']) > 0:
             continue
         empty_subnets.append({
             #'key': subnet.key,
@@ -91,10 +45,19 @@ async def main():
     empty_subnets = sorted(empty_subnets, key=lambda x: x.get('network_name', "UNKNOWN"), reverse=False)
     return empty_subnets
 
+
+async def main(refresh: bool = False):
+
+    from reports import run_reports
+
+    _ = await run_reports(['get_empty_subnets'], refresh)
+    return _['get_empty_subnets']
+
 if __name__ == "__main__":
 
+    from sys import argv
     from pprint import pprint
 
-    _ = run(main())
+    _ = run(main(refresh='--refresh' in argv))
     #pprint(_)
     run(write_to_excel({'empty_subnets': {'data': _}}, XLSX_FILE))
@@ -1,5 +1,5 @@
 from asyncio import run, gather
-from aiohttp import ClientSession
+from session_pool import get_session, close_session_pool
 from file_utils import get_settings
 from gcp_utils import get_access_token, get_projects, get_host_project, get_networks, get_subnets, get_subnet_iam_binding
 
@@ -15,7 +15,7 @@ async def main():
     projects = await get_projects(access_token)
     project_numbers_to_id = {p.number: p.id for p in projects}
     
-    session = ClientSession(raise_for_status=False)
+    session = get_session()
 
     # Get the Shared VPC host project for each service project
     tasks = [get_host_project(p.id, access_token, session) for p in projects]
@@ -75,7 +75,7 @@ async def main():
             print("No shared VPC found for project ID", project_id)
             continue
 
-    await session.close()
+    await close_session_pool()
     print("Found", len(orphans), "orphans:", orphans)
     
 
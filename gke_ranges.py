@@ -1,14 +1,115 @@
 #!/usr/bin/env python3
 
 from asyncio import run, gather
-from aiohttp import ClientSession
+from session_pool import get_session, close_session_pool
 from file_utils import get_settings
 from gcp_utils import get_access_token, get_projects, get_service_projects, get_subnets
 
 
 XLSX_FILE = "gke_ranges.xlsx"
-
-async def main() -> list:
+SERVICES_RANGE_PREFIX = "gke-services"
+
+
+class RangeAllocations:
+    """
+    The cluster using each GKE services range, by subnet key and range name.  Built once from the subnets,
+    then kept current from changes to the cluster list rather than rebuilt
+    """
+    def __init__(self, subnets: list):
+
+        self.subnets = {}
+        self.ranges = {}
+        self.clusters = {}  # Subnet key and range name used by each cluster, by cluster ID
+        self.version = None
+        for subnet in sorted(subnets, key=lambda x: x.key):
+            if subnet.purpose == "PRIVATE" and len(subnet.secondary_ranges) > 0:
+                self.subnets[subnet.key] = subnet
+                _ = [r['name'] for r in subnet.secondary_ranges if SERVICES_RANGE_PREFIX in r['name']]
+                self.ranges[subnet.key] = {range_name: None for range_name in _}
+
+    def _release(self, cluster_id: str) -> None:
+
+        subnet_key, range_name = self.clusters.pop(cluster_id)
+        if self.ranges[subnet_key][range_name] == cluster_id:
+            self.ranges[subnet_key][range_name] = None
+
+    def update(self, gke_clusters: list, version: float = None) -> None:
+        """
+        Apply changes to the cluster list: free the ranges of clusters that are gone, and allocate those of
+        new or changed clusters.  Does nothing if the list's version hasn't changed
+        """
+        if version is not None and version == self.version:
+            return
+        current = {}
+        for gke_cluster in gke_clusters:
+            ranges = self.ranges.get(gke_cluster.subnet_key, {})
+            if gke_cluster.services_range in ranges:
+                current[gke_cluster.id] = (gke_cluster.subnet_key, gke_cluster.services_range)
+        for cluster_id in self.clusters.keys() - current.keys():
+            self._release(cluster_id)
+        for cluster_id, (subnet_key, range_name) in current.items():
+            if self.clusters.get(cluster_id) != (subnet_key, range_name):
+                if cluster_id in self.clusters:
+                    self._release(cluster_id)
+                self.ranges[subnet_key][range_name] = cluster_id
+                self.clusters[cluster_id] = (subnet_key, range_name)
+        self.version = version
+
+    def get_range_data(self) -> list:
+
+        range_data = []
+        for subnet_key, ranges in self.ranges.items():
+            for k, v in ranges.items():
+                range_data.append({
+                    'subnet_key': subnet_key,
+                    'range_name': k,
+                    'gke_cluster': v.split('/')[-1] if v else "FREE",
+                })
+        return range_data
+
+    def plan(self, region: str, num_clusters: int = 1) -> dict | None:
+        """
+        Find the subnet in a region with enough free services ranges for a number of new clusters, or None.
+        Picks the one with the fewest free ranges that still fit, so subnets with more room are kept for later
+        """
+        candidates = []
+        for subnet_key, ranges in self.ranges.items():
+            if self.subnets[subnet_key].region == region:
+                free_ranges = [k for k, v in ranges.items() if not v]
+                if len(free_ranges) >= num_clusters:
+                    candidates.append((len(free_ranges), subnet_key, free_ranges))
+        if not candidates:
+            return None
+        num_free_ranges, subnet_key, free_ranges = min(candidates)
+        subnet = self.subnets[subnet_key]
+        return {
+            'subnet_key': subnet_key,
+            'subnet_name': subnet.name,
+            'subnet_region': subnet.region,
+            'subnet_project': subnet.project_id,
+            'network': subnet.network_name,
+            'main_ip_range': subnet.cidr_range,
+            'num_free_ranges': num_free_ranges,
+            'ip_ranges_services': free_ranges[:num_clusters],
+        }
+
+
+_allocations = None
+
+
+def get_range_allocations(subnets: list, gke_clusters: list, subnets_version: float = None,
+                          clusters_version: float = None) -> RangeAllocations:
+    """
+    Get the cached allocations, rebuilt only when the subnets change and otherwise updated from the cluster list
+    """
+    global _allocations
+    if not _allocations or _allocations[0] != subnets_version:
+        _allocations = (subnets_version, RangeAllocations(subnets))
+    _allocations[1].update(gke_clusters, clusters_version)
+    return _allocations[1]
+
+
+async def get_allocations() -> RangeAllocations:
 
     try:
         settings = await get_settings()
@@ -22,17 +123,8 @@ async def main() -> list:
     _ = await get_service_projects(host_project_id, access_token)
     service_projects = [p for p in projects if p.id in _]
 
-    session = ClientSession(raise_for_status=False)
+    session = get_session()
     subnets = await get_subnets(host_project_id, access_token, session=session)
-    subnets = [s for s in subnets if s.purpose == "PRIVATE" and len(s.secondary_ranges) > 0]
-    subnets = sorted(subnets, key=lambda x: x.key, reverse=False)
-
-    subnets_by_key = {s.key: s for s in subnets}
-
-    # Populate a dictionary of range names
-    services_ranges = {}
-    for k, v in subnets_by_key.items():
-        services_ranges[k] = {r['name']: None for r in v.secondary_ranges if 'gke-services' in r['name']}
 
     # Get all GKE Clusters
     gke_clusters = []
@@ -41,34 +133,32 @@ async def main() -> list:
     for p in service_projects:
         if p.gke_clusters:
             gke_clusters.extend(p.gke_clusters)
+    await close_session_pool()
 
     # Populate subnet ranges with the allocated GKE Cluster name
-    for gke_cluster in gke_clusters:
-        services_range = gke_cluster.services_range
-        subnet_key = gke_cluster.subnet_key
-        if subnet := subnets_by_key.get(subnet_key):
-            if services_range in [_['name'] for _ in subnet.secondary_ranges]:
-                services_ranges[subnet_key][services_range] = gke_cluster.id
-
-    range_data = []
-    for subnet_key, ranges in services_ranges.items():
-        for k, v in ranges.items():
-            cluster_name = "FREE"
-            if v:
-                cluster_name = v.split('/')[-1]
-            range_data.append({
-                'subnet_key': subnet_key,
-                'range_name': k,
-                'gke_cluster': cluster_name,
-            })
-    return range_data
+    allocations = RangeAllocations(subnets)
+    allocations.update(gke_clusters)
+    return allocations
+
+
+async def main() -> list:
+
+    _ = await get_allocations()
+    return _.get_range_data()
 
 
 if __name__ == "__main__":
 
+    from sys import argv
     from pprint import pprint
     from file_utils import write_to_excel
 
+    # Given a region and optionally a number of clusters, just show the best subnet for them
+    if len(argv) > 1:
+        allocations = run(get_allocations())
+        pprint(allocations.plan(argv[1], int(argv[2]) if len(argv) > 2 else 1))
+        quit()
+
     _data = run(main())
     pprint(_data)
 
@@ -0,0 +1,309 @@
+import json
+import sqlite3
+from asyncio import Semaphore, gather, to_thread, create_task
+from contextlib import closing
+from pathlib import Path
+from time import time
+from aiohttp import ClientSession
+from fetch_scheduler import get_scheduler
+from json_codec import loads, dumps
+from gcp_utils import get_api_data, iter_api_pages, get_items_path, get_call_urls, parse_api_url, merge_fields
+from gcp_utils import IncompleteResultsError
+from parsing import parse_json
+
+PWD = Path(__file__).parent
+CACHE_FILE = PWD.joinpath("inventory.db")
+DEFAULT_TTL = 3600  # Seconds; override per resource type with 'ttl' in the calls file
+COLUMNS = "(resource_type, project_id, updated, data, fields)"
+ENABLED_SERVICES_CALL = {
+    'api_name': "serviceusage",
+    'calls': ["services?filter=state:ENABLED&fields=services/config/name,nextPageToken"],
+    'ttl': 86400,
+}
+ROUTER_STATUS_TTL = 900  # Seconds before an unchanged router is polled again
+MAX_ROUTER_STATUS_REQUESTS = 25
+
+
+class InventoryCache:
+
+    def __init__(self, db_file: str = CACHE_FILE):
+
+        self.db_file = str(db_file)
+        with closing(self._connect()) as db, db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS inventory (
+                    resource_type TEXT NOT NULL,
+                    project_id TEXT NOT NULL,
+                    updated INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    fields TEXT,
+                    PRIMARY KEY (resource_type, project_id)
+                )
+            """)
+            try:
+                db.execute("ALTER TABLE inventory ADD COLUMN fields TEXT")  # Cache files from before fields existed
+            except sqlite3.OperationalError:
+                pass
+
+    def _connect(self) -> sqlite3.Connection:
+
+        return sqlite3.connect(self.db_file, timeout=30)
+
+    @staticmethod
+    def _has_fields(cached_fields: str | None, fields: list | None) -> bool:
+        """
+        Check if a cached entry, stored with only some fields of each item, has all the fields needed
+        """
+        if cached_fields is None:
+            return True
+        if fields is None:
+            return False
+        cached_fields = json.loads(cached_fields)
+        return merge_fields(cached_fields, fields) == merge_fields(cached_fields)
+
+    def get(self, resource_type: str, project_ids: list = None, ttl: int = DEFAULT_TTL, fields: list = None) -> dict:
+        """
+        Get cached items by project ID, with their age and a staleness flag.
+        Entries that are missing any of the given fields are also flagged as stale
+        """
+        project_ids = set(project_ids) if project_ids is not None else None
+        now = int(time())
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                "SELECT project_id, updated, data, fields FROM inventory WHERE resource_type = ?", (resource_type,)
+            ).fetchall()
+        entries = {}
+        for project_id, updated, data, cached_fields in rows:
+            if project_ids is not None and project_id not in project_ids:
+                continue
+            entries[project_id] = {
+                'items': loads(data),
+                'updated': updated,
+                'age': now - updated,
+                'is_stale': now - updated > ttl or not self._has_fields(cached_fields, fields),
+            }
+        return entries
+
+    def get_staleness(self, resource_type: str, project_ids: list, ttl: int = DEFAULT_TTL, fields: list = None) -> dict:
+        """
+        Get the staleness flag of cached entries by project ID, without loading their items
+        """
+        project_ids = set(project_ids)
+        now = int(time())
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                "SELECT project_id, updated, fields FROM inventory WHERE resource_type = ?", (resource_type,)
+            ).fetchall()
+        return {project_id: now - updated > ttl or not self._has_fields(cached_fields, fields)
+                for project_id, updated, cached_fields in rows if project_id in project_ids}
+
+    def get_json(self, resource_type: str, project_id: str) -> str | None:
+        """
+        Get the cached items for a single project as a JSON list, without decoding them
+        """
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT data FROM inventory WHERE resource_type = ? AND project_id = ?", (resource_type, project_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_items(self, resource_type: str, project_id: str) -> list:
+
+        return loads(_) if (_ := self.get_json(resource_type, project_id)) else []
+
+    def put_json(self, resource_type: str, project_id: str, data: str, fields: list = None) -> None:
+        """
+        Store items for a single project that have already been serialized to a JSON list
+        """
+        row = (resource_type, project_id, int(time()), data, json.dumps(merge_fields(fields)) if fields else None)
+        with closing(self._connect()) as db, db:
+            db.execute(f"INSERT OR REPLACE INTO inventory {COLUMNS} VALUES (?, ?, ?, ?, ?)", row)
+
+    def put(self, resource_type: str, items_by_project: dict, fields: list = None) -> None:
+
+        now = int(time())
+        fields = json.dumps(merge_fields(fields)) if fields else None
+        rows = [(resource_type, k, now, dumps(v), fields) for k, v in items_by_project.items()]
+        with closing(self._connect()) as db, db:
+            db.executemany(f"INSERT OR REPLACE INTO inventory {COLUMNS} VALUES (?, ?, ?, ?, ?)", rows)
+
+    def invalidate(self, resource_type: str = None, project_id: str = None) -> None:
+
+        where = {k: v for k, v in (('resource_type', resource_type), ('project_id', project_id)) if v}
+        sql = "DELETE FROM inventory"
+        if where:
+            sql += " WHERE " + " AND ".join(f"{k} = ?" for k in where)
+        with closing(self._connect()) as db, db:
+            db.execute(sql, tuple(where.values()))
+
+
+_cache = None
+
+
+def get_inventory_cache() -> InventoryCache:
+
+    global _cache
+    if not _cache:
+        _cache = InventoryCache()
+    return _cache
+
+
+async def get_inventory(session: ClientSession, access_token: str, project_ids: list, resource_type: str, call: dict,
+                        refresh: bool = False) -> dict:
+    """
+    Get items of one resource type from the calls file for a list of projects, by project ID.
+    Fresh entries come from the on-disk cache; missing or stale ones are fetched and written back.
+    Projects that fail part way through get their stale copy, or are left out if there isn't one
+    """
+    cache = get_inventory_cache()
+    ttl = call.get('ttl', DEFAULT_TTL)
+    fields = call.get('fields')
+    cached = {} if refresh else await to_thread(cache.get, resource_type, project_ids, ttl, fields)
+    stale = [project_id for project_id in project_ids if project_id not in cached or cached[project_id]['is_stale']]
+
+    async def fetch(url: str) -> list | None:
+        try:
+            return await get_api_data(session, url, access_token, fields=fields)
+        except IncompleteResultsError as e:
+            return None
+
+    urls = {project_id: get_call_urls(project_id, call) for project_id in stale}
+    tasks = [gather(*[fetch(url) for url in _]) for _ in urls.values()]
+    results = await gather(*tasks)
+
+    # Don't overwrite good data in the cache with results that failed part way through
+    fetched = {}
+    for project_id, pages in zip(urls.keys(), results):
+        if None in pages:
+            continue  # Fall back to the stale copy, if there is one
+        fetched[project_id] = [item for items in pages for item in items]
+    if fetched:
+        await to_thread(cache.put, resource_type, fetched, fields)
+
+    return {project_id: fetched[project_id] if project_id in fetched else cached[project_id]['items']
+            for project_id in project_ids if project_id in fetched or project_id in cached}
+
+
+async def get_inventory_objects(session: ClientSession, access_token: str, project_ids: list, resource_type: str,
+                                call: dict, cls, refresh: bool = False, is_enabled=None) -> list:
+    """
+    Get objects of one resource type from the calls file for a list of projects, without decoding any items on the
+    event loop: cached entries, and each page as it's fetched, go to parse_json() as raw JSON.
+    A project's objects are only used once its listing has finished; if it fails part way through, its stale copy
+    is used instead, or nothing if there isn't one, and the failure is left in get_scheduler().errors.
+    If given, is_enabled(project_id) is awaited before fetching a project, which is skipped if it returns False
+    """
+    cache = get_inventory_cache()
+    ttl = call.get('ttl', DEFAULT_TTL)
+    fields = call.get('fields')
+    staleness = {} if refresh else await to_thread(cache.get_staleness, resource_type, project_ids, ttl, fields)
+
+    async def get_cached_objects(project_id: str) -> list:
+        if data := await to_thread(cache.get_json, resource_type, project_id):
+            return (await parse_json(cls, data))[1]
+        return []
+
+    async def get_project_objects(project_id: str) -> list:
+        if staleness.get(project_id, True) is False:
+            return await get_cached_objects(project_id)
+        if is_enabled and not await is_enabled(project_id):
+            return []
+        tasks = []
+        try:
+            for url in get_call_urls(project_id, call):
+                items_key, collection = get_items_path(url)
+                async for page in iter_api_pages(session, url, access_token, fields=fields):
+                    # Parse each page while the next one downloads
+                    tasks.append(create_task(parse_json(cls, page, items_key, collection)))
+            results = await gather(*tasks)
+        except IncompleteResultsError as e:
+            # A partial listing must not look like a complete, smaller one, so fall back to the stale copy
+            return await get_cached_objects(project_id)
+        finally:
+            for task in tasks:
+                task.cancel()
+        items_json = ",".join(_[1:-1] for _, objects in results if _ != "[]")
+        await to_thread(cache.put_json, resource_type, project_id, f"[{items_json}]", fields)
+        return [obj for _, objects in results for obj in objects]
+
+    _ = await gather(*[get_project_objects(project_id) for project_id in project_ids])
+    return [obj for objects in _ for obj in objects]
+
+
+async def get_router_statuses(session: ClientSession, access_token: str, cloud_routers: list,
+                              refresh: bool = False) -> dict:
+    """
+    Call getRouterStatus() for a list of CloudRouter objects concurrently, returning results by router key.
+    Results are cached by router fingerprint, so unchanged routers aren't polled again until the TTL is up.
+    Routers that fail are left out rather than failing the whole batch
+    """
+    cache = get_inventory_cache()
+    resource_type = 'router_status'  # Stored by router key in place of project ID
+    router_keys = [router.key for router in cloud_routers]
+    cached = {} if refresh else await to_thread(cache.get, resource_type, router_keys, ROUTER_STATUS_TTL)
+    semaphore = Semaphore(MAX_ROUTER_STATUS_REQUESTS)
+    errors = get_scheduler().errors
+
+    async def get_router_status(router) -> list | None:
+        if _ := cached.get(router.key):
+            if not _['is_stale'] and _['items'].get('fingerprint') == router.fingerprint:
+                return _['items']['statuses']
+        url = f"/compute/v1/projects/{router.project_id}/regions/{router.region}/routers/{router.name}/getRouterStatus"
+        async with semaphore:
+            try:
+                statuses = await get_api_data(session, url, access_token)
+            except Exception as e:
+                return None
+        if parse_api_url(url)[1] in errors:
+            return None
+        return statuses
+
+    results = await gather(*[get_router_status(router) for router in cloud_routers])
+
+    router_statuses = {}
+    updates = {}
+    for router, statuses in zip(cloud_routers, results):
+        if statuses is None:
+            continue
+        router_statuses[router.key] = statuses
+        if statuses is not cached.get(router.key, {}).get('items', {}).get('statuses'):
+            updates[router.key] = {'fingerprint': router.fingerprint, 'statuses': statuses}
+    if updates:
+        await to_thread(cache.put, resource_type, updates)
+    return router_statuses
+
+
+async def start_enabled_services(session: ClientSession, access_token: str, project_ids: list,
+                                 refresh: bool = False) -> dict:
+    """
+    Start getting the names of the enabled APIs for each project, e.g. 'compute.googleapis.com', cached for a day.
+    Returns a task for each project, so a project's services can be used as soon as they arrive rather than after
+    every project's.  A project whose services couldn't be listed gets an empty set, so nothing gets pruned from it
+    """
+    resource_type = 'enabled_services'
+    call = ENABLED_SERVICES_CALL
+    cached = {} if refresh else await to_thread(get_inventory_cache().get, resource_type, project_ids, call['ttl'])
+
+    async def get_services(project_id: str) -> set:
+        if (_ := cached.get(project_id)) and not _['is_stale']:
+            items = _['items']
+        else:
+            try:
+                _ = await get_inventory(session, access_token, [project_id], resource_type, call, refresh=True)
+            except Exception as e:
+                _ = {}
+            items = _.get(project_id) or cached.get(project_id, {}).get('items', [])  # Else fall back to a stale copy
+        return set(item['config']['name'] for item in items)
+
+    return {project_id: create_task(get_services(project_id)) for project_id in project_ids}
+
+
+async def get_enabled_services(session: ClientSession, access_token: str, project_ids: list,
+                               refresh: bool = False) -> dict:
+    """
+    Get the names of the enabled APIs for each project, e.g. 'compute.googleapis.com', cached for a day.
+    Projects whose services couldn't be listed are left out, so nothing gets pruned from them
+    """
+    tasks = await start_enabled_services(session, access_token, project_ids, refresh)
+    _ = await gather(*tasks.values())
+    return {project_id: services for project_id, services in zip(tasks, _) if services}
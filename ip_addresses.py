@@ -1,40 +1,30 @@
 #!/usr/bin/env python3 
 
 from ipaddress import IPv4Address
-from asyncio import run, gather
-from aiohttp import ClientSession
-from file_utils import get_settings, write_to_excel, get_calls
-from gcp_utils import get_access_token, get_projects, get_api_data, get_instances
-from gcp_classes import Instance, ForwardingRule, CloudRouter, GKECluster, CloudSQL
-
+from asyncio import run
+from file_utils import write_to_excel
+from session_pool import get_session
+from inventory_cache import get_router_statuses
+
+CALLS = ('instances', 'forwarding_rules', 'cloud_routers', 'gke_clusters', 'cloud_sqls')
+API_FIELDS = {
+    'instances': ['name', 'zone', 'selfLink', 'networkInterfaces(name,networkIP,network,subnetwork,accessConfigs)'],
+    'forwarding_rules': ['name', 'region', 'selfLink', 'IPAddress', 'network', 'subnetwork'],
+}
 COLUMNS = ('ip_address', 'type', 'project_id', 'region', 'name', 'network_key')
 SORT_COLUMN = 'ip_address'
 XLSX_FILE = "ip_addresses.xlsx"
 
 
-async def main():
-    
-    try:
-        settings = await get_settings()
-        access_token = await get_access_token(settings.get('key_file'))
-    except Exception as e:
-        quit(e)
-
-    # Create Session and get all projects
-    session = ClientSession(raise_for_status=False)
-    projects = await get_projects(access_token, session=session)
-    calls = await get_calls()
-
+async def get_report(projects: list, network_data: dict, access_token: str = None, refresh: bool = False) -> list:
+    """
+    List every IP address in use, given objects for each resource type in CALLS
+    """
     ip_addresses = []
     print("Gathering IP addresses across", len(projects), "projects...")
 
     print("Getting GCE Instance IPs...")
-    tasks = [project.get_instances(access_token, session=session) for project in projects]
-    _ = await gather(*tasks)
-    instances = []
-    for project in projects:
-        instances.extend(project.instances)
-    for instance in instances:
+    for instance in network_data['instances']:
         for nic in instance.nics:
             _ = {k: getattr(instance, k) for k in ('name', 'project_id', 'region')}
             _.update({
@@ -55,16 +45,7 @@ async def main():
                 ip_addresses.append(_)
 
     print("Getting Forwarding_rules...")
-    urls = []
-    _ = calls.get('forwarding_rules').get('calls')
-    for call in _:
-        urls.extend([f"/compute/v1/projects/{project.id}/{call}" for project in projects])
-    tasks = [get_api_data(session, url, access_token) for url in urls]
-    results = await gather(*tasks)
-    _ = [item for items in results for item in items]  # Flatten results
-    forwarding_rules = [ForwardingRule(_) for _ in _]
-    
-    for forwarding_rule in forwarding_rules:
+    for forwarding_rule in network_data['forwarding_rules']:
         _ = {k: getattr(forwarding_rule, k) for k in ('name', 'project_id', 'region', 'network_key', 'network_name')}
         _.update({
             'ip_address': forwarding_rule.ip_address,
@@ -73,26 +54,12 @@ async def main():
         ip_addresses.append(_)
 
     print("Getting Cloud Routers...")
-    urls = []
-    _ = calls.get('cloud_routers').get('calls')
-    for call in _:
-        urls.extend([f"/compute/v1/projects/{project.id}/{call}" for project in projects])
-    tasks = [get_api_data(session, url, access_token) for url in urls]
-    results = await gather(*tasks)
-    _ = [item for items in results for item in items]  # Flatten results
-    cloud_routers = [CloudRouter(_) for _ in _]
 
     # Have to use getRouterStatus() to view all Cloud NAT IPs
+    cloud_routers = [router for router in network_data['cloud_routers'] if len(router.cloud_nats) > 0]
+    router_statuses = await get_router_statuses(get_session(), access_token, cloud_routers, refresh)
     for router in cloud_routers:
-        if len(router.cloud_nats) == 0:
-            continue
-        project_id = router.project_id
-        url = f"/compute/v1/projects/{project_id}/regions/{router.region}/routers/{router.name}/getRouterStatus"
-        try:
-            _ = await get_api_data(session, url, access_token)
-        except:
-            continue
-        for router_status in _:
+        for router_status in router_statuses.get(router.key, []):
             nat_ips = []
             if nat_statuses := router_status.get('natStatus'):
                 for nat_status in nat_statuses:
@@ -107,12 +74,7 @@ async def main():
                 ip_addresses.append(_)
 
     print("Getting GKE Endpoints...")
-    urls = [f"/v1/projects/{project.id}/locations/-/clusters" for project in projects]
-    tasks = [get_api_data(session, url, access_token) for url in urls]
-    results = await gather(*tasks)
-    _ = [item for items in results for item in items]  # Flatten results
-    gke_clusters = [GKECluster(_) for _ in _]
-    for gke_cluster in gke_clusters:
+    for gke_cluster in network_data['gke_clusters']:
         for endpoint_ip in gke_cluster.endpoint_ips:
             _ = {k: getattr(gke_cluster, k) for k in ('name', 'project_id', 'region', 'network_key', 'network_name')}
             _.update({
@@ -122,15 +84,7 @@ async def main():
             ip_addresses.append(_)
 
     print("Getting Cloud SQL Instances...")
-    urls = [f"https://sqladmin.googleapis.com/v1/projects/{project.id}/instances" for project in projects]
-    tasks = [get_api_data(session, url, access_token) for url in urls]
-    results = await gather(*tasks)
-    _ = [item for items in results for item in items]  # Flatten results
-    cloud_sqls = [CloudSQL(_) for _ in _]
-
-    await session.close()
-
-    for cloud_sql in cloud_sqls:
+    for cloud_sql in network_data['cloud_sqls']:
         for ip_address in cloud_sql.ip_addresses:
             _ = {k: getattr(cloud_sql, k) for k in ('name', 'project_id', 'region', 'network_key', 'network_name')}
             _.update({
@@ -139,20 +93,24 @@ async def main():
             })
             ip_addresses.append(_)
 
-    # Work-around for uncaught scenarios where the IP address isn't set or value is None
-    for _ in ip_addresses:
-        if not _.get('ip_address'):
-            _.update({'ip_address': "192.0.2.0"})
-
-    print("Checkpoint for null values...")
-    ip_addresses = sorted(ip_addresses, key=lambda x: IPv4Address(x[SORT_COLUMN]), reverse=False)
+    # Rows where the IP address isn't set are left empty, and sorted last
+    ip_addresses = sorted(ip_addresses, key=lambda x: (not x[SORT_COLUMN], IPv4Address(x[SORT_COLUMN] or 0)))
     return ip_addresses
 
 
+async def main(refresh: bool = False):
+
+    from reports import run_reports
+
+    _ = await run_reports(['ip_addresses'], refresh)
+    return _['ip_addresses']
+
+
 if __name__ == "__main__":
 
+    from sys import argv
     from collections import Counter
-    data = run(main())
+    data = run(main(refresh='--refresh' in argv))
     ips_by_project = Counter(item['region'] for item in data)
     print(ips_by_project)
     #print([item for item in data if "ems" in item['project_id']])
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+from asyncio import run
+from bisect import bisect_left, bisect_right
+from ipaddress import IPv4Address, IPv4Network
+
+CALLS = ('subnetworks', 'instances', 'forwarding_rules', 'cloud_routers', 'gke_clusters', 'cloud_sqls')
+API_FIELDS = {
+    'instances': ['name', 'zone', 'selfLink', 'networkInterfaces(name,networkIP,network,subnetwork,accessConfigs)'],
+    'forwarding_rules': ['name', 'region', 'selfLink', 'IPAddress', 'network', 'subnetwork'],
+}
+SUBNET_FIELDS = ('name', 'project_id', 'region', 'network_key', 'network_name', 'subnet_key')
+
+
+class _Node:
+
+    __slots__ = ('children', 'entries')
+
+    def __init__(self):
+
+        self.children = [None, None]
+        self.entries = None
+
+
+class IPIndex:
+    """
+    Index of IPv4 addresses and CIDR ranges.  Ranges are kept in a binary prefix trie, so finding every range that
+    contains an address takes at most 32 steps.  Addresses are kept by value, with a sorted copy for range queries
+    """
+    def __init__(self):
+
+        self._root = _Node()
+        self._addresses = {}
+        self._sorted_addresses = None
+        self.num_networks = 0
+
+    def __len__(self):
+        return len(self._addresses) + self.num_networks
+
+    def add_address(self, ip_address: str, entry: dict) -> None:
+
+        self._addresses.setdefault(int(IPv4Address(ip_address)), []).append(entry)
+        self._sorted_addresses = None
+
+    def sort(self) -> None:
+        """
+        Sort addresses for range queries; done once after loading, otherwise on the next range query
+        """
+        self._sorted_addresses = sorted(self._addresses)
+
+    def add_network(self, cidr_range: str, entry: dict) -> None:
+
+        network = IPv4Network(cidr_range, strict=False)
+        bits = int(network.network_address)
+        node = self._root
+        for i in range(network.prefixlen):
+            bit = (bits >> (31 - i)) & 1
+            if not node.children[bit]:
+                node.children[bit] = _Node()
+            node = node.children[bit]
+        if node.entries is None:
+            node.entries = []
+        node.entries.append(entry)
+        self.num_networks += 1
+
+    def _walk(self, bits: int, prefix_length: int) -> tuple[list, _Node | None]:
+        """
+        Follow the trie to a prefix, returning entries for ranges that contain it (most specific first),
+        and the prefix's node if there is one
+        """
+        covering = []
+        node = self._root
+        for i in range(prefix_length + 1):
+            if node.entries:
+                covering.extend(node.entries)
+            if i == prefix_length or not (node := node.children[(bits >> (31 - i)) & 1]):
+                break
+        covering.reverse()
+        return covering, node
+
+    def lookup(self, ip_address: str) -> dict:
+        """
+        Get what owns an IP address, and every range that contains it
+        """
+        bits = int(IPv4Address(ip_address))
+        networks, _ = self._walk(bits, 32)
+        return {
+            'ip_address': ip_address,
+            'addresses': self._addresses.get(bits, []),
+            'networks': networks,  # The first is the longest prefix match
+        }
+
+    def search(self, cidr_range: str) -> dict:
+        """
+        Get all addresses and ranges within a CIDR range, plus ranges that contain it
+        """
+        network = IPv4Network(cidr_range, strict=False)
+        first, last = int(network.network_address), int(network.broadcast_address)
+        covering, node = self._walk(first, network.prefixlen)
+        if node and node.entries:
+            covering = covering[len(node.entries):]  # Exact matches for the range itself are counted as within it
+        within = []
+        nodes = [node] if node else []
+        while nodes:
+            _ = nodes.pop()
+            if _.entries:
+                within.extend(_.entries)
+            nodes.extend(child for child in reversed(_.children) if child)
+        if self._sorted_addresses is None:
+            self.sort()
+        _ = self._sorted_addresses
+        addresses = [self._addresses[bits] for bits in _[bisect_left(_, first):bisect_right(_, last)]]
+        return {
+            'cidr_range': str(network),
+            'addresses': [entry for entries in addresses for entry in entries],
+            'networks': within,
+            'covering_networks': covering,
+        }
+
+    def query(self, text: str) -> dict:
+        """
+        Lookup a single address, or search a range if given in CIDR format
+        """
+        return self.search(text) if '/' in text else self.lookup(text)
+
+
+async def get_report(projects: list, network_data: dict, access_token: str = None, refresh: bool = False) -> IPIndex:
+    """
+    Index every IP address in use and every subnet range, given objects for each resource type in CALLS
+    """
+    from ip_addresses import get_report as get_ip_addresses
+
+    ip_index = IPIndex()
+
+    print("Indexing Subnet ranges...")
+    for subnet in network_data['subnetworks']:
+        _ = {k: getattr(subnet, k) for k in SUBNET_FIELDS}
+        if subnet.cidr_range:
+            ip_index.add_network(subnet.cidr_range, _ | {'cidr_range': subnet.cidr_range, 'type': "Subnet"})
+        for secondary_range in subnet.secondary_ranges:
+            ip_index.add_network(secondary_range['range'], _ | {
+                'cidr_range': secondary_range['range'],
+                'type': "Subnet Secondary Range",
+                'range_name': secondary_range['name'],
+            })
+
+    for row in await get_ip_addresses(projects, network_data, access_token, refresh):
+        if not row['ip_address']:
+            continue
+        try:
+            ip_index.add_address(row['ip_address'], row)
+        except ValueError as e:
+            continue  # Not an IPv4 address
+    ip_index.sort()
+    print("Indexed", len(ip_index), "IP addresses and ranges")
+    return ip_index
+
+
+async def main(refresh: bool = False) -> IPIndex:
+
+    from reports import run_reports
+
+    _ = await run_reports(['ip_index'], refresh)
+    return _['ip_index']
+
+
+if __name__ == "__main__":
+
+    from sys import argv
+    from pprint import pprint
+    from time import perf_counter
+
+    queries = [arg for arg in argv[1:] if not arg.startswith('--')]
+    if not queries:
+        quit(f"Usage: {argv[0]} <ip address or cidr range> ... [--refresh]")
+    ip_index = run(main(refresh='--refresh' in argv))
+    for query in queries:
+        start = perf_counter()
+        _ = ip_index.query(query)
+        pprint(_ | {'milliseconds': round((perf_counter() - start) * 1000, 3)})
@@ -0,0 +1,115 @@
+import json
+from functools import cache
+
+try:
+    import msgspec
+except Exception as e:
+    msgspec = None
+try:
+    import orjson
+except Exception as e:
+    orjson = None
+
+# Use the fastest JSON library that's installed
+if msgspec:
+    JSON_BACKEND = "msgspec"
+    loads = msgspec.json.Decoder().decode
+    dumps = lambda _: msgspec.json.encode(_).decode()
+elif orjson:
+    JSON_BACKEND = "orjson"
+    loads = orjson.loads
+    dumps = lambda _: orjson.dumps(_).decode()
+else:
+    JSON_BACKEND = "json"
+    loads = json.loads
+    dumps = json.dumps
+
+STRUCTS = {}
+
+if msgspec:
+
+    class PageToken(msgspec.Struct):
+        nextPageToken: str | None = None
+
+    _page_token_decoder = msgspec.json.Decoder(PageToken)
+
+    # Only the fields that the gcp_classes models read; everything else is skipped while decoding
+    class AccessConfig(msgspec.Struct, omit_defaults=True):
+        name: str | None = None
+        type: str | None = None
+        natIP: str | None = None
+
+    class NetworkInterface(msgspec.Struct, omit_defaults=True):
+        kind: str | None = None
+        name: str | None = None
+        networkIP: str | None = None
+        network: str | None = None
+        subnetwork: str | None = None
+        accessConfigs: list[AccessConfig] | None = None
+
+    class Instance(msgspec.Struct, omit_defaults=True):
+        name: str | None = None
+        description: str | None = None
+        labels: dict[str, str] | None = None
+        kind: str | None = None
+        creationTimestamp: str | None = None
+        zone: str | None = None
+        selfLink: str | None = None
+        machineType: str | None = None
+        canIpForward: bool | None = None
+        status: str | None = None
+        networkInterfaces: list[NetworkInterface] | None = None
+
+    class ForwardingRule(msgspec.Struct, omit_defaults=True):
+        name: str | None = None
+        description: str | None = None
+        labels: dict[str, str] | None = None
+        kind: str | None = None
+        creationTimestamp: str | None = None
+        region: str | None = None
+        selfLink: str | None = None
+        IPAddress: str | None = None
+        loadBalancingScheme: str | None = None
+        target: str | None = None
+        portRange: str | None = None
+        ports: list[str] | None = None
+        network: str | None = None
+        subnetwork: str | None = None
+
+    STRUCTS = {
+        'instances': Instance,
+        'forwardingRules': ForwardingRule,
+    }
+
+
+@cache
+def _get_page_decoder(items_key: str, collection: str, is_aggregated: bool):
+
+    item_type = list[STRUCTS[collection]]
+    if is_aggregated:
+        scope = msgspec.defstruct(f"{collection}Scope", [(collection, item_type | None, None)], omit_defaults=True)
+        item_type = dict[str, scope]
+    page = msgspec.defstruct(
+        f"{collection}Page", [(items_key, item_type | None, None), ('nextPageToken', str | None, None)], omit_defaults=True
+    )
+    return msgspec.json.Decoder(page)
+
+
+def get_page_token(data: bytes) -> str | None:
+    """
+    Get the nextPageToken of a raw page of API results.  With msgspec the items are skipped over rather than decoded
+    """
+    if msgspec:
+        return _page_token_decoder.decode(data).nextPageToken
+    return loads(data).get('nextPageToken')
+
+
+def get_typed_loads(items_key: str, collection: str, is_aggregated: bool = False):
+    """
+    Get a function that decodes a page of API results straight into the typed structs for a collection,
+    then converts it to a dictionary shaped like the untyped page.  Returns None if there are no structs for it
+    """
+    if not (msgspec and items_key and collection in STRUCTS):
+        return None
+    decoder = _get_page_decoder(items_key, collection, is_aggregated)
+    return lambda _: msgspec.to_builtins(decoder.decode(_))
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 from asyncio import run, gather
-from aiohttp import ClientSession
+from session_pool import get_session, close_session_pool
 from file_utils import get_settings, write_to_excel, get_calls
 from gcp_utils import get_access_token, get_projects, get_api_data
 from gcp_classes import Network, PSAConnection
@@ -21,7 +21,7 @@ async def main():
 
     projects = await get_projects(access_token)
 
-    session = ClientSession(raise_for_status=False)
+    session = get_session()
 
     # Get all networks
     urls = [f"https://compute.googleapis.com/compute/v1/projects/{p.id}/global/networks" for p in projects]
@@ -37,9 +37,6 @@ async def main():
             for k in list(SERVICES.keys()):
                 if k in peering.get('network'):
                     networks.append(network)
-    await session.close()
-
-    session = ClientSession(raise_for_status=False)
 
     urls.clear()
     for service in SERVICES.values():
@@ -50,7 +47,7 @@ async def main():
     _ = await gather(*tasks)
     _ = [item for items in _ for item in items]  # Flatten results
     _psas = [PSAConnection(item) for item in _]
-    await session.close()
+    await close_session_pool()
 
     return _psas
 
@@ -0,0 +1,57 @@
+from collections import Counter, defaultdict
+from typing import Callable, Iterable
+
+INDEX_KEYS = ('network_key', 'subnet_key', 'project_id', 'region')
+
+
+class NetworkIndex:
+
+    def __init__(self, items: Iterable = (), keys: tuple = INDEX_KEYS):
+
+        self.keys = keys
+        self.items = []
+        self._index = {k: defaultdict(list) for k in keys}
+        self.extend(items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def add(self, item) -> None:
+
+        self.items.append(item)
+        for k, index in self._index.items():
+            index[getattr(item, k, None)].append(item)
+
+    def extend(self, items: Iterable) -> None:
+
+        for item in items:
+            self.add(item)
+
+    def get(self, key: str, value) -> list:
+        """
+        Get all items where the attribute 'key' is equal to value
+        """
+        return self._index[key].get(value, [])
+
+    def count(self, key: str, value) -> int:
+
+        return len(self._index[key].get(value, []))
+
+    def filter(self, condition: Callable) -> "NetworkIndex":
+        """
+        Return a new index with just the items matching a condition
+        """
+        return NetworkIndex((item for item in self.items if condition(item)), self.keys)
+
+    def group_by(self, *keys: str) -> Counter:
+        """
+        Count items by one or more attributes; with multiple keys, the Counter is keyed by tuples
+        """
+        if len(keys) == 1 and keys[0] in self._index:
+            return Counter({k: len(v) for k, v in self._index[keys[0]].items()})
+        if len(keys) == 1:
+            return Counter(getattr(item, keys[0], None) for item in self.items)
+        return Counter(tuple(getattr(item, k, None) for k in keys) for item in self.items)
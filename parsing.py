@@ -0,0 +1,127 @@
+from asyncio import get_running_loop, sleep
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from multiprocessing import get_all_start_methods, get_context
+from os import cpu_count
+from gcp_classes import GCPObject
+from json_codec import loads, dumps
+
+PARSE_BATCH_SIZE = 500  # Items to parse before letting the event loop run other tasks
+PARSE_WORKERS = (cpu_count() or 1) - 1  # Leave a core for the event loop; with none spare, parse inline
+# Workers start from a clean process, not a fork of one with a running event loop and open connections
+START_METHOD = "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+
+_pool = None
+
+
+class _Records(list):
+    """
+    Records of nested objects, such as an Instance's NICs, so they can be told apart from plain lists
+    """
+
+
+def get_page_items(json_data: dict | list, items_key: str = None, collection: str = None) -> list:
+    """
+    Get the items from a decoded page of API results, given where gcp_utils.get_items_path() says they are.
+    A list, such as a cached entry, is already the items
+    """
+    if isinstance(json_data, list):
+        return json_data
+    if collection:
+        return [item for _ in json_data.get(items_key, {}).values() for item in _.get(collection, [])]
+    if items_key:
+        return json_data.get(items_key, [])
+    return [json_data]  # API returned a dictionary
+
+
+@cache
+def _get_slots(cls) -> tuple:
+
+    slots = []
+    for c in reversed(cls.__mro__):
+        slots.extend(_ for _ in c.__dict__.get('__slots__', ()) if _ not in slots)
+    return tuple(slots)
+
+
+def to_record(obj: GCPObject) -> tuple:
+    """
+    Get a compact record of a model object: its class and a tuple of its slot values, with ... for unset slots
+    """
+    values = []
+    for k in _get_slots(type(obj)):
+        value = getattr(obj, k, ...)
+        if type(value) is list and value and isinstance(value[0], GCPObject):
+            value = _Records(to_record(_) for _ in value)
+        values.append(value)
+    return type(obj), tuple(values)
+
+
+def from_record(record: tuple) -> GCPObject:
+    """
+    Rebuild a model object from its to_record() record
+    """
+    cls, values = record
+    obj = cls.__new__(cls)
+    for k, value in zip(_get_slots(cls), values):
+        if value is ...:
+            continue
+        if type(value) is _Records:
+            value = [from_record(_) for _ in value]
+        setattr(obj, k, value)
+    return obj
+
+
+def _parse(cls, data: bytes | str, items_key: str | None, collection: str | None, as_records: bool) -> tuple:
+    """
+    Decode a raw page or a JSON list of items and build objects from the items, or records of them.
+    For a page, the items are also returned as a JSON list
+    """
+    json_data = loads(data)
+    items = get_page_items(json_data, items_key, collection)
+    items_json = None if isinstance(json_data, list) else dumps(items)
+    objects = [cls(item) for item in items]
+    return items_json, [to_record(_) for _ in objects] if as_records else objects
+
+
+def get_parse_pool() -> ProcessPoolExecutor | None:
+    """
+    Get the shared pool of parse workers, or None if there's no core to spare for one
+    """
+    global _pool
+    if not _pool and PARSE_WORKERS > 0:
+        _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=get_context(START_METHOD))
+    return _pool
+
+
+def close_parse_pool() -> None:
+
+    global _pool
+    if _pool:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def parse_json(cls, data: bytes | str, items_key: str = None, collection: str = None) -> tuple[str | None, list]:
+    """
+    Build objects from a raw page of API results, or a JSON list of items such as a cached entry.
+    Decoding and building run in a worker process: only the raw JSON goes in, and compact records come back to be
+    rebuilt into objects on the loop, so it keeps reading pages while the other cores parse.
+    Returns the items as a JSON list for the cache (None if the JSON was already a list), and the objects
+    """
+    if pool := get_parse_pool():
+        as_records = issubclass(cls, GCPObject)  # Anything else is pickled whole
+        _ = await get_running_loop().run_in_executor(pool, _parse, cls, data, items_key, collection, as_records)
+        items_json, objects = _
+        return items_json, [from_record(record) for record in objects] if as_records else objects
+    return _parse(cls, data, items_key, collection, False)
+
+
+async def parse_items(cls, items: list) -> list:
+    """
+    Create objects from a list of already decoded API items on the event loop, giving way after every batch
+    """
+    objects = []
+    for i in range(0, len(items), PARSE_BATCH_SIZE):
+        objects.extend(cls(item) for item in items[i:i + PARSE_BATCH_SIZE])
+        await sleep(0)
+    return objects
@@ -1,16 +1,45 @@
 #!/usr/bin/env python3 
 
 import yaml
+import json
+from hashlib import sha1
 from time import time
 from gcloud.aio.storage import Storage
 from asyncio import run, gather
-from aiohttp import ClientSession
-from file_utils import get_settings, get_calls, write_file, write_data_file
+from file_utils import get_settings, get_calls, write_file, read_data_file, write_data_file
 from gcp_utils import get_access_token, get_projects, get_api_data, get_project_from_account_key
+from session_pool import get_session
+from gcp_utils import get_call_urls, has_api_enabled
+from inventory_cache import get_enabled_services
 #from gcp_classes import Instance, ForwardingRule, CloudRouter, GKECluster
 
+SNAPSHOT_FILE = "rancid_snapshot.json"
+CHANGE_LOG_FILE = "rancid_changes.yaml"
 
-async def main():
+
+def get_signature(item: dict) -> str:
+    """
+    Get a short value that changes whenever the resource changes
+    """
+    if fingerprint := item.get('fingerprint'):
+        return f"{item.get('id')}:{item.get('creationTimestamp')}:{fingerprint}"
+    # No fingerprint on this resource type, so hash the whole thing
+    return sha1(json.dumps(item, sort_keys=True).encode()).hexdigest()
+
+
+def compare_signatures(previous: dict, current: dict) -> dict:
+    """
+    Given two dictionaries of item name -> signature, return names that were added, changed, or deleted
+    """
+    _ = {
+        'added': sorted(k for k in current if k not in previous),
+        'changed': sorted(k for k in current if k in previous and current[k] != previous[k]),
+        'deleted': sorted(k for k in previous if k not in current),
+    }
+    return {k: v for k, v in _.items() if v}
+
+
+async def main(incremental: bool = False):
 
     try:
         settings = await get_settings()
@@ -50,19 +79,23 @@ async def main():
             quit(e)
 
     calls = await get_calls()
+    session = get_session()
+
+    # Skip resource types whose API isn't enabled in a project
+    _ = [get_enabled_services(session, project.get('access_token'), [project_id]) for project_id, project in projects.items()]
+    enabled_services = {k: v for _ in await gather(*_) for k, v in _.items()}
 
     # Generate the URls for each Project
     for project_id, project in projects.items():
         urls = []
         for k, v in calls.items():
-            for call in v.get('calls', []):
-                urls.append(f"/compute/v1/projects/{project_id}/{call}")
+            if has_api_enabled(project_id, v, enabled_services):
+                urls.extend(get_call_urls(project_id, v))
         project['urls'] = urls
         projects.update({project_id: project})
 
     tasks = []
     urls = []
-    session = ClientSession(raise_for_status=False)
     for project in projects.values():
         access_token = project.get('access_token')
         _ = project.get('urls', [])
@@ -71,10 +104,10 @@ async def main():
         urls.extend(_)
 
     # Make the API calls
-    raw_data = await gather(*tasks)
-    await session.close()
+    raw_data = await gather(*tasks, return_exceptions=True)
 
-    data_by_url = dict(zip(urls, raw_data))
+    failed_urls = {url for url, _ in zip(urls, raw_data) if isinstance(_, Exception)}
+    data_by_url = {url: _ for url, _ in zip(urls, raw_data) if url not in failed_urls}
     del raw_data
 
     # Organize the raw data by project
@@ -82,23 +115,45 @@ async def main():
         project['data'] = {}
         for k, v in calls.items():
             _ = f'{project_id}/{k}'
-            urls = [f"/compute/v1/projects/{project_id}/{call}" for call in v.get('calls', [])]
             data = []
-            for url in urls:
-                data.extend(data_by_url[url])
+            for url in get_call_urls(project_id, v):
+                data.extend(data_by_url.get(url, []))
             project['data'][k] = data
         projects.update({project_id: project})
 
+    # Compare to the last run's snapshot so only changed files get written and uploaded
+    incremental = incremental or settings.get('incremental', False)
+    snapshot = await read_data_file(SNAPSHOT_FILE, "json") if incremental else {}
+    changes = []
+    changed = {project_id: [] for project_id in projects.keys()}
+    for project_id, project in projects.items():
+        for k, v in calls.items():
+            snapshot_key = f'{project_id}/{k}'
+            if any(url in failed_urls for url in get_call_urls(project_id, v)):
+                continue  # Partial data would look like deletes, so leave the last copy alone
+            signatures = {item.get('selfLink', item.get('name')): get_signature(item) for item in project['data'][k]}
+            if incremental and snapshot_key in snapshot:
+                if not (_ := compare_signatures(snapshot[snapshot_key], signatures)):
+                    continue
+            else:
+                _ = {'added': sorted(signatures.keys())}
+            changes.append({'project_id': project_id, 'resource_type': k} | _)
+            changed[project_id].append(k)
+            snapshot[snapshot_key] = signatures
+    print("Found changes in", sum(len(_) for _ in changed.values()), "files")
+
     # Write to local disk
     file_format = settings.get('file_format', 'yaml')
     tasks = []
     for project_id, project in projects.items():
-        for k in calls.keys():
+        for k in changed[project_id]:
             file_name = f'{project_id}/{k}.{file_format}'
             data = project['data'][k]
             #tasks.append(write_data_file(file_name, data))
             tasks.append(write_data_file(file_name, data))
     await gather(*tasks)
+    await write_data_file(SNAPSHOT_FILE, snapshot, "json")
+    await write_data_file(CHANGE_LOG_FILE, {'timestamp': int(time()), 'changes': changes})
 
     #print({k: v.get('bucket_name') for k, v in projects.items()})
 
@@ -107,12 +162,14 @@ async def main():
     buckets = {k: (v.get('bucket_name'), v.get('bucket_prefix'), v.get('key_file')) for k, v in projects.items() if v.get('bucket_name')}
     #print(buckets)
     for project_id, bucket in buckets.items():
+        if not changed[project_id]:
+            continue
         try:
             bucket_name = bucket[0]
             bucket_prefix = bucket[1]
             service_file = bucket[2]
             async with Storage(service_file=service_file) as storage:
-                storage_objects = {f'{project_id}/{k}.{file_format}': projects[project_id]['data'][k] for k in calls.keys()}
+                storage_objects = {f'{project_id}/{k}.{file_format}': projects[project_id]['data'][k] for k in changed[project_id]}
                 if bucket_prefix:
                     bucket_prefix.replace('/', "")
                     storage_objects.update({f'{bucket_prefix}/{k}': v for k, v in storage_objects.items()})
@@ -133,5 +190,7 @@ async def main():
 
 if __name__ == "__main__":
 
-    _ = run(main())
+    from sys import argv
+
+    _ = run(main(incremental='--incremental' in argv))
 
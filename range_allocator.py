@@ -0,0 +1,141 @@
+from array import array
+from ipaddress import IPv4Address
+from time import time
+from subnet_usage import get_range_bounds
+
+GKE_MASTER_PREFIX_LENGTH = 28
+ALLOCATION_TTL = 86400  # Seconds an allocated range is held for a cluster that hasn't been created
+
+
+class RangeAllocator:
+    """
+    Allocates fixed-size blocks, e.g. /28s for GKE master ranges, from a pool such as 10.0.0.0/16.
+    A binary tree of free block counts sits over a bitmap of the blocks, so finding the lowest free block,
+    reserving and releasing are all O(log n)
+    """
+    def __init__(self, pool: str, prefix_length: int = GKE_MASTER_PREFIX_LENGTH):
+
+        self.pool = pool
+        self.prefix_length = prefix_length
+        self.first, last = get_range_bounds(pool)
+        self.block_size = 2 ** (32 - prefix_length)
+        self.num_blocks = (last - self.first + 1) // self.block_size
+        assert self.num_blocks > 0, f"Pool '{pool}' is smaller than a /{prefix_length}"
+        self.owners = {}     # Owner of each used block, by block number
+        self.allocated = {}  # Ranges handed out by allocate(), which may not exist yet, by range
+        self.allocated_at = {}  # When each of those was handed out
+
+        # Node 1 is the root, and node n has children 2n and 2n + 1; the leaves are 1 if free, 0 if used
+        self._size = 1 << (self.num_blocks - 1).bit_length()
+        self._free = array('I', [0]) * (2 * self._size)
+        self._free[self._size:self._size + self.num_blocks] = array('I', [1]) * self.num_blocks
+        for node in range(self._size - 1, 0, -1):
+            self._free[node] = self._free[2 * node] + self._free[2 * node + 1]
+
+    def __len__(self):
+        return self.num_blocks
+
+    @property
+    def num_free(self) -> int:
+        return self._free[1]
+
+    def _set(self, block: int, is_free: bool) -> None:
+
+        node = self._size + block
+        self._free[node] = int(is_free)
+        node //= 2
+        while node:
+            self._free[node] = self._free[2 * node] + self._free[2 * node + 1]
+            node //= 2
+
+    def _get_blocks(self, cidr_range: str) -> range:
+        """
+        Get the numbers of the blocks that a range overlaps, if any are in the pool
+        """
+        first, last = get_range_bounds(cidr_range)
+        first = max(first, self.first) - self.first
+        last = min(last - self.first, self.num_blocks * self.block_size - 1)
+        return range(first // self.block_size, last // self.block_size + 1) if first <= last else range(0)
+
+    def _get_range(self, block: int) -> str:
+
+        return f"{IPv4Address(self.first + block * self.block_size)}/{self.prefix_length}"
+
+    def is_free(self, cidr_range: str) -> bool:
+
+        return all(self._free[self._size + block] for block in self._get_blocks(cidr_range))
+
+    def reserve(self, cidr_range: str, owner: str = None) -> None:
+        """
+        Mark every block overlapping a range as used, e.g. an existing cluster's master range
+        """
+        for block in self._get_blocks(cidr_range):
+            self._set(block, False)
+            self.owners[block] = owner
+
+    def release(self, cidr_range: str) -> None:
+
+        for block in self._get_blocks(cidr_range):
+            self._set(block, True)
+            self.owners.pop(block, None)
+        self.allocated.pop(cidr_range, None)
+        self.allocated_at.pop(cidr_range, None)
+
+    def get_first_free(self) -> str | None:
+        """
+        Get the lowest free block without using it, or None if the pool is full
+        """
+        if not self._free[1]:
+            return None
+        node = 1
+        while node < self._size:
+            node = 2 * node if self._free[2 * node] else 2 * node + 1
+        return self._get_range(node - self._size)
+
+    def allocate(self, owner: str = None) -> str | None:
+        """
+        Use the lowest free block, returning its range, or None if the pool is full
+        """
+        if cidr_range := self.get_first_free():
+            self.reserve(cidr_range, owner)
+            self.allocated[cidr_range] = owner
+            self.allocated_at[cidr_range] = time()
+        return cidr_range
+
+    def expire(self, ttl: float = ALLOCATION_TTL) -> list:
+        """
+        Release ranges allocated more than ttl seconds ago, returning them
+        """
+        expired = [k for k, allocated_at in self.allocated_at.items() if time() - allocated_at > ttl]
+        for cidr_range in expired:
+            self.release(cidr_range)
+        return expired
+
+
+_allocators = {}
+
+
+def get_master_range_allocator(pool: str, gke_clusters: list, network_key: str = None,
+                               version: float = None) -> RangeAllocator:
+    """
+    Get the allocator for a pool of GKE master ranges, built from discovered clusters (optionally just those in one
+    network) once per version of the cluster list.  Ranges allocated since the last build that no cluster uses yet
+    are carried over, so they aren't handed out twice, until they're released or expire after ALLOCATION_TTL
+    """
+    k = (pool, network_key)
+    if (_ := _allocators.get(k)) and _[0] == version:
+        _[1].expire()
+        return _[1]
+    allocator = RangeAllocator(pool, GKE_MASTER_PREFIX_LENGTH)
+    for gke_cluster in gke_clusters:
+        if gke_cluster.master_range and (not network_key or gke_cluster.network_key == network_key):
+            allocator.reserve(gke_cluster.master_range, gke_cluster.id)
+    if _:
+        _[1].expire()
+        for cidr_range, owner in _[1].allocated.items():
+            if allocator.is_free(cidr_range):
+                allocator.reserve(cidr_range, owner)
+                allocator.allocated[cidr_range] = owner
+                allocator.allocated_at[cidr_range] = _[1].allocated_at[cidr_range]
+    _allocators[k] = (version, allocator)
+    return allocator
@@ -1,42 +1,36 @@
 #!/usr/bin/env python3 
 
 from time import time
-from asyncio import run, gather
-from aiohttp import ClientSession
-from file_utils import get_settings
-from gcp_utils import get_access_token, get_projects, get_api_data
-from gcp_classes import FirewallRule
+from asyncio import run
 
+CALLS = ('firewall_rules',)
+API_FIELDS = {
+    'firewall_rules': ['name', 'selfLink', 'creationTimestamp'],
+}
 DAYS_THRESHOLD = 14
 
 
-async def main():
-
-    try:
-        settings = await get_settings()
-        access_token = await get_access_token(settings.get('key_file'))
-    except Exception as e:
-        quit(e)
-
-    projects = await get_projects(access_token)
-    urls = [f"/compute/v1/projects/{p.id}/global/firewalls" for p in projects]
-    session = ClientSession(raise_for_status=False)
-    tasks = [get_api_data(session, url, access_token) for url in urls]
-    _ = await gather(*tasks)
-    _ = [item for items in _ for item in items]  # Flatten results
-    await session.close()
-    firewall_rules = [FirewallRule(_) for _ in _]
+async def get_report(projects: list, network_data: dict, access_token: str = None, refresh: bool = False) -> list:
 
     recents = []
     now = int(time())
-    for r in firewall_rules:
+    for r in network_data['firewall_rules']:
         if now - r.creation_timestamp < 3600 * 24 * DAYS_THRESHOLD:
             recents.append({k: getattr(r, k) for k in ('project_id','name','creation')})
     return recents
 
+
+async def main(refresh: bool = False):
+
+    from reports import run_reports
+
+    _ = await run_reports(['recent_firewall_rules'], refresh)
+    return _['recent_firewall_rules']
+
 if __name__ == "__main__":
 
+    from sys import argv
     from pprint import pprint
 
-    _ = run(main())
+    _ = run(main(refresh='--refresh' in argv))
     pprint(_)
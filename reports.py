@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+from asyncio import run, gather
+from importlib import import_module
+from file_utils import get_settings, write_to_excel, get_calls
+from gcp_utils import get_access_token, get_projects, has_api_enabled, merge_fields
+from session_pool import get_session
+from gcp_classes import *
+from inventory_cache import get_inventory_objects, start_enabled_services
+
+REPORTS = ('check_quotas', 'get_empty_subnets', 'ip_addresses', 'recent_firewall_rules', 'list_access_configs',
+           'dump_network_data', 'ip_index', 'cidr_overlaps')
+CLASSES = {
+    'vpc_networks': Network,
+    'subnetworks': Subnet,
+    'firewall_rules': FirewallRule,
+    'instances': Instance,
+    'forwarding_rules': ForwardingRule,
+    'cloud_routers': CloudRouter,
+    'vpn_tunnels': VPNTunnel,
+    'cloud_vpn_gateways': CloudVPNGateway,
+    'peer_vpn_gateways': PeerVPNGateway,
+    'gke_clusters': GKECluster,
+    'cloud_sqls': CloudSQL,
+    'global_addresses': Address,
+}
+
+
+def get_crawl_plan(reports: list, calls: dict) -> dict:
+    """
+    Get the union of resource types needed by a list of reports, so each is only fetched once, with the fields
+    needed by all of them. A report's CALLS of None means every resource type in the calls file.
+    Fields come from a report's API_FIELDS, or the 'fields' of the calls file entry; None means the whole item
+    """
+    plan = {}
+    for report in reports:
+        module = import_module(report)
+        _ = getattr(module, 'CALLS', None)
+        for resource_type in _ if _ is not None else calls.keys():
+            if resource_type not in calls:
+                continue
+            fields = getattr(module, 'API_FIELDS', {}).get(resource_type, calls[resource_type].get('fields'))
+            plan[resource_type] = merge_fields(plan[resource_type], fields) if resource_type in plan else fields
+    return plan
+
+
+async def crawl(plan: dict, calls: dict, project_ids: list, access_token: str, refresh: bool = False) -> dict:
+    """
+    Fetch each resource type in a crawl plan once for all projects, and parse items into objects, by resource type.
+    Projects that don't have a resource type's API enabled aren't fetched.  Each project's enabled services are
+    checked alongside the fetches, so a project only waits for its own check
+    """
+    session = get_session()
+    enabled_services = await start_enabled_services(session, access_token, project_ids, refresh)
+
+    async def get_objects(resource_type: str) -> list:
+        cls = CLASSES.get(resource_type, GCPNetworkItem)
+        call = calls[resource_type] | {'fields': plan[resource_type]}
+
+        async def is_enabled(project_id: str) -> bool:
+            return has_api_enabled(project_id, call, {project_id: await enabled_services[project_id]})
+
+        return await get_inventory_objects(session, access_token, project_ids, resource_type, call, cls, refresh,
+                                           is_enabled)
+
+    try:
+        _ = await gather(*[get_objects(resource_type) for resource_type in plan])
+    finally:
+        for task in enabled_services.values():
+            task.cancel()
+    return dict(zip(plan, _))
+
+
+async def get_network_data(reports: list, refresh: bool = False) -> tuple[list, dict, str]:
+    """
+    Crawl everything needed by one or more reports, returning the projects, objects by resource type,
+    and access token
+    """
+    try:
+        settings = await get_settings()
+        access_token = await get_access_token(settings.get('key_file'))
+    except Exception as e:
+        quit(e)
+
+    if unknown := [report for report in reports if report not in REPORTS]:
+        raise ValueError(f"Unknown report(s): {unknown}")
+
+    projects = await get_projects(access_token)
+    calls = await get_calls()
+    plan = get_crawl_plan(reports, calls)
+    print(f"Gathering {len(plan)} resource types across {len(projects)} projects for {len(reports)} reports...")
+    network_data = await crawl(plan, calls, [project.id for project in projects], access_token, refresh)
+    return projects, network_data, access_token
+
+
+async def run_reports(reports: list, refresh: bool = False) -> dict:
+    """
+    Run one or more reports from a single crawl, returning the result of each report by name
+    """
+    projects, network_data, access_token = await get_network_data(reports, refresh)
+
+    # Every report gets the same parsed objects
+    results = {}
+    for report in reports:
+        get_report = import_module(report).get_report
+        results[report] = await get_report(projects, network_data, access_token, refresh)
+    return results
+
+
+if __name__ == "__main__":
+
+    from sys import argv
+
+    _ = [arg for arg in argv[1:] if not arg.startswith('--')]
+    results = run(run_reports(_ if _ else REPORTS, refresh='--refresh' in argv))
+    for report, result in results.items():
+        # Reports that return a list of rows are saved as a single sheet workbook
+        if isinstance(result, list) and (xlsx_file := getattr(import_module(report), 'XLSX_FILE', None)):
+            run(write_to_excel({report.removeprefix('get_'): {'data': result}}, xlsx_file))
+        print(f"{report}: {len(result) if result else 0} results")
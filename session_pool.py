@@ -0,0 +1,107 @@
+from asyncio import get_running_loop
+from collections import Counter
+from weakref import WeakKeyDictionary
+from aiohttp import ClientSession, TCPConnector, TraceConfig
+
+MAX_CONNECTIONS = 100
+MAX_CONNECTIONS_PER_HOST = 50
+KEEPALIVE_TIMEOUT = 60  # Seconds to keep an idle connection open for re-use
+DNS_CACHE_TTL = 300
+
+
+def make_connector() -> TCPConnector:
+    """
+    Create a connector with capped connections, keep-alive, and cached DNS lookups
+    """
+    try:
+        from aiohttp import AsyncResolver
+        resolver = AsyncResolver()   # Requires aiodns
+    except Exception as e:
+        resolver = None
+    return TCPConnector(
+        limit=MAX_CONNECTIONS,
+        limit_per_host=MAX_CONNECTIONS_PER_HOST,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        use_dns_cache=True,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        resolver=resolver,
+    )
+
+
+class SessionPool:
+
+    def __init__(self):
+
+        self.connector = make_connector()
+        self.sessions = {}
+        self.counts = Counter()
+        self.trace_config = TraceConfig()
+        self.trace_config.on_request_start.append(self._count('requests'))
+        self.trace_config.on_connection_create_end.append(self._count('new_connections'))
+        self.trace_config.on_connection_reuseconn.append(self._count('reused_connections'))
+        self.trace_config.on_dns_cache_miss.append(self._count('dns_lookups'))
+
+    def _count(self, k: str):
+
+        async def _(session, context, params):
+            self.counts[k] += 1
+        return _
+
+    def get_session(self, raise_for_status: bool = False) -> ClientSession:
+        """
+        Get a long-lived session; all sessions in the pool share one connector.  Sessions don't raise for status by
+        default, since iter_api_data() checks the status itself to decide whether to retry
+        """
+        session = self.sessions.get(raise_for_status)
+        if not session or session.closed:
+            session = ClientSession(
+                connector=self.connector,
+                connector_owner=False,
+                raise_for_status=raise_for_status,
+                trace_configs=[self.trace_config],
+            )
+            self.sessions[raise_for_status] = session
+        return session
+
+    async def close(self) -> None:
+
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
+        await self.connector.close()
+
+    def get_metrics(self) -> dict:
+
+        requests = self.counts['requests']
+        return {
+            'requests': requests,
+            'new_connections': self.counts['new_connections'],
+            'reused_connections': self.counts['reused_connections'],
+            'dns_lookups': self.counts['dns_lookups'],
+            'handshakes_per_request': round(self.counts['new_connections'] / requests, 3) if requests else 0,
+        }
+
+
+_pools = WeakKeyDictionary()
+
+
+def get_session_pool() -> SessionPool:
+    """
+    Get the session pool for the running event loop
+    """
+    loop = get_running_loop()
+    if loop not in _pools or _pools[loop].connector.closed:
+        _pools[loop] = SessionPool()
+    return _pools[loop]
+
+
+def get_session(raise_for_status: bool = False) -> ClientSession:
+
+    return get_session_pool().get_session(raise_for_status)
+
+
+async def close_session_pool() -> None:
+
+    loop = get_running_loop()
+    if pool := _pools.pop(loop, None):
+        await pool.close()
@@ -320,10 +320,13 @@ async def main(profile: str):
     assert subnet['region'] == region, f"Selected subnet '{subnet_id}' is not in region '{region}'"
     assert subnet['project_id'] == host_project_id, f"Selected subnet '{subnet_id}' is not in project '{host_project_id}'"
 
-    used_master_ranges = {_['master_range']: _['id'] for _ in gke_clusters}
-    _ = list(ipaddress.ip_network(gke_master_range).subnets(new_prefix=28))
-    for gke_master_range in _:
-        if not used_master_ranges.get(gke_master_range):
+    # Master ranges are strings, so convert them to compare; stop at the first free /28 rather than listing them all
+    used_master_ranges = set()
+    for _ in gke_clusters:
+        if _['master_range'] and _['master_range'] != "N/A":
+            used_master_ranges.add(ipaddress.ip_network(_['master_range']))
+    for gke_master_range in ipaddress.ip_network(gke_master_range).subnets(new_prefix=28):
+        if gke_master_range not in used_master_ranges:
             break
 
     output = {
@@ -0,0 +1,120 @@
+from asyncio import Task, create_task, gather, shield, sleep
+from email.utils import formatdate
+from time import time
+
+REFRESH_INTERVAL = 900  # Default seconds between background reloads of each dataset
+RETRY_INTERVAL = 60     # Wait this long before retrying a failed reload
+
+
+class Snapshot:
+
+    __slots__ = ('data', 'timestamp')
+
+    def __init__(self, data, timestamp: float):
+
+        self.data = data
+        self.timestamp = timestamp
+
+    @property
+    def last_modified(self) -> str:
+        return formatdate(self.timestamp, usegmt=True)  # HTTP date format, for the Last-Modified header
+
+
+class Dataset:
+    """
+    A dataset that's reloaded in the background, so requests can be served from the last good snapshot
+    """
+    def __init__(self, name: str, loader, interval: int = REFRESH_INTERVAL):
+
+        self.name = name
+        self.loader = loader
+        self.interval = interval
+        self.snapshot: Snapshot | None = None
+        self.exception: Exception | None = None
+        self._refreshing: Task | None = None
+        self._refresher: Task | None = None
+
+    async def _load(self) -> None:
+
+        try:
+            self.snapshot = Snapshot(await self.loader(), time())
+            self.exception = None
+        except Exception as e:
+            self.exception = e  # Keep serving the last good snapshot, if there is one
+
+    def refresh(self) -> Task:
+        """
+        Start a reload unless one is already running; concurrent callers share it
+        """
+        if not self._refreshing or self._refreshing.done():
+            self._refreshing = create_task(self._load())
+        return self._refreshing
+
+    async def get(self, refresh: bool = False) -> Snapshot:
+        """
+        Get the last good snapshot straight away, optionally starting a reload that isn't waited on.
+        Only waits if there isn't a snapshot yet
+        """
+        if refresh or not self.snapshot:
+            task = self.refresh()
+        if not self.snapshot:
+            await shield(task)  # A cancelled request mustn't cancel the load that other requests are waiting on
+            if self.exception:
+                raise self.exception
+        return self.snapshot
+
+    async def _refresh_in_background(self) -> None:
+
+        while True:
+            await self.refresh()
+            await sleep(min(RETRY_INTERVAL, self.interval) if self.exception else self.interval)
+
+    def start(self) -> None:
+
+        if not self._refresher or self._refresher.done():
+            self._refresher = create_task(self._refresh_in_background())
+
+    async def stop(self) -> None:
+
+        for task in (self._refresher, self._refreshing):
+            if task and not task.done():
+                task.cancel()
+        await gather(*[_ for _ in (self._refresher, self._refreshing) if _], return_exceptions=True)
+
+    def get_metrics(self) -> dict:
+
+        return {
+            'age': round(time() - self.snapshot.timestamp) if self.snapshot else None,
+            'interval': self.interval,
+            'refreshing': bool(self._refreshing and not self._refreshing.done()),
+            'error': str(self.exception) if self.exception else None,
+        }
+
+
+_datasets = {}
+
+
+def start_background_refresh(loaders: dict, interval: int = REFRESH_INTERVAL) -> None:
+    """
+    Start reloading each dataset every interval seconds, given a dictionary of name: async loader function
+    """
+    for name, loader in loaders.items():
+        if name not in _datasets:
+            _datasets[name] = Dataset(name, loader, interval)
+        _datasets[name].start()
+
+
+async def stop_background_refresh() -> None:
+
+    await gather(*[dataset.stop() for dataset in _datasets.values()])
+    _datasets.clear()
+
+
+async def get_snapshot(name: str, refresh: bool = False) -> Snapshot:
+
+    return await _datasets[name].get(refresh)
+
+
+def get_snapshot_metrics() -> dict:
+
+    return {name: dataset.get_metrics() for name, dataset in _datasets.items()}
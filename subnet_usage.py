@@ -0,0 +1,82 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain
+from operator import sub
+from socket import inet_aton
+from sys import byteorder
+from typing import Iterable
+
+RESERVED_IPS = (2, 2)  # GCP reserves the network and gateway addresses, plus the last two in each primary range
+
+
+def ip_to_int(ip_address: str) -> int:
+
+    return int.from_bytes(inet_aton(ip_address), 'big')
+
+
+def get_range_bounds(cidr_range: str) -> tuple[int, int]:
+    """
+    Get the first and last IPs of an IPv4 CIDR range, as integers
+    """
+    ip_address, prefix_length = cidr_range.split('/')
+    size = 2 ** (32 - int(prefix_length))
+    first = ip_to_int(ip_address) & -size
+    return first, first + size - 1
+
+
+def to_int_array(ip_addresses: Iterable[str]) -> array:
+    """
+    Convert IPv4 addresses to a sorted array of integers, without a Python-level call per address
+    """
+    _ = array('I', b"".join(map(inet_aton, ip_addresses)))
+    if byteorder == "little":
+        _.byteswap()  # inet_aton() gives network byte order
+    return array('I', sorted(_))
+
+
+def get_address_arrays(items: Iterable) -> dict:
+    """
+    Get a sorted array of integer IPv4 addresses for each network, from objects with ip_address and network_key
+    """
+    addresses = {}
+    for item in items:
+        if (ip_address := item.ip_address) and item.network_key and ":" not in ip_address:
+            addresses.setdefault(item.network_key, []).append(ip_address)
+    return {k: to_int_array(v) for k, v in addresses.items()}
+
+
+def get_subnet_usage(subnets: Iterable, *address_arrays: dict) -> dict:
+    """
+    Get IP usage of each subnet's primary range by subnet key, given dictionaries of sorted address arrays by
+    network key, e.g. one for instance NICs and one for forwarding rules.  Addresses count towards a subnet if
+    they're in the same network and within its usable range.  Each address array is bucketed by bisection,
+    so it's never scanned per subnet:
+        used_ips: count of addresses in range, from each address array
+        largest_free_block: the longest run of usable IPs not in any address array
+        fragmentation: the share of free IPs outside the largest free block
+    """
+    usage = {}
+    empty = array('I')
+    for subnet in subnets:
+        _ = {'used_ips': [0] * len(address_arrays), 'largest_free_block': 0, 'fragmentation': 0}
+        usage[subnet.key] = _
+        if not subnet.cidr_range:
+            continue
+        first, last = get_range_bounds(subnet.cidr_range)
+        first += RESERVED_IPS[0]
+        last -= RESERVED_IPS[1]
+        # Subnet ranges are only unique within a network, so addresses are bucketed per network
+        slices = [
+            a[bisect_left(a, first):bisect_right(a, last)]
+            for a in (addresses.get(subnet.network_key, empty) for addresses in address_arrays)
+        ]
+        _['used_ips'] = [len(s) for s in slices]
+        # Slices are already sorted, so this is a merge of sorted runs rather than a full sort
+        used = slices[0] if len(slices) == 1 else sorted(chain(*slices))
+        # Gaps between consecutive used IPs, with the ends of the usable range as fenceposts; 0 means a duplicate
+        gaps = list(map(sub, chain(used, (last + 1,)), chain((first - 1,), used)))
+        largest_free_block = max(gaps) - 1
+        free_ips = last - first + 1 - (len(used) - gaps.count(0))
+        _['largest_free_block'] = max(largest_free_block, 0)
+        _['fragmentation'] = round(1 - largest_free_block / free_ips, 3) if free_ips > 0 else 0
+    return usage
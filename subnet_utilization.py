@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 
 from asyncio import run, gather
-from aiohttp import ClientSession
+from session_pool import get_session, close_session_pool
 from file_utils import get_settings, write_to_excel, get_calls
 from gcp_utils import get_access_token, get_projects, get_service_projects, get_instances, get_subnets
+from network_index import NetworkIndex
 
 
 async def main():
@@ -19,7 +20,7 @@ async def main():
     host_project_id = settings.get('host_project_id')
     service_projects = await get_service_projects(host_project_id, access_token)
     print(service_projects)
-    session = ClientSession(raise_for_status=False)
+    session = get_session()
 
     service_projects = [sp for sp in service_projects if project_ids.get(sp)]
     print(f"Found {len(service_projects)} Service Projects after filtering")
@@ -31,24 +32,21 @@ async def main():
     for data in _:
         instances.extend(data)
 
-    used_subnetworks = []
+    instance_nics = NetworkIndex(keys=('subnet_key',))
     for i in instances:
-        for nic in i.nics:
-            used_subnetworks.append(nic.subnet_key)
+        instance_nics.extend(i.nics)
 
     subnets = await get_subnets(host_project_id, access_token, session)
-    subnets = {s.key: s for s in subnets if s.key in used_subnetworks}
+    subnets = {s.key: s for s in subnets if instance_nics.count('subnet_key', s.key) > 0}
 
-    await session.close()
+    await close_session_pool()
 
     matches = {s: [] for s in subnets.keys()}
     for subnet_key, subnet in subnets.items():
         attached_projects = []
-        for instance in instances:
-            for nic in instance.nics:
-                if nic.subnet_key == subnet_key:
-                    if instance.project_id not in attached_projects:
-                        attached_projects.append(instance.project_id)
+        for nic in instance_nics.get('subnet_key', subnet_key):
+            if nic.project_id not in attached_projects:
+                attached_projects.append(nic.project_id)
         if len(attached_projects) > 0:
             matches[subnet_key].extend(attached_projects)
     _ = {k: v for k, v in matches.items() if len(v) > 0}
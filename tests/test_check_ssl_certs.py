@@ -0,0 +1,10 @@
+from check_ssl_certs import get_planned_urls
+
+
+def test_planned_urls():
+
+    assert get_planned_urls("p", "sslCertificates", []) == ["/compute/v1/projects/p/global/sslCertificates"]
+    # Any regional scope makes one aggregated call cheaper than global plus per-region calls
+    for regions in (["us-central1"], ["us-central1", "europe-west1"]):
+        assert get_planned_urls("p", "targetHttpsProxies", regions) == \
+            ["/compute/v1/projects/p/aggregated/targetHttpsProxies"]
@@ -0,0 +1,73 @@
+from ipaddress import IPv4Network
+from random import Random
+from types import SimpleNamespace
+from cidr_overlaps import get_peerings, find_overlaps, RangeIndex
+
+NETWORKS = ("host/vpc-a", "host/vpc-b", "host/vpc-c", "other/vpc-d")
+PEERINGS = {"host/vpc-a": {"host/vpc-b"}, "host/vpc-b": {"host/vpc-a", "other/vpc-d"}}
+
+
+def make_range(name: str, cidr_range: str, network_key: str) -> dict:
+
+    return {'name': name, 'cidr_range': cidr_range, 'network_key': network_key, 'project_id': network_key.split('/')[0],
+            'region': "us-central1", 'type': "Subnet"}
+
+
+def can_route(a: dict, b: dict) -> bool:
+
+    return a['network_key'] == b['network_key'] or b['network_key'] in PEERINGS.get(a['network_key'], ()) or \
+        a['network_key'] in PEERINGS.get(b['network_key'], ())
+
+
+def test_get_peerings():
+
+    network = SimpleNamespace(key="host/vpc-a", peerings=[
+        {'network': "https://www.googleapis.com/compute/v1/projects/other/global/networks/vpc-d"},
+        {'name': "no-network"},
+    ])
+    assert get_peerings([network]) == {"host/vpc-a": {"other/vpc-d"}}
+
+
+def test_find_overlaps_matches_brute_force():
+
+    random = Random(1)
+    ranges = []
+    for i in range(400):
+        _ = IPv4Network((random.randint(0x0A000000, 0x0A0FFFFF), random.randint(14, 28)), strict=False)
+        ranges.append(make_range(f"range-{i}", str(_), random.choice(NETWORKS)))
+
+    expected = set()
+    for i, a in enumerate(ranges):
+        for b in ranges[i + 1:]:
+            if can_route(a, b) and IPv4Network(a['cidr_range']).overlaps(IPv4Network(b['cidr_range'])):
+                expected.add(frozenset((a['name'], b['name'])))
+
+    overlaps = find_overlaps(ranges, PEERINGS)
+    found = [frozenset((_['name'], _['overlaps_name'])) for _ in overlaps]
+    assert len(found) == len(set(found))
+    assert set(found) == expected
+    for _ in overlaps:
+        assert _['is_peered'] == (_['network_key'] != _['overlaps_network_key'])
+
+
+def test_find_overlaps_skips_unpeered_networks():
+
+    ranges = [make_range("a", "10.0.0.0/24", "host/vpc-a"), make_range("c", "10.0.0.0/25", "host/vpc-c")]
+    assert find_overlaps(ranges, PEERINGS) == []
+    ranges.append(make_range("b", "10.0.0.128/25", "host/vpc-b"))
+    assert [(_['name'], _['overlaps_name']) for _ in find_overlaps(ranges, PEERINGS)] == [("a", "b")]
+
+
+def test_range_index_check():
+
+    ranges = [
+        make_range("a", "10.0.0.0/16", "host/vpc-a"),
+        make_range("b", "10.0.1.0/24", "host/vpc-b"),
+        make_range("c", "10.0.2.0/24", "host/vpc-c"),
+    ]
+    range_index = RangeIndex(ranges, PEERINGS)
+    assert len(range_index) == 3
+    assert sorted(_['name'] for _ in range_index.check("10.0.0.0/22")) == ["a", "b", "c"]
+    assert sorted(_['name'] for _ in range_index.check("10.0.0.0/22", "host/vpc-a")) == ["a", "b"]
+    assert [_['name'] for _ in range_index.check("10.0.2.128/25", "host/vpc-c")] == ["c"]
+    assert range_index.check("192.168.0.0/24") == []
@@ -0,0 +1,66 @@
+from asyncio import run, gather, sleep
+from collections import Counter
+from time import monotonic
+from fetch_scheduler import TokenBucket, FetchScheduler, RATE_DECREASE_FACTOR, RATE_INCREASE_STEP
+
+
+def test_slow_down_and_speed_up():
+
+    bucket = TokenBucket(10.0, min_rate=1.0)
+    bucket.slow_down()
+    assert bucket.rate == 10.0 * RATE_DECREASE_FACTOR
+    for _ in range(10):
+        bucket.slow_down()
+    assert bucket.rate == 1.0
+    bucket.speed_up()
+    assert bucket.rate == 1.0 + RATE_INCREASE_STEP
+    for _ in range(100):
+        bucket.speed_up()
+    assert bucket.rate == 10.0
+
+
+def test_acquire_is_rate_limited():
+
+    async def main():
+        bucket = TokenBucket(50.0)
+        start = monotonic()
+        for _ in range(100):
+            await bucket.acquire()
+        # The first 50 come from a full bucket, the rest at 50 per second
+        assert 0.9 <= monotonic() - start <= 1.5
+
+    run(main())
+
+
+def test_acquire_waits_for_retry_after():
+
+    async def main():
+        bucket = TokenBucket(100.0)
+        bucket.slow_down(retry_after=0.2)
+        start = monotonic()
+        await bucket.acquire()
+        assert monotonic() - start >= 0.2
+
+    run(main())
+
+
+def test_slot_limits_concurrency():
+
+    async def main():
+        api_rates = {'compute': 1000.0, 'container': 1000.0}
+        scheduler = FetchScheduler(max_concurrent=5, api_limits={'compute': 3}, api_rates=api_rates)
+        peaks = Counter()
+
+        async def request(api_name: str):
+            async with scheduler.slot(api_name):
+                peaks[api_name] = max(peaks[api_name], scheduler.in_flight[api_name])
+                await sleep(0.01)
+
+        await gather(*[request('compute') for _ in range(20)], *[request('container') for _ in range(20)])
+        assert peaks['compute'] == 3
+        assert scheduler.peak_in_flight == 5
+        _ = scheduler.get_metrics()
+        assert (_['completed'], _['in_flight'], _['queue_depth']) == (40, 0, 0)
+        assert _['apis']['compute']['limit'] == 3
+
+    run(main())
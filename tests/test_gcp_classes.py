@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta, timezone
+from random import Random
+from gcp_classes import parse_timestamp, format_timestamp
+
+
+def test_parse_timestamp_matches_stdlib():
+
+    random = Random(1)
+    start = datetime(2015, 1, 1, tzinfo=timezone.utc)
+    for _ in range(2000):
+        offset = timedelta(minutes=random.choice((0, 60, -420, 330, 345, -600)))
+        dt = (start + timedelta(seconds=random.randint(0, 400000000))).astimezone(timezone(offset))
+        timestamp = dt.isoformat(timespec=random.choice(('seconds', 'milliseconds', 'microseconds')))
+        if offset == timedelta(0) and random.random() < 0.5:
+            timestamp = timestamp.replace('+00:00', 'Z')
+        assert parse_timestamp(timestamp) == int(datetime.fromisoformat(timestamp).timestamp()), timestamp
+
+
+def test_parse_timestamp_passthrough():
+
+    assert parse_timestamp(None) == 0
+    assert parse_timestamp("") == 0
+    assert parse_timestamp(1700000000) == 1700000000
+
+
+def test_format_timestamp():
+
+    assert format_timestamp(0) == "1970-01-01 00:00:00"
+    assert format_timestamp(parse_timestamp("2024-05-01T10:11:12.345-07:00")) == "2024-05-01 17:11:12"
+
+
+def make_certificate(common_name: str = None, days: int = 365) -> tuple[str, datetime]:
+
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    attributes = [x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Example")]
+    if common_name:
+        attributes.append(x509.NameAttribute(NameOID.COMMON_NAME, common_name))
+    name = x509.Name(attributes)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()).not_valid_before(now - timedelta(days=1)) \
+        .not_valid_after(now + timedelta(days=days)).sign(key, hashes.SHA256())
+    return cert.public_bytes(serialization.Encoding.PEM).decode(), now + timedelta(days=days)
+
+
+def ssl_cert_item(name: str, expire_time: datetime, **kwargs) -> dict:
+
+    return {
+        'name': name,
+        'selfLink': f"https://www.googleapis.com/compute/v1/projects/my-project/global/sslCertificates/{name}",
+        'creationTimestamp': "2024-01-01T00:00:00.000-08:00",
+        'expireTime': expire_time.isoformat(),
+    } | kwargs
+
+
+def test_ssl_cert_decodes_pem_lazily():
+
+    from hashlib import sha256
+    from gcp_classes import SSLCert, _parsed_certificates
+
+    certificate, expire_time = make_certificate("www.example.com")
+    ssl_cert = SSLCert(ssl_cert_item("self-managed", expire_time, type="SELF_MANAGED", certificate=certificate))
+    key = sha256(certificate.encode('utf-8')).digest()
+    assert key not in _parsed_certificates
+    assert ssl_cert.cn == "www.example.com"
+    assert key in _parsed_certificates
+    assert ssl_cert.subject == "CN=www.example.com,O=Example"
+    assert ssl_cert.issuer == ssl_cert.subject
+    assert ssl_cert.expire_timestamp == int(expire_time.timestamp())
+    assert not ssl_cert.is_expired and not ssl_cert.is_expiring_soon
+    assert 'cn' in ssl_cert.to_dict() and '_certificate' not in ssl_cert.to_dict()
+
+
+def test_ssl_cert_managed_and_san():
+
+    from gcp_classes import SSLCert
+
+    certificate, expire_time = make_certificate(days=10)
+    managed = SSLCert(ssl_cert_item("managed", expire_time, type="MANAGED", certificate=certificate,
+                                    managed={'domains': ["a.example.com"]}))
+    assert (managed.issuer, managed.cn, managed.subject) == ("Google", "a.example.com", "UNKNOWN")
+    assert managed.is_expiring_soon and not managed.is_expired
+    san = SSLCert(ssl_cert_item("san", expire_time - timedelta(days=20), certificate=certificate,
+                                subjectAlternativeNames=["b.example.com"]))
+    assert san.cn == "b.example.com"
+    assert san.is_expired
+    assert SSLCert(ssl_cert_item("none", expire_time)).cn == "UNKNOWN"
+
+
+def instance_item(name: str) -> dict:
+
+    return {
+        'name': name,
+        'zone': "https://www.googleapis.com/compute/v1/projects/my-project/zones/us-central1-a",
+        'selfLink': f"https://www.googleapis.com/compute/v1/projects/my-project/zones/us-central1-a/instances/{name}",
+        'creationTimestamp': "2024-01-01T00:00:00.000-08:00",
+        'machineType': "zones/us-central1-a/machineTypes/e2-small",
+        'networkInterfaces': [{
+            'name': "nic0",
+            'network': "https://www.googleapis.com/compute/v1/projects/host/global/networks/vpc",
+            'subnetwork': "https://www.googleapis.com/compute/v1/projects/host/regions/us-central1/subnetworks/s",
+            'networkIP': "10.0.0.2",
+            'accessConfigs': [{'name': "External NAT", 'type': "ONE_TO_ONE_NAT", 'natIP': "203.0.113.1"}],
+        }],
+    }
+
+
+def test_slots_and_to_dict():
+
+    from gcp_classes import Instance
+
+    item = instance_item("vm-1")
+    instance = Instance(item)
+    assert not hasattr(instance, '__dict__')
+    assert set(item['networkInterfaces'][0]) == {'name', 'network', 'subnetwork', 'networkIP', 'accessConfigs'}
+    _ = instance.to_dict()
+    assert (_['name'], _['key'], _['machine_type'], _['creation']) == \
+        ("vm-1", "my-project/us-central1-a/vm-1", "e2-small", "2024-01-01 08:00:00")
+    nic = instance.nics[0].to_dict()
+    assert (nic['name'], nic['ip_address'], nic['external_ip_address']) == ("vm-1-nic0", "10.0.0.2", "203.0.113.1")
+    assert (nic['network_key'], nic['zone'], nic['region']) == ("host/vpc", "us-central1-a", "us-central1")
+
+
+def test_repeated_strings_are_interned():
+
+    from gcp_classes import Instance
+
+    a, b = Instance(instance_item("vm-1")), Instance(instance_item("vm-2"))
+    assert a.project_id is b.project_id and a.zone is b.zone and a.region is b.region
+    assert a.nics[0].network_key is b.nics[0].network_key
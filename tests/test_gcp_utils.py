@@ -0,0 +1,244 @@
+from asyncio import run, create_task, gather, sleep
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from aiohttp import web, ClientSession
+from aiohttp.test_utils import TestServer
+import pytest
+import gcp_utils
+from gcp_utils import get_api_data, parse_retry_after, IncompleteResultsError, has_api_enabled, get_call_urls, parse_api_url
+from fetch_scheduler import get_scheduler
+
+RATE_LIMIT_ERROR = {'error': {'code': 403, 'errors': [{'reason': "rateLimitExceeded"}], 'status': "PERMISSION_DENIED"}}
+API_DISABLED_ERROR = {'error': {'code': 403, 'errors': [{'reason': "accessNotConfigured"}]}}
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+
+    monkeypatch.setattr(gcp_utils, 'BACKOFF_BASE', 0.001)
+    monkeypatch.setattr(gcp_utils, 'MAX_RETRIES', 2)
+
+
+async def fetch(responses: list, raise_for_status: bool) -> tuple[list, list]:
+    """
+    Call get_api_data against a local server that gives each response in turn, returning the items and requests
+    """
+    requests = []
+
+    async def handler(request):
+        requests.append(dict(request.query))
+        status, body = responses[min(len(requests), len(responses)) - 1]
+        return web.json_response(body, status=status)
+
+    app = web.Application()
+    app.router.add_get('/v1/items', handler)
+    async with TestServer(app) as server:
+        async with ClientSession(raise_for_status=raise_for_status) as session:
+            items = await get_api_data(session, str(server.make_url('/v1/items')), "token", items_key="items")
+    return items, requests
+
+
+@pytest.mark.parametrize('raise_for_status', [True, False])
+def test_rate_limited_403_is_retried(raise_for_status):
+
+    async def main():
+        responses = [(403, RATE_LIMIT_ERROR), (403, RATE_LIMIT_ERROR), (200, {'items': [{'name': "a"}]})]
+        items, requests = await fetch(responses, raise_for_status)
+        scheduler = get_scheduler()
+        assert items == [{'name': "a"}]
+        assert len(requests) == 3
+        assert scheduler.throttled['127'] == 2
+        assert scheduler.bucket('127').rate < scheduler.bucket('127').max_rate
+
+    run(main())
+
+
+def test_api_not_enabled_gives_no_items():
+
+    async def main():
+        items, requests = await fetch([(403, API_DISABLED_ERROR)], raise_for_status=True)
+        assert items == []
+        assert len(requests) == 1
+        assert list(get_scheduler().errors.values())[0]['reason'] == "accessNotConfigured"
+
+    run(main())
+
+
+def test_failed_retries_raise():
+
+    async def main():
+        with pytest.raises(IncompleteResultsError):
+            await fetch([(503, {})], raise_for_status=False)
+
+    run(main())
+
+
+def test_failed_later_page_raises():
+
+    async def main():
+        responses = [(200, {'items': [{'name': "a"}], 'nextPageToken': "2"}), (404, {})]
+        with pytest.raises(IncompleteResultsError) as e:
+            await fetch(responses, raise_for_status=False)
+        assert e.value.status == 404
+
+    run(main())
+
+
+def test_truncated_body_is_retried():
+
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        if len(requests) > 1:
+            return web.json_response({'items': [{'name': "a"}]})
+        # Promise more than is sent, then drop the connection
+        response = web.StreamResponse(headers={'Content-Type': "application/json"})
+        response.content_length = 100
+        await response.prepare(request)
+        await response.write(b'{"items": [')
+        request.transport.close()
+        return response
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/v1/items', handler)
+        async with TestServer(app) as server:
+            async with ClientSession() as session:
+                items = await get_api_data(session, str(server.make_url('/v1/items')), "token", items_key="items")
+        assert items == [{'name': "a"}]
+        assert len(requests) == 2
+
+    run(main())
+
+
+def test_parse_retry_after():
+
+    assert parse_retry_after("120") == 120.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    _ = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 <= parse_retry_after(_) <= 30
+    _ = format_datetime(datetime.now(timezone.utc) - timedelta(seconds=30), usegmt=True)
+    assert parse_retry_after(_) == 0.0
+
+
+def test_identical_concurrent_calls_share_one_fetch():
+
+    async def main():
+        requests = []
+
+        async def handler(request):
+            requests.append(1)
+            await sleep(0.05)
+            return web.json_response({'items': [{'name': "a"}]})
+
+        app = web.Application()
+        app.router.add_get('/v1/items', handler)
+        async with TestServer(app) as server:
+            url = str(server.make_url('/v1/items'))
+            async with ClientSession() as session:
+                calls = [create_task(get_api_data(session, url, "token", items_key="items")) for _ in range(5)]
+                other = create_task(get_api_data(session, url, "other-token", items_key="items"))
+                await sleep(0.01)
+                calls[0].cancel()  # Mustn't cancel the fetch the others are waiting on
+                results = await gather(*calls[1:], other)
+        assert len(requests) == 2
+        assert all(_ == [{'name': "a"}] for _ in results)
+        assert len(set(id(_) for _ in results)) == len(results)  # Each caller gets its own list
+        assert get_scheduler().coalesced['127'] == 4
+
+    run(main())
+
+
+def test_iter_api_data_streams_pages():
+
+    from gcp_utils import iter_api_data
+
+    pages = {
+        None: {'items': {'zones/a': {'instances': [{'name': "1"}, {'name': "2"}]}, 'zones/b': {}}, 'nextPageToken': "2"},
+        "2": {'items': {'zones/b': {'instances': [{'name': "3"}]}}},
+    }
+
+    async def main():
+        requests = []
+        fields = set()
+
+        async def handler(request):
+            requests.append(request.query.get('pageToken'))
+            fields.add(request.query.get('fields'))
+            return web.json_response(pages[request.query.get('pageToken')])
+
+        app = web.Application()
+        app.router.add_get('/v1/aggregated/instances', handler)
+        async with TestServer(app) as server:
+            url = str(server.make_url('/v1/aggregated/instances'))
+            async with ClientSession() as session:
+                items = []
+                async for item in iter_api_data(session, url, "token", items_key="items", fields=['name']):
+                    if not items:
+                        await sleep(0.05)
+                        assert requests == [None, "2"]  # The next page is fetched while this one is consumed
+                    items.append(item['name'])
+        assert items == ["1", "2", "3"]
+        assert fields == {"items/*/instances(name),nextPageToken"}
+
+    run(main())
+
+
+def test_iter_api_pages_yields_raw_json():
+
+    from json import loads
+    from gcp_utils import iter_api_pages, get_items_path
+
+    pages = {
+        None: {'items': [{'name': "1"}], 'nextPageToken': "2"},
+        "2": {'items': [{'name': "2"}]},
+    }
+
+    async def main():
+        async def handler(request):
+            return web.json_response(pages[request.query.get('pageToken')])
+
+        app = web.Application()
+        app.router.add_get('/v1/instances', handler)
+        async with TestServer(app) as server:
+            url = str(server.make_url('/v1/instances'))
+            async with ClientSession() as session:
+                return [page async for page in iter_api_pages(session, url, "token", items_key="items")]
+
+    _ = run(main())
+    assert all(isinstance(page, bytes) for page in _)
+    assert [loads(page) for page in _] == list(pages.values())
+    assert get_items_path("/compute/v1/projects/p/aggregated/instances") == ("items", "instances")
+    assert get_items_path("/compute/v1/projects/p/global/networks") == ("items", None)
+    assert get_items_path("/compute/v1/projects/p/getXpnHost") == (None, None)
+
+
+def test_has_api_enabled():
+
+    enabled_services = {'a': {"compute.googleapis.com"}, 'b': set()}
+    assert has_api_enabled('a', {'calls': ["global/networks"]}, enabled_services)
+    assert not has_api_enabled('a', {'api_name': "container", 'calls': []}, enabled_services)
+    # Projects with unknown or empty service lists are never pruned
+    assert has_api_enabled('b', {'api_name': "container"}, enabled_services)
+    assert has_api_enabled('c', {'api_name': "sqladmin"}, enabled_services)
+
+
+def test_get_call_urls():
+
+    assert get_call_urls("p", {'calls': ["global/networks", "aggregated/subnetworks"]}) == \
+        ["/compute/v1/projects/p/global/networks", "/compute/v1/projects/p/aggregated/subnetworks"]
+    assert get_call_urls("p", {'api_name': "container", 'calls': ["locations/-/clusters"]}) == \
+        ["/v1/projects/p/locations/-/clusters"]
+    assert get_call_urls("p", {'api_name': "sqladmin", 'calls': ["instances"]}) == \
+        ["https://sqladmin.googleapis.com/v1/projects/p/instances"]
+    for url in get_call_urls("p", {'api_name': "container", 'calls': ["locations/-/clusters"]}):
+        assert parse_api_url(url)[:2] == ("container", "https://container.googleapis.com/v1/projects/p/locations/-/clusters")
+
+
+def test_parse_api_url_query_string():
+
+    _ = parse_api_url("https://serviceusage.googleapis.com/v1/projects/p/services?filter=state:ENABLED")
+    assert _ == ("serviceusage", "https://serviceusage.googleapis.com/v1/projects/p/services",
+                 {'filter': "state:ENABLED"})
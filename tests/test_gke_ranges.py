@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+import gke_ranges
+from gke_ranges import RangeAllocations, get_range_allocations
+
+
+def subnet(name: str, num_services_ranges: int, region: str = "us-central1", purpose: str = "PRIVATE"):
+
+    secondary_ranges = [{'name': f"gke-services-{i}", 'range': f"10.{i}.0.0/24"} for i in range(num_services_ranges)]
+    secondary_ranges.append({'name': "gke-pods", 'range': "10.100.0.0/16"})
+    return SimpleNamespace(key=f"host/{region}/{name}", name=name, region=region, project_id="host",
+                           network_name="vpc", cidr_range="10.0.0.0/24", purpose=purpose,
+                           secondary_ranges=secondary_ranges)
+
+
+def cluster(name: str, subnet_name: str, services_range: str, region: str = "us-central1"):
+
+    return SimpleNamespace(id=f"service/{region}/{name}", subnet_key=f"host/{region}/{subnet_name}",
+                           services_range=services_range)
+
+
+def get_allocated(allocations: RangeAllocations) -> dict:
+
+    return {(_['subnet_key'].split('/')[-1], _['range_name']): _['gke_cluster'] for _ in allocations.get_range_data()
+            if _['gke_cluster'] != "FREE"}
+
+
+def test_only_private_subnets_and_services_ranges():
+
+    subnets = [subnet("a", 2), subnet("proxy", 2, purpose="REGIONAL_MANAGED_PROXY"), subnet("b", 0)]
+    allocations = RangeAllocations(subnets)
+    assert list(allocations.ranges) == ["host/us-central1/a", "host/us-central1/b"]
+    assert list(allocations.ranges["host/us-central1/a"]) == ["gke-services-0", "gke-services-1"]
+    assert allocations.ranges["host/us-central1/b"] == {}
+
+
+def test_update_applies_changes():
+
+    allocations = RangeAllocations([subnet("a", 3)])
+    allocations.update([cluster("c1", "a", "gke-services-0"), cluster("c2", "a", "gke-services-1"),
+                        cluster("other", "a", "gke-pods"), cluster("elsewhere", "z", "gke-services-0")])
+    assert get_allocated(allocations) == {("a", "gke-services-0"): "c1", ("a", "gke-services-1"): "c2"}
+
+    # c1 is deleted, c2 moves to another range, and c3 is created
+    allocations.update([cluster("c2", "a", "gke-services-2"), cluster("c3", "a", "gke-services-0")])
+    assert get_allocated(allocations) == {("a", "gke-services-0"): "c3", ("a", "gke-services-2"): "c2"}
+    assert allocations.clusters == {
+        "service/us-central1/c2": ("host/us-central1/a", "gke-services-2"),
+        "service/us-central1/c3": ("host/us-central1/a", "gke-services-0"),
+    }
+
+    # Two clusters swapping ranges
+    allocations.update([cluster("c2", "a", "gke-services-0"), cluster("c3", "a", "gke-services-2")])
+    assert get_allocated(allocations) == {("a", "gke-services-0"): "c2", ("a", "gke-services-2"): "c3"}
+
+    # An unchanged version is skipped
+    allocations.update([], version=1)
+    allocations.update([cluster("c4", "a", "gke-services-1")], version=1)
+    assert get_allocated(allocations) == {}
+
+
+def test_plan_picks_tightest_fit():
+
+    allocations = RangeAllocations([subnet("a", 4), subnet("b", 2), subnet("c", 8, region="us-east1")])
+    allocations.update([cluster("c1", "a", "gke-services-0")])
+    _ = allocations.plan("us-central1", 2)
+    assert (_['subnet_name'], _['num_free_ranges'], _['ip_ranges_services']) == \
+        ("b", 2, ["gke-services-0", "gke-services-1"])
+    _ = allocations.plan("us-central1", 3)
+    assert (_['subnet_name'], _['ip_ranges_services']) == ("a", ["gke-services-1", "gke-services-2", "gke-services-3"])
+    assert allocations.plan("us-central1", 4) is None
+    assert allocations.plan("us-east1", 8)['subnet_name'] == "c"
+    assert allocations.plan("europe-west1") is None
+
+
+def test_get_range_allocations_rebuilds_on_new_subnets(monkeypatch):
+
+    monkeypatch.setattr(gke_ranges, '_allocations', None)
+    subnets = [subnet("a", 2)]
+    gke_clusters = [cluster("c1", "a", "gke-services-0")]
+    allocations = get_range_allocations(subnets, gke_clusters, 1, 1)
+    assert get_range_allocations(subnets, [], 1, 1) is allocations
+    assert get_allocated(allocations) == {("a", "gke-services-0"): "c1"}
+    assert get_allocated(get_range_allocations(subnets, [], 1, 2)) == {}
+    allocations = get_range_allocations(subnets + [subnet("b", 1)], gke_clusters, 2, 2)
+    assert get_allocated(allocations) == {("a", "gke-services-0"): "c1"}
+    assert "host/us-central1/b" in allocations.ranges
@@ -0,0 +1,189 @@
+import json
+from asyncio import run, Event
+from types import SimpleNamespace
+import pytest
+import inventory_cache
+from inventory_cache import InventoryCache, get_inventory, get_inventory_objects, get_router_statuses, get_enabled_services
+from inventory_cache import start_enabled_services
+from gcp_utils import IncompleteResultsError
+
+CALL = {'calls': ["global/networks"]}
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+
+    _ = InventoryCache(tmp_path.joinpath("inventory.db"))
+    monkeypatch.setattr(inventory_cache, '_cache', _)
+    return _
+
+
+def test_put_and_get(cache):
+
+    cache.put('vpc_networks', {'a': [{'name': "vpc-1"}], 'b': []})
+    entries = cache.get('vpc_networks', ['a', 'c'])
+    assert list(entries) == ['a']
+    assert entries['a']['items'] == [{'name': "vpc-1"}]
+    assert not entries['a']['is_stale']
+    assert cache.get_items('vpc_networks', 'b') == []
+    assert cache.get_staleness('vpc_networks', ['a', 'b', 'c']) == {'a': False, 'b': False}
+
+
+def test_ttl(cache):
+
+    cache.put('vpc_networks', {'a': []})
+    assert cache.get('vpc_networks', ['a'], ttl=-1)['a']['is_stale']
+    assert not cache.get('vpc_networks', ['a'], ttl=60)['a']['is_stale']
+
+
+def test_missing_fields_are_stale(cache):
+
+    cache.put('instances', {'a': [{'name': "vm"}]}, fields=['name', 'networkInterfaces(network)'])
+    assert not cache.get_staleness('instances', ['a'], fields=['networkInterfaces(network)'])['a']
+    assert cache.get_staleness('instances', ['a'], fields=['networkInterfaces(networkIP)'])['a']
+    assert cache.get_staleness('instances', ['a'], fields=None)['a']  # Needs whole items
+    cache.put_json('instances', 'a', "[]")
+    assert not cache.get_staleness('instances', ['a'], fields=['zone'])['a']
+
+
+def test_invalidate(cache):
+
+    cache.put('vpc_networks', {'a': [], 'b': []})
+    cache.put('instances', {'a': []})
+    cache.invalidate('vpc_networks', 'a')
+    assert list(cache.get('vpc_networks')) == ['b']
+    cache.invalidate(project_id='a')
+    assert cache.get('instances') == {}
+    cache.invalidate()
+    assert cache.get('vpc_networks') == {}
+
+
+def test_failed_refresh_keeps_stale_copy(cache, monkeypatch):
+
+    async def get_api_data(session, url, access_token, fields=None):
+        if "/b/" in url:
+            raise IncompleteResultsError(url, 503, "backendError")
+        return [{'name': url.split('/')[-3]}]
+
+    monkeypatch.setattr(inventory_cache, 'get_api_data', get_api_data)
+    cache.put('vpc_networks', {'b': [{'name': "old"}]})
+    _ = run(get_inventory(None, "token", ['a', 'b', 'c'], 'vpc_networks', CALL | {'ttl': -1}))
+    assert _ == {'a': [{'name': "a"}], 'b': [{'name': "old"}], 'c': [{'name': "c"}]}
+    # The failed project isn't overwritten, and a failure with nothing cached gives no entry
+    assert cache.get_items('vpc_networks', 'b') == [{'name': "old"}]
+    cache.invalidate('vpc_networks', 'b')
+    _ = run(get_inventory(None, "token", ['b'], 'vpc_networks', CALL))
+    assert _ == {}
+
+
+def router(name: str, fingerprint: str):
+
+    return SimpleNamespace(key=f"p/us-central1/{name}", name=name, project_id="p", region="us-central1",
+                           fingerprint=fingerprint)
+
+
+def test_router_statuses_cached_by_fingerprint(cache, monkeypatch):
+
+    calls = []
+
+    async def get_api_data(session, url, access_token, fields=None):
+        name = url.split('/')[-2]
+        calls.append(name)
+        if name == "broken":
+            raise RuntimeError("Failed")
+        return [{'name': f"{name}-{len(calls)}"}]
+
+    monkeypatch.setattr(inventory_cache, 'get_api_data', get_api_data)
+    routers = [router("r1", "a"), router("r2", "a"), router("broken", "a")]
+    first = _ = run(get_router_statuses(None, "token", routers))
+    assert sorted(calls) == ["broken", "r1", "r2"]
+    assert set(_) == {"p/us-central1/r1", "p/us-central1/r2"}  # A failed router is left out
+
+    # Only the router whose fingerprint changed is polled again
+    calls.clear()
+    routers[1].fingerprint = "b"
+    _ = run(get_router_statuses(None, "token", routers[:2]))
+    assert calls == ["r2"]
+    assert _["p/us-central1/r1"] == first["p/us-central1/r1"]
+    assert _["p/us-central1/r2"] == [{'name': "r2-1"}]
+    calls.clear()
+    run(get_router_statuses(None, "token", routers[:2], refresh=True))
+    assert sorted(calls) == ["r1", "r2"]
+
+
+def test_enabled_services(cache, monkeypatch):
+
+    async def get_api_data(session, url, access_token, fields=None):
+        if "/b/" in url:
+            return []
+        return [{'config': {'name': "compute.googleapis.com"}}, {'config': {'name': "dns.googleapis.com"}}]
+
+    monkeypatch.setattr(inventory_cache, 'get_api_data', get_api_data)
+    _ = run(get_enabled_services(None, "token", ['a', 'b']))
+    assert _ == {'a': {"compute.googleapis.com", "dns.googleapis.com"}}  # An empty list is never used for pruning
+
+
+class Item:
+
+    def __init__(self, item: dict):
+
+        self.name = item['name']
+
+
+def test_objects_from_stale_copy_when_refresh_fails(cache, monkeypatch):
+
+    async def iter_api_pages(session, url, access_token, fields=None):
+        project_id = url.split('/')[-3]
+        yield json.dumps({'items': [{'name': f"{project_id}-1"}], 'nextPageToken': "2"}).encode()
+        if project_id != 'a':
+            raise IncompleteResultsError(url, 503, "backendError")
+        yield json.dumps({'items': [{'name': f"{project_id}-2"}]}).encode()
+
+    async def get_names(project_ids: list, refresh: bool = True) -> list:
+        _ = await get_inventory_objects(None, "token", project_ids, 'vpc_networks', CALL, Item, refresh)
+        return [item.name for item in _]
+
+    monkeypatch.setattr(inventory_cache, 'iter_api_pages', iter_api_pages)
+    cache.put('vpc_networks', {'b': [{'name': "old"}]})
+    # Nothing from a failed listing is used: b gets its stale copy and c, with nothing cached, gets nothing
+    assert run(get_names(['a', 'b', 'c'])) == ["a-1", "a-2", "old"]
+    assert cache.get_items('vpc_networks', 'a') == [{'name': "a-1"}, {'name': "a-2"}]
+    assert cache.get_items('vpc_networks', 'b') == [{'name': "old"}]
+    assert cache.get('vpc_networks', ['c']) == {}
+    # Fresh entries come from the cache
+    cache.put('vpc_networks', {'c': [{'name': "cached"}]})
+    assert run(get_names(['c'], refresh=False)) == ["cached"]
+
+
+def test_fetches_start_before_every_service_check_finishes(cache, monkeypatch):
+
+    fetched = []
+    b_checked = Event()
+
+    async def get_api_data(session, url, access_token, fields=None):
+        if "/b/" in url:
+            await b_checked.wait()
+            return [{'config': {'name': "dns.googleapis.com"}}]
+        return [{'config': {'name': "compute.googleapis.com"}}]
+
+    async def iter_api_pages(session, url, access_token, fields=None):
+        project_id = url.split('/')[-3]
+        fetched.append(project_id)
+        if project_id == 'a':
+            b_checked.set()  # b's check only finishes once a is being fetched
+        yield json.dumps({'items': [{'name': project_id}]}).encode()
+
+    monkeypatch.setattr(inventory_cache, 'get_api_data', get_api_data)
+    monkeypatch.setattr(inventory_cache, 'iter_api_pages', iter_api_pages)
+
+    async def main():
+        services = await start_enabled_services(None, "token", ['a', 'b'])
+
+        async def is_enabled(project_id: str) -> bool:
+            return "compute.googleapis.com" in await services[project_id]
+
+        return await get_inventory_objects(None, "token", ['a', 'b'], 'vpc_networks', CALL, Item, True, is_enabled)
+
+    assert [item.name for item in run(main())] == ["a"]
+    assert fetched == ['a']  # b was pruned once its check arrived
+    assert cache.get_items('enabled_services', 'b') == [{'config': {'name': "dns.googleapis.com"}}]
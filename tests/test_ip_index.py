@@ -0,0 +1,86 @@
+from ipaddress import IPv4Address, IPv4Network
+from random import Random
+from ip_index import IPIndex
+
+
+def make_index(random: Random) -> tuple[IPIndex, list, list]:
+
+    networks = ["0.0.0.0/0", "10.0.0.0/8"]
+    for _ in range(300):
+        prefix_length = random.randint(12, 30)
+        networks.append(str(IPv4Network((random.randint(0x0A000000, 0x0AFFFFFF), prefix_length), strict=False)))
+    addresses = [str(IPv4Address(random.randint(0x0A000000, 0x0AFFFFFF))) for _ in range(2000)]
+    ip_index = IPIndex()
+    for i, cidr_range in enumerate(networks):
+        ip_index.add_network(cidr_range, {'id': i, 'cidr_range': cidr_range})
+    for i, ip_address in enumerate(addresses):
+        ip_index.add_address(ip_address, {'id': i, 'ip_address': ip_address})
+    ip_index.sort()
+    return ip_index, networks, addresses
+
+
+def test_lookup_matches_brute_force():
+
+    random = Random(1)
+    ip_index, networks, addresses = make_index(random)
+    assert len(ip_index) == len(networks) + len(set(addresses))
+    for ip_address in random.sample(addresses, 200) + ["10.0.0.1", "192.168.0.1"]:
+        _ = ip_index.lookup(ip_address)
+        expected = [n for n in networks if IPv4Address(ip_address) in IPv4Network(n)]
+        assert sorted(e['cidr_range'] for e in _['networks']) == sorted(expected)
+        # Longest prefix match first
+        prefix_lengths = [IPv4Network(e['cidr_range']).prefixlen for e in _['networks']]
+        assert prefix_lengths == sorted(prefix_lengths, reverse=True)
+        assert [e['ip_address'] for e in _['addresses']] == [ip_address] * addresses.count(ip_address)
+
+
+def test_search_matches_brute_force():
+
+    random = Random(2)
+    ip_index, networks, addresses = make_index(random)
+    for cidr_range in random.sample(networks, 100) + ["10.0.0.0/8", "172.16.0.0/12"]:
+        search = IPv4Network(cidr_range)
+        _ = ip_index.search(cidr_range)
+        within = [n for n in networks if IPv4Network(n).subnet_of(search)]
+        covering = [n for n in networks if search.subnet_of(IPv4Network(n)) and IPv4Network(n) != search]
+        assert sorted(e['cidr_range'] for e in _['networks']) == sorted(within)
+        assert sorted(e['cidr_range'] for e in _['covering_networks']) == sorted(covering)
+        assert sorted(e['ip_address'] for e in _['addresses']) == sorted(a for a in addresses if IPv4Address(a) in search)
+
+
+def test_query():
+
+    ip_index = IPIndex()
+    ip_index.add_network("10.0.0.0/24", {'name': "subnet"})
+    ip_index.add_address("10.0.0.5", {'name': "vm"})
+    assert ip_index.query("10.0.0.5")['addresses'] == [{'name': "vm"}]
+    assert ip_index.query("10.0.0.0/25")['covering_networks'] == [{'name': "subnet"}]
+    assert ip_index.query("10.0.0.0/16")['networks'] == [{'name': "subnet"}]
+
+
+def test_rows_without_an_address_are_not_indexed(monkeypatch):
+
+    from asyncio import run
+    from types import SimpleNamespace
+    import ip_addresses
+    from ip_index import get_report
+
+    async def get_router_statuses(session, access_token, cloud_routers, refresh=False):
+        return {}
+
+    def forwarding_rule(name: str, ip_address: str | None):
+        return SimpleNamespace(name=name, project_id="p", region="r", network_key="p/vpc", network_name="vpc",
+                               ip_address=ip_address)
+
+    monkeypatch.setattr(ip_addresses, 'get_router_statuses', get_router_statuses)
+    network_data = {k: [] for k in ('instances', 'cloud_routers', 'gke_clusters', 'cloud_sqls')}
+    network_data['forwarding_rules'] = [forwarding_rule("no-ip", None), forwarding_rule("lb", "192.0.2.10")]
+    rows = run(ip_addresses.get_report([], network_data))
+    assert [(_['name'], _['ip_address']) for _ in rows] == [("lb", "192.0.2.10"), ("no-ip", None)]
+
+    subnet = SimpleNamespace(name="s", project_id="p", region="r", network_key="p/vpc", network_name="vpc",
+                             subnet_key="p/r/s", cidr_range="192.0.2.0/24", secondary_ranges=[])
+    ip_index = run(get_report([], network_data | {'subnetworks': [subnet]}))
+    assert len(ip_index) == 2
+    assert [_['name'] for _ in ip_index.search("192.0.2.0/24")['addresses']] == ["lb"]
+    assert ip_index.lookup("192.0.2.0")['addresses'] == []
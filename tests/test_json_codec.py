@@ -0,0 +1,35 @@
+import json
+import pytest
+from benchmark_json import make_aggregated_instances
+from gcp_classes import Instance
+from json_codec import loads, dumps, get_typed_loads
+
+
+def to_dict(instance: Instance) -> dict:
+
+    return instance.to_dict() | {'nics': [nic.to_dict() for nic in instance.nics]}
+
+
+def test_loads_and_dumps():
+
+    _ = {'name': "vm", 'labels': {'env': "prod"}, 'ports': ["80", "443"], 'canIpForward': False, 'id': 12}
+    assert loads(dumps(_)) == _
+    assert loads(json.dumps(_).encode()) == _
+
+
+def test_typed_page_builds_the_same_objects():
+
+    pytest.importorskip('msgspec')
+    page = make_aggregated_instances(num_instances=200)
+    typed_loads = get_typed_loads('items', 'instances', is_aggregated=True)
+    typed, untyped = typed_loads(page), json.loads(page)
+    assert typed.get('nextPageToken') == untyped.get('nextPageToken')
+    for zone, scope in untyped['items'].items():
+        expected = [to_dict(Instance(item)) for item in scope.get('instances', [])]
+        assert [to_dict(Instance(item)) for item in typed['items'][zone].get('instances', [])] == expected
+
+
+def test_no_typed_loads_without_structs():
+
+    assert get_typed_loads('items', 'subnetworks') is None
+    assert get_typed_loads(None, 'instances') is None
@@ -0,0 +1,37 @@
+from collections import Counter
+from random import Random
+from types import SimpleNamespace
+from network_index import NetworkIndex
+
+
+def make_items(n: int) -> list:
+
+    random = Random(1)
+    return [SimpleNamespace(name=f"item-{i}", network_key=random.choice(("p/a", "p/b", None)),
+                            project_id=random.choice(("p", "q")), region=random.choice(("r1", "r2")))
+            for i in range(n)]
+
+
+def test_get_and_count_match_scans():
+
+    items = make_items(500)
+    index = NetworkIndex(items)
+    assert len(index) == 500 and list(index) == items
+    for value in ("p/a", "p/b", None, "p/c"):
+        expected = [_ for _ in items if _.network_key == value]
+        assert index.get('network_key', value) == expected
+        assert index.count('network_key', value) == len(expected)
+    # Items without an indexed attribute are indexed under None
+    assert index.get('subnet_key', None) == items
+
+
+def test_filter_and_group_by():
+
+    items = make_items(500)
+    index = NetworkIndex(items)
+    filtered = index.filter(lambda _: _.region == "r1")
+    assert list(filtered) == [_ for _ in items if _.region == "r1"]
+    assert filtered.get('project_id', "q") == [_ for _ in items if _.region == "r1" and _.project_id == "q"]
+    assert index.group_by('project_id') == Counter(_.project_id for _ in items)
+    assert index.group_by('name')['item-3'] == 1
+    assert index.group_by('project_id', 'region') == Counter((_.project_id, _.region) for _ in items)
@@ -0,0 +1,81 @@
+from asyncio import run, create_task, sleep
+import json
+import pytest
+import parsing
+from benchmark_json import make_aggregated_instances
+from gcp_classes import Instance
+from parsing import parse_items, parse_json, get_page_items, to_record, from_record, close_parse_pool
+from parsing import PARSE_BATCH_SIZE
+
+
+class Item:
+
+    def __init__(self, item: dict):
+
+        self.name = item['name']
+
+
+@pytest.fixture(params=[0, 1], ids=["inline", "pool"])
+def workers(request, monkeypatch):
+
+    monkeypatch.setattr(parsing, 'PARSE_WORKERS', request.param)
+    yield request.param
+    close_parse_pool()
+
+
+def test_parse_items_keeps_order():
+
+    items = [{'name': str(i)} for i in range(PARSE_BATCH_SIZE * 2 + 1)]
+    assert [_.name for _ in run(parse_items(Item, items))] == [_['name'] for _ in items]
+
+
+def test_parsing_gives_way_to_other_tasks():
+
+    async def main():
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(1)
+                await sleep(0)
+
+        task = create_task(ticker())
+        await sleep(0)
+        ticks.clear()
+        await parse_items(Item, [{'name': str(i)} for i in range(PARSE_BATCH_SIZE * 4)])
+        task.cancel()
+        return len(ticks)
+
+    assert run(main()) >= 4
+
+
+def test_get_page_items():
+
+    page = {'items': {'zones/a': {'instances': [1, 2]}, 'zones/b': {'warning': {}}, 'zones/c': {'instances': [3]}}}
+    assert get_page_items(page, "items", "instances") == [1, 2, 3]
+    assert get_page_items({'items': [1, 2], 'nextPageToken': "x"}, "items") == [1, 2]
+    assert get_page_items({'name': "x"}) == [{'name': "x"}]
+    assert get_page_items([1, 2], "items", "instances") == [1, 2]
+
+
+def test_records_rebuild_objects():
+
+    items = json.loads(make_aggregated_instances(num_instances=4))['items']['zones/us-central1-a']['instances']
+    instance = Instance(items[0])
+    _ = from_record(to_record(instance))
+    assert type(_) is Instance and type(_.nics[0]) is type(instance.nics[0])
+    assert str(_) == str(instance)
+    assert _.nics[0].to_dict() == instance.nics[0].to_dict()
+
+
+def test_parse_json(workers):
+
+    page = make_aggregated_instances(num_instances=10)
+    items_json, instances = run(parse_json(Instance, page, "items", "instances"))
+    assert [_.name for _ in instances] == [_['name'] for _ in get_page_items(json.loads(page), "items", "instances")]
+    assert instances[0].nics[0].ip_address == "10.0.0.0"
+    assert json.loads(items_json)[0]['name'] == "instance-00000"
+    # A JSON list, such as a cached entry, is the items, and doesn't come back
+    _ = run(parse_json(Instance, items_json))
+    assert _[0] is None and [str(i) for i in _[1]] == [str(i) for i in instances]
+    assert [_.name for _ in run(parse_json(Item, items_json))[1]] == [_.name for _ in instances]
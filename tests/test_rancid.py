@@ -0,0 +1,24 @@
+from rancid import get_signature, compare_signatures
+
+
+def test_signature_uses_fingerprint():
+
+    item = {'id': "1", 'creationTimestamp': "2024-05-01T10:11:12.345-07:00", 'fingerprint': "abc", 'name': "vpc"}
+    assert get_signature(item) == get_signature(item | {'description': "changed"})
+    assert get_signature(item) != get_signature(item | {'fingerprint': "def"})
+
+
+def test_signature_without_fingerprint_hashes_item():
+
+    item = {'name': "route", 'priority': 1000, 'tags': ["a", "b"]}
+    assert get_signature(item) == get_signature(dict(reversed(item.items())))
+    assert get_signature(item) != get_signature(item | {'priority': 900})
+
+
+def test_compare_signatures():
+
+    previous = {'a': "1", 'b': "2", 'c': "3"}
+    current = {'a': "1", 'b': "20", 'd': "4"}
+    assert compare_signatures(previous, current) == {'added': ["d"], 'changed': ["b"], 'deleted': ["c"]}
+    assert compare_signatures(previous, previous) == {}
+    assert compare_signatures({}, current) == {'added': ["a", "b", "d"]}
@@ -0,0 +1,113 @@
+from ipaddress import IPv4Network
+from random import Random
+from types import SimpleNamespace
+import pytest
+import range_allocator
+from range_allocator import RangeAllocator, get_master_range_allocator, ALLOCATION_TTL
+
+
+def cluster(id: str, master_range: str, network_key: str = "host/vpc"):
+
+    return SimpleNamespace(id=id, master_range=master_range, network_key=network_key)
+
+
+def test_allocates_lowest_free_block():
+
+    allocator = RangeAllocator("10.0.0.0/26", 28)
+    assert len(allocator) == 4
+    allocator.reserve("10.0.0.0/28", "a")
+    allocator.reserve("10.0.0.32/28", "c")
+    assert allocator.allocate("b") == "10.0.0.16/28"
+    assert allocator.allocate("d") == "10.0.0.48/28"
+    assert allocator.allocate("e") is None
+    assert allocator.num_free == 0
+    allocator.release("10.0.0.32/28")
+    assert allocator.get_first_free() == "10.0.0.32/28"
+    assert allocator.owners == {0: "a", 1: "b", 3: "d"}
+    assert allocator.allocated == {"10.0.0.16/28": "b", "10.0.0.48/28": "d"}
+
+
+def test_reserve_overlapping_and_outside_ranges():
+
+    allocator = RangeAllocator("10.0.0.0/24", 28)
+    allocator.reserve("10.0.0.0/26")      # Four blocks
+    allocator.reserve("10.0.0.70/32")     # Part of a block uses all of it
+    allocator.reserve("192.168.0.0/28")   # Outside the pool
+    assert allocator.num_free == 16 - 5
+    assert not allocator.is_free("10.0.0.64/28")
+    assert allocator.is_free("10.0.0.80/28")
+    assert allocator.get_first_free() == "10.0.0.80/28"
+
+
+def test_pool_smaller_than_block():
+
+    with pytest.raises(AssertionError):
+        RangeAllocator("10.0.0.0/30", 28)
+
+
+def test_matches_brute_force():
+
+    random = Random(1)
+    allocator = RangeAllocator("10.0.0.0/20", 28)
+    blocks = list(IPv4Network("10.0.0.0/20").subnets(new_prefix=28))
+    used = set()
+    for _ in range(2000):
+        block = random.choice(blocks)
+        if random.random() < 0.6:
+            allocator.reserve(str(block))
+            used.add(block)
+        else:
+            allocator.release(str(block))
+            used.discard(block)
+        free = [b for b in blocks if b not in used]
+        assert allocator.num_free == len(free)
+        assert allocator.get_first_free() == (str(free[0]) if free else None)
+
+
+def test_master_range_allocator_is_cached_per_version():
+
+    gke_clusters = [cluster("p/r/a", "172.16.0.0/28"), cluster("p/r/b", "172.16.0.16/28", "host/other")]
+    allocator = get_master_range_allocator("172.16.0.0/24", gke_clusters, "host/vpc", version=1)
+    assert allocator.get_first_free() == "172.16.0.16/28"  # Cluster b is in another network
+    assert allocator.allocate("new") == "172.16.0.16/28"
+    assert get_master_range_allocator("172.16.0.0/24", gke_clusters, "host/vpc", version=1) is allocator
+
+    # A new cluster list is rebuilt from, but ranges allocated and not yet in use are carried over
+    gke_clusters.append(cluster("p/r/c", "172.16.0.32/28"))
+    allocator = get_master_range_allocator("172.16.0.0/24", gke_clusters, "host/vpc", version=2)
+    assert allocator.owners == {0: "p/r/a", 1: "new", 2: "p/r/c"}
+    assert allocator.allocate() == "172.16.0.48/28"
+
+
+def test_allocated_ranges_expire(monkeypatch):
+
+    now = [1000.0]
+    monkeypatch.setattr(range_allocator, 'time', lambda: now[0])
+    gke_clusters = [cluster("p/r/a", "172.16.1.0/28")]
+    allocator = get_master_range_allocator("172.16.1.0/24", gke_clusters, version=1)
+    assert allocator.allocate("new") == "172.16.1.16/28"
+    now[0] += ALLOCATION_TTL / 2
+    assert allocator.allocate("newer") == "172.16.1.32/28"
+
+    # Carried over to a rebuild until it expires, keeping the time it was allocated
+    now[0] += ALLOCATION_TTL / 2 + 1
+    allocator = get_master_range_allocator("172.16.1.0/24", gke_clusters, version=2)
+    assert allocator.allocated == {"172.16.1.32/28": "newer"}
+    assert allocator.allocated_at == {"172.16.1.32/28": 1000.0 + ALLOCATION_TTL / 2}
+    assert allocator.get_first_free() == "172.16.1.16/28"
+
+    # Also expired without a rebuild
+    now[0] += ALLOCATION_TTL
+    assert get_master_range_allocator("172.16.1.0/24", gke_clusters, version=2) is allocator
+    assert allocator.allocated == {} and allocator.owners == {0: "p/r/a"}
+
+
+def test_release_allocated_range():
+
+    allocator = RangeAllocator("10.0.0.0/26", 28)
+    allocator.reserve("10.0.0.0/28", "a")
+    assert allocator.allocate("b") == "10.0.0.16/28"
+    allocator.release("10.0.0.16/28")
+    assert allocator.allocated == {}
+    assert allocator.get_first_free() == "10.0.0.16/28"
+    assert allocator.expire(ttl=0) == []
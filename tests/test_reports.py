@@ -0,0 +1,80 @@
+from gcp_utils import merge_fields
+from reports import get_crawl_plan
+
+CALLS = {
+    'instances': {'calls': ["aggregated/instances"]},
+    'forwarding_rules': {'calls': ["aggregated/forwardingRules"], 'fields': ['name', 'IPAddress']},
+    'subnetworks': {'calls': ["aggregated/subnetworks"]},
+}
+
+
+def test_merge_fields():
+
+    assert merge_fields(['name', 'zone'], ['zone', 'selfLink']) == ['name', 'zone', 'selfLink']
+    assert merge_fields(
+        ['networkInterfaces(name,network)'],
+        ['networkInterfaces(networkIP,accessConfigs(natIP))'],
+        ['networkInterfaces(accessConfigs(name))'],
+    ) == ['networkInterfaces(name,network,networkIP,accessConfigs(natIP,name))']
+
+
+def test_merge_fields_whole_field_wins():
+
+    assert merge_fields(['networkInterfaces(name)', 'name'], ['networkInterfaces']) == ['networkInterfaces', 'name']
+    assert merge_fields(['networkInterfaces'], ['networkInterfaces(name)']) == ['networkInterfaces']
+    assert merge_fields(['name'], None) is None
+    assert merge_fields(['a,b(c)']) == ['a', 'b(c)']
+
+
+def test_crawl_plan_merges_report_fields():
+
+    plan = get_crawl_plan(['get_empty_subnets', 'ip_addresses'], CALLS)
+    assert set(plan) == {'instances', 'forwarding_rules', 'subnetworks'}
+    assert plan['instances'] == [
+        'name', 'zone', 'selfLink', 'networkInterfaces(name,networkIP,network,subnetwork,accessConfigs)'
+    ]
+    assert plan['forwarding_rules'] == [
+        'name', 'region', 'selfLink', 'IPAddress', 'loadBalancingScheme', 'network', 'subnetwork'
+    ]
+    assert plan['subnetworks'] is None  # No fields given, so the whole item
+
+
+def test_crawl_plan_falls_back_to_calls_file_fields():
+
+    # dump_network_data has no API_FIELDS, so it gets the calls file's fields, or the whole item if there are none
+    plan = get_crawl_plan(['dump_network_data'], CALLS)
+    assert plan == {'instances': None, 'forwarding_rules': ['name', 'IPAddress'], 'subnetworks': None}
+    plan = get_crawl_plan(['dump_network_data', 'get_empty_subnets'], CALLS)
+    assert plan['instances'] is None
+    _ = get_crawl_plan(['get_empty_subnets'], CALLS)['forwarding_rules']
+    assert plan['forwarding_rules'] == merge_fields(['name', 'IPAddress'], _)
+
+
+def test_crawl_uses_the_shared_session(monkeypatch):
+
+    from asyncio import run
+    import reports
+    from session_pool import get_session, close_session_pool
+
+    sessions = []
+
+    async def start_enabled_services(session, access_token, project_ids, refresh=False):
+        sessions.append(session)
+        return {}
+
+    async def get_inventory_objects(session, access_token, project_ids, resource_type, call, cls, refresh=False,
+                                    is_enabled=None):
+        sessions.append(session)
+        return [resource_type]
+
+    monkeypatch.setattr(reports, 'start_enabled_services', start_enabled_services)
+    monkeypatch.setattr(reports, 'get_inventory_objects', get_inventory_objects)
+
+    async def main():
+        _ = await reports.crawl({'instances': None, 'subnetworks': None}, CALLS, ['p'], "token")
+        assert _ == {'instances': ["instances"], 'subnetworks': ["subnetworks"]}
+        assert all(session is get_session() for session in sessions) and len(sessions) == 3
+        assert not get_session().closed  # Other requests keep using it
+        await close_session_pool()
+
+    run(main())
@@ -0,0 +1,78 @@
+from asyncio import run, create_task, sleep, Event, wait_for
+import pytest
+from snapshots import Dataset
+
+
+class Loader:
+
+    def __init__(self):
+
+        self.calls = 0
+        self.release = Event()
+
+    async def __call__(self) -> list:
+
+        self.calls += 1
+        await self.release.wait()
+        return [self.calls]
+
+
+def test_concurrent_gets_share_one_load():
+
+    async def main():
+        loader = Loader()
+        dataset = Dataset('test', loader)
+        tasks = [create_task(dataset.get()) for _ in range(5)]
+        await sleep(0)
+        loader.release.set()
+        snapshots = [await _ for _ in tasks]
+        assert loader.calls == 1
+        assert all(_ is snapshots[0] for _ in snapshots)
+
+    run(main())
+
+
+def test_cancelled_get_doesnt_cancel_load():
+
+    async def main():
+        loader = Loader()
+        dataset = Dataset('test', loader)
+        first = create_task(dataset.get())
+        second = create_task(dataset.get())
+        await sleep(0)
+        first.cancel()
+        await sleep(0)
+        loader.release.set()
+        snapshot = await wait_for(second, 1)
+        assert snapshot.data == [1]
+        assert first.cancelled()
+
+    run(main())
+
+
+def test_refresh_serves_last_snapshot():
+
+    async def main():
+        loader = Loader()
+        loader.release.set()
+        dataset = Dataset('test', loader)
+        first = await dataset.get()
+        loader.release.clear()
+        assert await dataset.get(refresh=True) is first  # Doesn't wait for the reload
+        loader.release.set()
+        await dataset.refresh()
+        assert (await dataset.get()).data == [2]
+
+    run(main())
+
+
+def test_failed_first_load_raises():
+
+    async def main():
+        async def loader():
+            raise ValueError("no data")
+
+        with pytest.raises(ValueError):
+            await Dataset('test', loader).get()
+
+    run(main())
@@ -0,0 +1,137 @@
+from ipaddress import IPv4Address, IPv4Network
+from random import Random
+from types import SimpleNamespace
+from network_index import NetworkIndex
+from subnet_usage import ip_to_int, get_range_bounds, to_int_array, get_address_arrays, get_subnet_usage
+
+
+def subnet(key: str, cidr_range: str, network_key: str = "host/vpc", secondary_ranges: list = ()):
+
+    return SimpleNamespace(key=key, cidr_range=cidr_range, network_key=network_key,
+                           secondary_ranges=[{'name': f"range-{i}", 'range': _} for i, _ in enumerate(secondary_ranges)])
+
+
+def address(ip_address: str, network_key: str = "host/vpc", subnet_key: str = None):
+
+    return SimpleNamespace(ip_address=ip_address, network_key=network_key, subnet_key=subnet_key)
+
+
+def test_range_bounds():
+
+    assert get_range_bounds("10.0.0.0/24") == (ip_to_int("10.0.0.0"), ip_to_int("10.0.0.255"))
+    assert get_range_bounds("10.0.0.77/30") == (ip_to_int("10.0.0.76"), ip_to_int("10.0.0.79"))
+    assert get_range_bounds("192.168.1.1/32") == (ip_to_int("192.168.1.1"),) * 2
+
+
+def test_to_int_array_is_sorted():
+
+    _ = to_int_array(["10.0.0.9", "9.255.255.255", "10.0.0.1"])
+    assert list(_) == [int(IPv4Address(ip)) for ip in ("9.255.255.255", "10.0.0.1", "10.0.0.9")]
+
+
+def test_reserved_ips_and_secondary_ranges_are_not_counted():
+
+    subnets = [subnet("a", "10.0.0.0/29", secondary_ranges=["10.100.0.0/24"])]
+    nics = get_address_arrays([
+        address("10.0.0.0"),      # Network address
+        address("10.0.0.1"),      # Gateway
+        address("10.0.0.2"),
+        address("10.0.0.3"),
+        address("10.0.0.6"),      # Last two are reserved
+        address("10.0.0.7"),
+        address("10.100.0.5"),    # In a secondary range, not the primary
+        address("10.0.0.4", "other/vpc"),
+        address("fd20::1"),
+        address(None),
+    ])
+    forwarding_rules = get_address_arrays([address("10.0.0.3"), address("10.0.0.5")])
+    _ = get_subnet_usage(subnets, nics, forwarding_rules)['a']
+    assert _['used_ips'] == [2, 2]
+    # Usable IPs are .2 to .5, with .2, .3 and .5 used
+    assert _['largest_free_block'] == 1
+    assert _['fragmentation'] == 0
+
+
+def test_subnets_without_range_or_addresses():
+
+    subnets = [subnet("a", None), subnet("b", "10.0.1.0/24")]
+    usage = get_subnet_usage(subnets, {}, {})
+    assert usage['a'] == {'used_ips': [0, 0], 'largest_free_block': 0, 'fragmentation': 0}
+    assert usage['b'] == {'used_ips': [0, 0], 'largest_free_block': 252, 'fragmentation': 0}
+
+
+def test_matches_brute_force():
+
+    random = Random(1)
+    subnets = []
+    for n in range(3):
+        for i in range(20):
+            subnets.append(subnet(f"vpc{n}/s{i}", f"10.0.{i}.{64 * (n % 4)}/26", f"host/vpc{n}"))
+    addresses = [[], []]
+    for _ in range(3000):
+        s = random.choice(subnets)
+        first, last = get_range_bounds(s.cidr_range)
+        ip_address = str(IPv4Address(random.randint(first, last)))
+        addresses[random.randint(0, 1)].append(address(ip_address, s.network_key))
+
+    usage = get_subnet_usage(subnets, *[get_address_arrays(_) for _ in addresses])
+    for s in subnets:
+        network = IPv4Network(s.cidr_range)
+        usable = range(int(network.network_address) + 2, int(network.broadcast_address) - 1)
+        in_range = [
+            [int(IPv4Address(a.ip_address)) for a in _ if a.network_key == s.network_key and
+             int(IPv4Address(a.ip_address)) in usable] for _ in addresses
+        ]
+        used = set(in_range[0] + in_range[1])
+        largest = run = 0
+        for ip in usable:
+            run = 0 if ip in used else run + 1
+            largest = max(largest, run)
+        free = len(usable) - len(used)
+        assert usage[s.key]['used_ips'] == [len(_) for _ in in_range]
+        assert usage[s.key]['largest_free_block'] == largest
+        assert usage[s.key]['fragmentation'] == (round(1 - largest / free, 3) if free else 0)
+
+
+def test_counts_by_range_match_counts_by_subnet_key():
+
+    subnets = [
+        subnet("vpc/a", "10.0.0.0/24", secondary_ranges=["10.100.0.0/20", "10.101.0.0/24"]),
+        subnet("vpc/b", "10.0.1.0/24", secondary_ranges=["10.102.0.0/20"]),
+        subnet("other/c", "10.0.0.0/24", "host/other"),  # Same range as a, in another network
+    ]
+    nics = [
+        address("10.0.0.2", subnet_key="vpc/a"),
+        address("10.0.0.3", subnet_key="vpc/a"),
+        address("10.0.1.10", subnet_key="vpc/b"),
+        address("10.0.0.2", "host/other", "other/c"),  # Shares an IP with a NIC in a
+        address("10.0.0.9", "host/other", "other/c"),
+    ]
+    forwarding_rules = [
+        address("10.0.0.50", subnet_key="vpc/a"),  # Three rules on one IP, for different ports
+        address("10.0.0.50", subnet_key="vpc/a"),
+        address("10.0.0.50", subnet_key="vpc/a"),
+        address("10.0.1.20", subnet_key="vpc/b"),
+        address("10.0.0.50", "host/other", "other/c"),
+    ]
+
+    def get_old_counts(nics: list, forwarding_rules: list) -> dict:
+        # As check_quotas and get_empty_subnets counted before: by each item's subnet, whatever its IP
+        nics, forwarding_rules = NetworkIndex(nics), NetworkIndex(forwarding_rules)
+        return {s.key: [nics.count('subnet_key', s.key), forwarding_rules.count('subnet_key', s.key)] for s in subnets}
+
+    def get_new_counts(nics: list, forwarding_rules: list) -> dict:
+        usage = get_subnet_usage(subnets, get_address_arrays(nics), get_address_arrays(forwarding_rules))
+        return {k: v['used_ips'] for k, v in usage.items()}
+
+    old = get_old_counts(nics, forwarding_rules)
+    assert old == {'vpc/a': [2, 3], 'vpc/b': [1, 1], 'other/c': [2, 1]}
+    assert get_new_counts(nics, forwarding_rules) == old
+    assert get_subnet_usage(subnets, get_address_arrays(nics))['vpc/a']['largest_free_block'] == 250
+
+    # Where they differ: an item without an IPv4 address is no longer counted, and one with an address in the
+    # range is counted even if its subnet isn't known
+    nics.append(address(None, subnet_key="vpc/b"))
+    forwarding_rules.append(address("10.0.1.30"))
+    assert get_old_counts(nics, forwarding_rules)['vpc/b'] == [2, 1]
+    assert get_new_counts(nics, forwarding_rules)['vpc/b'] == [1, 2]
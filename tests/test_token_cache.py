@@ -0,0 +1,53 @@
+from asyncio import run, create_task, sleep, gather
+from threading import Event
+from time import time
+from types import SimpleNamespace
+from token_cache import TokenProvider, REFRESH_MARGIN
+
+
+class FakeProvider(TokenProvider):
+
+    def __init__(self, lifetime: int = 3600):
+
+        super().__init__()
+        self.lifetime = lifetime
+        self.calls = 0
+        self.release = Event()
+        self.release.set()
+
+    def _refresh(self) -> None:
+
+        self.release.wait(5)
+        self.calls += 1
+        self.credentials = SimpleNamespace(token=f"token-{self.calls}")
+        self.expire_timestamp = int(time()) + self.lifetime
+
+
+def test_token_is_reused_until_close_to_expiry():
+
+    async def main():
+        provider = FakeProvider()
+        assert await provider.get_token() == "token-1"
+        assert await provider.get_token() == "token-1"
+        provider.expire_timestamp = int(time()) + REFRESH_MARGIN - 1
+        assert await provider.get_token() == "token-2"
+        provider._refresher.cancel()
+
+    run(main())
+
+
+def test_concurrent_callers_share_one_refresh():
+
+    async def main():
+        provider = FakeProvider()
+        provider.release.clear()
+        tasks = [create_task(provider.get_token()) for _ in range(5)]
+        await sleep(0.01)
+        tasks[0].cancel()  # Mustn't cancel the refresh the others are waiting on
+        provider.release.set()
+        tokens = await gather(*tasks[1:])
+        assert tokens == ["token-1"] * 4
+        assert provider.calls == 1
+        provider._refresher.cancel()
+
+    run(main())
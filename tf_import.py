@@ -2,7 +2,7 @@
 
 from os import environ
 from asyncio import run
-from aiohttp import ClientSession
+from session_pool import get_session
 from gcp_utils import get_access_token, get_api_data
 
 PROJECT_ID = environ.get("GCP_PROJECT_ID")
@@ -23,7 +23,7 @@ async def main():
     except Exception as e:
         quit(e)
 
-    session = ClientSession(raise_for_status=False)
+    session = get_session()
 
     for resource, call in CALLS.items():
         url = f"/compute/v1/projects/{PROJECT_ID}/{call}"
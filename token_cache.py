@@ -0,0 +1,93 @@
+from asyncio import Task, create_task, get_running_loop, shield, sleep, to_thread
+from datetime import timezone
+from os import environ
+from pathlib import Path
+from time import time
+import google.auth
+import google.auth.transport.requests
+from google.oauth2 import service_account
+
+SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+REFRESH_MARGIN = 300  # Refresh tokens this many seconds before they expire
+RETRY_INTERVAL = 30   # Wait this long before retrying a failed background refresh
+PWD = Path(__file__).parent
+
+
+class TokenProvider:
+
+    def __init__(self, key_file: str = None, quota_project_id: str = None):
+
+        self.key_file = key_file
+        self.quota_project_id = quota_project_id
+        self.credentials = None
+        self.expire_timestamp = 0
+        self._refreshing: Task | None = None
+        self._refresher: Task | None = None
+
+    def _refresh(self) -> None:
+        """
+        Blocking call to mint a new access token; always run in a worker thread
+        """
+        if not self.credentials:
+            if self.key_file:
+                environ.update({'GOOGLE_APPLICATION_CREDENTIALS': self.key_file})
+                self.credentials = service_account.Credentials.from_service_account_file(self.key_file, scopes=SCOPES)
+            else:
+                # Authenticate via ADC
+                self.credentials, _ = google.auth.default(scopes=SCOPES, quota_project_id=self.quota_project_id)
+        self.credentials.refresh(google.auth.transport.requests.Request())
+        if expiry := self.credentials.expiry:
+            # google-auth uses naive datetimes in UTC
+            self.expire_timestamp = int(expiry.replace(tzinfo=timezone.utc).timestamp())
+        else:
+            self.expire_timestamp = int(time()) + 3600
+
+    @property
+    def is_fresh(self) -> bool:
+
+        return bool(self.credentials and self.credentials.token) and time() < self.expire_timestamp - REFRESH_MARGIN
+
+    async def refresh(self) -> None:
+        """
+        Refresh the token off the event loop; concurrent callers share one refresh
+        """
+        loop = get_running_loop()
+        if not self._refreshing or self._refreshing.done() or self._refreshing.get_loop() is not loop:
+            self._refreshing = create_task(to_thread(self._refresh))
+        await shield(self._refreshing)  # A cancelled caller mustn't cancel the refresh that others are waiting on
+
+    async def _refresh_in_background(self) -> None:
+
+        while True:
+            await sleep(max(self.expire_timestamp - REFRESH_MARGIN - time(), 0))
+            try:
+                await self.refresh()
+            except Exception as e:
+                await sleep(RETRY_INTERVAL)
+
+    async def get_token(self) -> str:
+
+        if not self.is_fresh:
+            await self.refresh()
+        loop = get_running_loop()
+        if not self._refresher or self._refresher.done() or self._refresher.get_loop() is not loop:
+            self._refresher = create_task(self._refresh_in_background())
+        return self.credentials.token
+
+
+_providers = {}
+
+
+def get_token_provider(key_file: str = None, quota_project_id: str = None) -> TokenProvider:
+    """
+    Get the process-wide token provider for a key file (or ADCs) and quota project
+    """
+    if key_file:
+        # Convert relative to full path
+        key_file = PWD.joinpath(key_file)
+        assert key_file.exists(), f"JSON key file not found: '{key_file}'"
+        key_file = str(key_file)
+    k = (key_file, quota_project_id)
+    if k not in _providers:
+        _providers[k] = TokenProvider(key_file, quota_project_id)
+    return _providers[k]